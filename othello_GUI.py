@@ -6,8 +6,13 @@ I separated the different methods by the phases of the game.
 """
 
 import othello_logic
+import othello_worker
+import sys
 import tkinter
 
+AI_SECONDS = 2.0 # how long the computer thinks per move
+POLL_MS = 30 # how often to check if the computer has moved
+
 class othello_GUI:
 	def __init__(self):
 		"""
@@ -36,7 +41,7 @@ class othello_GUI:
 
 		self.setup_rowcol()
 
-		self._display.bind("<Configure>", self._help_draw)
+		self._display.bind("<Configure>", self._on_canvas_resized)
 
 		self._root_window.rowconfigure(1, weight = 1)
 		self._root_window.columnconfigure(0, weight = 1)
@@ -45,6 +50,19 @@ class othello_GUI:
 		self._x_pos = 0
 		self._y_pos = 0
 
+		self._cells = None # canvas oval of every square
+		self._lines = []
+		self._shown = [] # color each oval is showing
+		self._geometry = None # canvas size the items are placed for
+		self._layout_pending = False
+		self._help_draw()
+
+		self._computer = 0 # player the computer plays, 0 for none
+		self._ponder = False
+		self._worker = othello_worker.SearchWorker()
+		self._ai_job = None
+		self._root_window.protocol("WM_DELETE_WINDOW", self._on_close)
+
 	################################# CLICKING FUNCTIONS ##################################
 
 	def run_game(self) -> None:
@@ -53,11 +71,21 @@ class othello_GUI:
 		"""
 		self._root_window.mainloop()
 
+	def _on_close(self) -> None:
+		"""
+		Stops the computer's search process and closes the window
+		"""
+		self._worker.close()
+		self._root_window.destroy()
+
 	def _on_canvas_resized(self, event: tkinter.Event) -> None:
 		"""
-		Redraws everything based on fractal values if window is resized
+		Moves everything to fit once the window is done resizing, however
+		many resize events come in before then
 		"""
-		self._draw_everything()
+		if not self._layout_pending:
+			self._layout_pending = True
+			self._display.after_idle(self._layout)
 
 	def _on_button_press(self, event: tkinter.Event) -> None:
 		"""
@@ -77,15 +105,15 @@ class othello_GUI:
 		"""
 		Places a tile and if it works, then it will redraw the board
 		"""
-		display_height = self._display.winfo_height()
-		display_width = self._display.winfo_width()
-		col = int(x/(display_width / self._width)) + 1
-		row = int(y/(display_height / self._height)) + 1
+		if self._othello_game.current_player == self._computer:
+			return # the computer is thinking
+		row, col = self._square_at(x, y)
 		try:
-			self._othello_game.take_turn([row, col])
+			self._othello_game.take_turn([row + 1, col + 1])
 			self._draw_circles(self._othello_game.game)
 			self._update_score_and_turn()
 			self.switch_players_or_end()
+			self._next_turn()
 		except:
 			pass
 
@@ -95,96 +123,168 @@ class othello_GUI:
 		"""
 		Returns true if the player has a valid move
 		"""
-		is_valid_move = False
-		for row in range(self._othello_game.get_rows()):
-			if is_valid_move:
-				break
-
-			for col in range(self._othello_game.get_cols()):
-
-				if len(self._othello_game.placement_is_valid(row, col)) > 0: #if the move is valid
-					is_valid_move = True
-					break
-
-		return is_valid_move
+		return len(self._othello_game.legal_moves()) > 0
 
 	def switch_players_or_end(self) -> bool:
 		"""
 		If there are no valid moves for the player, then switch. If none left for anyone, then end game
 		"""
-		if not self.has_valid_move():
-			self._othello_game.change_player()
+		player = self._othello_game.current_player
+		ended = self._othello_game.pass_or_end()
+		if self._othello_game.current_player != player:
 			self._update_score_and_turn()
 
-			if not self.has_valid_move():
-				self._display.unbind("<Button-1>")
-				self._display_winner()
+		if ended:
+			self._display.unbind("<Button-1>")
+			self._worker.cancel()
+			self._ai_job = None
+			self._display_winner()
+			return True
+		return False
+
+	################################ COMPUTER FUNCTIONS #############################
+
+	def _next_turn(self) -> None:
+		"""
+		Starts the computer's search if it is the computer's turn, or a
+		ponder search on the player's time if pondering is on. The search
+		runs in another process and _poll_computer picks the move up
+		"""
+		game = self._othello_game
+		if self._computer == 0 or not (self.has_valid_move()):
+			return
+		if game.current_player == self._computer:
+			self._ai_job = self._worker.start(game, AI_SECONDS)
+			self.turn_label["text"] = "Turn: {} (thinking)".format(game.get_current_player())
+			self._root_window.after(POLL_MS, self._poll_computer, self._ai_job)
+		elif self._ponder:
+			self._ai_job = None
+			self._worker.start(game, None) # fills the search table, result is never used
+
+	def _poll_computer(self, job: int) -> None:
+		"""
+		Plays the computer's move once its search is done, otherwise checks
+		again later. Does nothing if the search was cancelled
+		"""
+		if job != self._ai_job:
+			return
+		result = self._worker.poll()
+		if result == None:
+			self._root_window.after(POLL_MS, self._poll_computer, job)
+			return
+		self._ai_job = None
+		if result.move != None:
+			self._othello_game.take_turn([result.move[0] + 1, result.move[1] + 1])
+			self._draw_circles(self._othello_game.game)
+		self._update_score_and_turn()
+		if not self.switch_players_or_end():
+			self._next_turn()
+
+	def _restart(self) -> None:
+		"""
+		Cancels the computer's search and goes back to the settings
+		"""
+		self._worker.cancel()
+		self._ai_job = None
+		self._othello_game = None
+		self._settings_frame.destroy()
+		self._display.unbind("<Button-1>")
+		self._display.unbind("<Motion>")
+		self.setup_rowcol()
+		self._help_draw()
 
 	################################ DRAWING FUNCTIONS #############################
+	# The canvas keeps one line per grid line and one oval per square for the
+	# whole game. Moves only recolour the squares that changed, and resizes
+	# only move the items, once per burst of resize events.
+
 	def _draw_everything(self) -> None:
 		"""
-		Redraws all the canvas objects
+		Makes sure the canvas shows the board at its current size and pieces
 		"""
-		self._display.delete(tkinter.ALL)
-
-		self._draw_board()
-		self._draw_circles(self._othello_game.game)
+		if self._cells == None or len(self._cells) != self._height or len(self._cells[0]) != self._width:
+			self._draw_board()
+		self._layout()
+		if self._othello_game != None:
+			self._draw_circles(self._othello_game.game)
 
 	def _draw_board(self) -> None:
 		"""
-		Draws the grid to place the pieces on
+		Deletes everything and creates the grid lines and a hidden oval for
+		every square, placed by _layout
+		"""
+		self._display.delete(tkinter.ALL)
+		self._lines = [self._display.create_line(0, 0, 0, 0, fill = "#000000")
+			for _ in range(self._width + self._height)]
+		self._cells = [[self._display.create_oval(0, 0, 0, 0, state = tkinter.HIDDEN)
+			for _ in range(self._width)] for _ in range(self._height)]
+		self._shown = [[0] * self._width for _ in range(self._height)]
+		self._geometry = None
+
+	def _layout(self) -> None:
+		"""
+		Moves every item to fit the canvas size, if it changed since the
+		last time
 		"""
+		self._layout_pending = False
+		if self._cells == None:
+			return
 		display_width = self._display.winfo_width()
 		display_height = self._display.winfo_height()
-		
-		for vertical in range(1, self._width + 1):
-			self._display.create_line(
-				(vertical / self._width) * display_width, 
-				0,
-				(vertical / self._width) * display_width, 
-				display_height,
-				fill = "#000000")
+		if self._geometry == (display_width, display_height):
+			return
+		self._geometry = (display_width, display_height)
+		cell_width = display_width / self._width
+		cell_height = display_height / self._height
 
+		for vertical in range(1, self._width + 1):
+			self._display.coords(self._lines[vertical - 1],
+				vertical * cell_width, 0, vertical * cell_width, display_height)
 		for horiz in range(1, self._height + 1):
-			self._display.create_line(
-				0, 
-				(horiz / self._height) * display_height, 
-				display_width, 
-				(horiz / self._height) * display_height,
-				fill = "#000000")
+			self._display.coords(self._lines[self._width + horiz - 1],
+				0, horiz * cell_height, display_width, horiz * cell_height)
+
+		w_padding = cell_width / 15
+		h_padding = cell_height / 15
+		for row in range(self._height):
+			for col in range(self._width):
+				self._display.coords(self._cells[row][col],
+					col * cell_width + w_padding, row * cell_height + h_padding,
+					(col + 1) * cell_width - w_padding, (row + 1) * cell_height - h_padding)
 
 	def _draw_circles(self, board: [[int]]) -> None:
 		"""
-		Draws the pieces on the board
+		Recolours the squares whose piece changed since they were last drawn
 		"""
 		for row in range(self._height):
+			shown = self._shown[row]
+			line = board[row]
 			for col in range(self._width):
-				if self._othello_game.game[row][col] != 0:
-					self._draw_piece(row, col, self._othello_game.game[row][col])
-
+				if line[col] != shown[col]:
+					self._draw_piece(row, col, line[col])
 
 	def _draw_piece(self, row: int, col: int, color: int) -> None:
 		"""
-		Draws the peices based on the player's color
+		Shows the square's oval in the player's color, or hides it if empty
 		"""
-		display_width = self._display.winfo_width()
-		display_height = self._display.winfo_height()
-		h_padding = (display_height / self._height) / 15
-		w_padding = (display_width / self._width) / 15
-		row += 1
-		col += 1
-
+		self._shown[row][col] = color
+		if color == 0:
+			self._display.itemconfigure(self._cells[row][col], state = tkinter.HIDDEN)
+			return
 		if color == 2:
 			filler = "white"
 		elif color == 1:
 			filler = "black"
-		self._display.create_oval(
-			(col / self._width) * display_width - (1/self._width) * display_width + w_padding,
-			(row / self._height) * display_height - (1/self._height) * display_height + h_padding, 
-			(col / self._width) * display_width - w_padding,
-			(row / self._height) * display_height - h_padding, 
+		self._display.itemconfigure(self._cells[row][col], state = tkinter.NORMAL,
 			outline = filler, fill = filler)
 
+	def _square_at(self, x: int, y: int) -> (int, int):
+		"""
+		Returns the (row, col) starting at 0 under the canvas point x, y
+		"""
+		display_width, display_height = self._geometry
+		return int(y / (display_height / self._height)), int(x / (display_width / self._width))
+
 
 	############################# INITIATE PHASE 1 SETUP BOARD SETTINGS ############################
 
@@ -206,6 +306,10 @@ class othello_GUI:
 		self._first_setter.set("Black")
 		self._wintype_setter = tkinter.StringVar(self._settings_frame)
 		self._wintype_setter.set("Most")
+		self._computer_setter = tkinter.StringVar(self._settings_frame)
+		self._computer_setter.set("Nobody")
+		self._ponder_setter = tkinter.BooleanVar(self._settings_frame)
+		self._ponder_setter.set(False)
 		self._settings_done = tkinter.Button(self._settings_frame, text = "Done", font = 30,
 			command = self._create_board)
 
@@ -229,12 +333,19 @@ class othello_GUI:
 			self._wintype_setter, "Most", "Least")
 		_wintype_dropdown.grid(row = 1, column = 3,
 			padx = 10, pady = 10)
-		self._settings_done.grid(row = 1, column = 4,
+		tkinter.Label(self._settings_frame, text = "Computer Plays").grid(row = 0, column = 4, padx = 10, sticky = tkinter.S)
+		_computer_dropdown = tkinter.OptionMenu(self._settings_frame,
+			self._computer_setter, "Nobody", "Black", "White")
+		_computer_dropdown.grid(row = 1, column = 4,
+			padx = 10, pady = 10)
+		tkinter.Checkbutton(self._settings_frame, text = "Ponder", variable = self._ponder_setter).grid(
+			row = 1, column = 5, padx = 10, pady = 10)
+		self._settings_done.grid(row = 1, column = 6,
 			padx = 10, pady = 10)
 		self._rows_setter.trace("w", self._help_draw)
 		self._cols_setter.trace("w", self._help_draw)
 
-		for i in range(5):
+		for i in range(7):
 			self._settings_frame.columnconfigure(i, weight = 1)
 
 	def _help_draw(self, *args) -> None:
@@ -243,8 +354,8 @@ class othello_GUI:
 		"""
 		self._height = self._rows_setter.get()
 		self._width = self._cols_setter.get()
-		self._display.delete(tkinter.ALL)
 		self._draw_board()
+		self._layout()
 
 	def _set_first(self) -> str:
 		"""
@@ -273,10 +384,11 @@ class othello_GUI:
 		self._othello_game = othello_logic.Othello(self._rows_setter.get(), 
 			self._cols_setter.get(), self._set_first(), self._set_winstyle(),
 			board)
+		self._computer = {"Nobody": 0, "Black": 1, "White": 2}[self._computer_setter.get()]
+		self._ponder = self._ponder_setter.get()
 
 		self._display.bind("<Motion>", self._mouse_position)
 		self._display.bind("<Button-1>", self._on_button_press_setup)
-		self._display.bind("<Configure>", self._on_canvas_resized)
 		self._settings_frame.destroy()
 		self._setup_pieces()
 
@@ -302,7 +414,7 @@ class othello_GUI:
 		"""
 		for row in range(self._height):
 			for col in range(self._width):
-				self._othello_game.game[row][col] = 0
+				self._othello_game.set_piece(row, col, 0)
 		self._draw_everything()
 
 	def _setup_pieces(self) -> None:
@@ -334,21 +446,18 @@ class othello_GUI:
 		For when the uses presses the button during the setting phase. Gets which button is
 		sunken and places that piece down when mouse is clicked
 		"""
-		display_height = self._display.winfo_height()
-		display_width = self._display.winfo_width()
-		col = int(self._x_pos/(display_width / self._width))
-		row = int(self._y_pos/(display_height / self._height))
+		row, col = self._square_at(self._x_pos, self._y_pos)
 
 		if self._black_setup["relief"] == "sunken":
 			if self._othello_game.game[row][col] == 1:
-				self._othello_game.game[row][col] = 0
+				self._othello_game.set_piece(row, col, 0)
 			else:
-				self._othello_game.game[row][col] = 1
+				self._othello_game.set_piece(row, col, 1)
 		else:
 			if self._othello_game.game[row][col] == 2:
-				self._othello_game.game[row][col] = 0
+				self._othello_game.set_piece(row, col, 0)
 			else:
-				self._othello_game.game[row][col] = 2
+				self._othello_game.set_piece(row, col, 2)
 		self._draw_everything()
 
 	def _start_game(self) -> None:
@@ -358,7 +467,8 @@ class othello_GUI:
 		self._settings_frame.destroy()
 		self._display.bind("<Button-1>", self._on_button_press)
 		self._setup_display()
-		self.switch_players_or_end()
+		if not self.switch_players_or_end():
+			self._next_turn()
 
 	############################### GAME STARTED PHASE 3 #####################################
 	def _setup_display(self) -> None:
@@ -386,6 +496,8 @@ class othello_GUI:
 		self.black_label.grid(row = 0, column = 0, padx = 10, pady = 10)
 		self.white_label.grid(row = 0, column = 1, padx = 10, pady = 10)
 		self.turn_label.grid(row = 0, column = 2, padx = 10, pady = 10)
+		tkinter.Button(self._settings_frame, text = "New Game", font = 30,
+			command = self._restart).grid(row = 0, column = 3, padx = 10, pady = 10)
 
 	def _update_score_and_turn(self) -> None:
 		"""
@@ -411,5 +523,14 @@ class othello_GUI:
 
 
 if __name__ == "__main__":
+	# --stats prints counters and drawing times every few seconds,
+	# --profile saves a cProfile of the whole session to othello_GUI.prof
+	if "--stats" in sys.argv or "--profile" in sys.argv:
+		import othello_stats
+		othello_stats.enable(gui_class = othello_GUI) # this module is __main__ here
+		othello_stats.periodic()
 	test = othello_GUI()
-	test.run_game()
+	if "--profile" in sys.argv:
+		othello_stats.profile(test.run_game, path = "othello_GUI.prof")
+	else:
+		test.run_game()
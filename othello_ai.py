@@ -0,0 +1,337 @@
+"""
+Computer player for othello_logic.Othello. Uses negamax alpha-beta search with
+iterative deepening, so it always has a move ready and stops when it runs out
+of time or nodes. Works with any board size and with either backend
+(Othello or othello_bitboard.BitboardOthello) since it only uses
+legal_moves, apply_move, apply_pass and undo_move.
+"""
+
+import collections
+import time
+
+import othello_endgame
+import othello_tt
+
+WIN_SCORE = 1000000
+
+ENDGAME_EMPTIES = 10 # solve exactly from this many empty squares
+
+# evaluation weights
+DISC_WEIGHT = 1
+MOBILITY_WEIGHT = 5
+CORNER_WEIGHT = 25
+
+SearchResult = collections.namedtuple("SearchResult",
+	["move", "score", "depth", "nodes", "seconds", "nodes_per_second"])
+
+
+_SOLVER = None # one othello_endgame.EndgameSolver per process, made when first needed
+
+
+class _OutOfBudget(Exception):
+	pass
+
+
+def corners(othello) -> [(int, int)]:
+	"""
+	Returns the four corner squares of the board
+	"""
+	last_row = othello.ROWS - 1
+	last_col = othello.COLS - 1
+	return [(0, 0), (0, last_col), (last_row, 0), (last_row, last_col)]
+
+
+def final_score(othello, player: int) -> int:
+	"""
+	Scores a finished game from player's point of view. Wins are worth more
+	than any evaluation, and the margin is added so bigger wins come first.
+	Follows STYLE, so with "<" having fewer pieces is a win
+	"""
+	counts = othello._count_pieces()
+	diff = counts[player - 1] - counts[2 - player]
+	if othello.STYLE == "<":
+		diff = -diff
+	return exact_score(diff)
+
+
+def endgame_solver() -> othello_endgame.EndgameSolver:
+	"""
+	Returns this process's exact endgame solver, making it (and its table) on
+	the first call so searches that never reach the endgame don't pay for it
+	"""
+	global _SOLVER
+	if _SOLVER == None:
+		_SOLVER = othello_endgame.EndgameSolver(othello_endgame.EXACT)
+	return _SOLVER
+
+
+def exact_score(diff: int) -> int:
+	"""
+	Turns a solved disc difference (from othello_endgame) into a search
+	score on the same scale as final_score
+	"""
+	if diff > 0:
+		return WIN_SCORE + diff
+	elif diff < 0:
+		return -WIN_SCORE + diff
+	return 0
+
+
+def discs(score: int) -> int:
+	"""
+	Turns a score of a finished or solved game back into its disc
+	difference, the inverse of exact_score
+	"""
+	if score >= WIN_SCORE:
+		return score - WIN_SCORE
+	elif score <= -WIN_SCORE:
+		return score + WIN_SCORE
+	return score
+
+
+def evaluate(othello, player: int) -> int:
+	"""
+	Heuristic score of an unfinished position from player's point of view.
+	Counts discs and corners (both inverted when STYLE is "<") and mobility
+	"""
+	opponent = 3 - player
+	counts = othello._count_pieces()
+	discs = counts[player - 1] - counts[opponent - 1]
+
+	corner_score = 0
+	for row, col in corners(othello):
+		if othello.game[row][col] == player:
+			corner_score += 1
+		elif othello.game[row][col] == opponent:
+			corner_score -= 1
+
+	material = DISC_WEIGHT * discs + CORNER_WEIGHT * corner_score
+	if othello.STYLE == "<":
+		material = -material
+
+	mobility = len(othello.legal_moves(player)) - len(othello.legal_moves(opponent))
+	return material + MOBILITY_WEIGHT * mobility
+
+
+class AlphaBetaSearch:
+	"""
+	ATTRIBUTES:
+	max_time, seconds allowed per search (None for no limit)
+	max_nodes, nodes allowed per search (None for no limit)
+	max_depth, deepest iteration to try (None searches until the game ends)
+	tt, othello_tt.TranspositionTable to use for cutoffs and ordering (or None)
+	endgame_empties, solve exactly with othello_endgame at or below this many
+	empty squares (0 never does)
+	book, othello_book.Book to answer from before searching (or None)
+	evaluator, evaluator kept up to date move by move, like
+	othello_patterns.PatternEvaluator, used instead of evaluate (or None)
+	stop, function that returns True when the search should end early, like
+	when someone else cancels it (or None)
+	nodes, nodes searched in the current search
+	"""
+
+	CHECK_EVERY = 16 # how many nodes between budget checks
+
+	def __init__(self, max_time=1.0, max_nodes=None, max_depth=None, tt=None,
+			endgame_empties=ENDGAME_EMPTIES, book=None, evaluator=None, stop=None):
+		"""
+		Sets up the budgets, at least one of them should be given. The same tt
+		can be kept between searches so later moves reuse earlier work
+		"""
+		self.max_time = max_time
+		self.max_nodes = max_nodes
+		self.max_depth = max_depth
+		self.tt = tt
+		self.endgame_empties = endgame_empties
+		self.book = book
+		self.evaluator = evaluator
+		self.stop = stop
+		self.nodes = 0
+		self._deadline = None
+		self._corners = set()
+
+	def search(self, othello) -> SearchResult:
+		"""
+		Finds the best move for the current player of othello. The board is
+		changed while searching but is back to how it was when this returns.
+		The move is (row, col) starting at 0, or None if the player has to pass.
+		Positions in the book are answered from it without searching
+		"""
+		start = time.perf_counter()
+		self.nodes = 0
+		if self.book != None:
+			move = self.book.lookup(othello)
+			if move != None:
+				return SearchResult(move, 0, 0, 0, time.perf_counter() - start, 0.0)
+		self._deadline = None if self.max_time == None else start + self.max_time
+		self._corners = set(corners(othello))
+		if self.evaluator != None:
+			self.evaluator.reset(othello)
+		if self.tt != None:
+			self.tt.new_search()
+
+		moves = list(othello.legal_moves())
+		best_move = None
+		best_score = 0
+		depth_done = 0
+
+		empties = othello_endgame.empties(othello)
+		if len(moves) == 1:
+			best_move = moves[0]
+		elif moves and empties <= self.endgame_empties:
+			try:
+				solved = endgame_solver().solve(othello, self.stop)
+			except othello_endgame.Stopped:
+				self.nodes = endgame_solver().nodes
+				best_move = self._order(moves, None)[0]
+			else:
+				self.nodes = solved.nodes
+				best_move = solved.move
+				best_score = exact_score(solved.score)
+				depth_done = empties
+		elif moves:
+			best_move = self._order(moves, None)[0]
+			last_depth = empties if self.max_depth == None else min(self.max_depth, empties)
+
+			for depth in range(1, last_depth + 1):
+				try:
+					best_move, best_score = self._search_root(othello, moves, depth, best_move)
+				except _OutOfBudget:
+					break
+				depth_done = depth
+				if abs(best_score) >= WIN_SCORE:
+					break # the result is already decided
+
+		seconds = time.perf_counter() - start
+		return SearchResult(best_move, best_score, depth_done, self.nodes, seconds,
+			self.nodes / seconds if seconds > 0 else 0.0)
+
+	def _order(self, moves: [(int, int)], best) -> [(int, int)]:
+		"""
+		Orders moves with corners first, then the previous iteration's best
+		"""
+		return sorted(moves, key = lambda move: (move not in self._corners, move != best))
+
+	def _search_root(self, othello, moves: [(int, int)], depth: int, best) -> ((int, int), int):
+		"""
+		Searches every root move to depth and returns the best move and score
+		"""
+		alpha = -WIN_SCORE * 2
+		beta = WIN_SCORE * 2
+		best_move = None
+		for move in self._order(moves, best):
+			record = self._apply(othello, move)
+			try:
+				score = -self._negamax(othello, depth - 1, -beta, -alpha, False)
+			finally:
+				self._undo(othello, record)
+			if best_move == None or score > alpha:
+				alpha = score
+				best_move = move
+		return best_move, alpha
+
+	def _negamax(self, othello, depth: int, alpha: int, beta: int, passed: bool) -> int:
+		"""
+		Returns the score of the position for the player to move
+		"""
+		self.nodes += 1
+		if self.nodes % self.CHECK_EVERY == 0:
+			self._check_budget()
+
+		player = othello.current_player
+		if depth <= 0:
+			if othello.board_is_full():
+				return final_score(othello, player)
+			if self.evaluator != None:
+				return self.evaluator.evaluate(othello, player)
+			return evaluate(othello, player)
+
+		key = othello.get_hash()
+		original_alpha = alpha
+		best = None
+		if self.tt != None:
+			entry = self.tt.probe(key)
+			if entry != None:
+				score, entry_depth, flag, move = entry
+				if move != othello_tt.NO_MOVE:
+					best = (move // othello.COLS, move % othello.COLS)
+				if entry_depth >= depth:
+					if flag == othello_tt.EXACT:
+						return score
+					elif flag == othello_tt.LOWER and score >= beta:
+						return score
+					elif flag == othello_tt.UPPER and score <= alpha:
+						return score
+
+		moves = othello.legal_moves()
+		if not moves:
+			if passed:
+				return final_score(othello, player)
+			record = othello.apply_pass()
+			try:
+				return -self._negamax(othello, depth, -beta, -alpha, True)
+			finally:
+				othello.undo_move(record)
+
+		best_move = None
+		for move in self._order(moves, best):
+			record = self._apply(othello, move)
+			try:
+				score = -self._negamax(othello, depth - 1, -beta, -alpha, False)
+			finally:
+				self._undo(othello, record)
+			if score > alpha:
+				alpha = score
+				best_move = move
+				if alpha >= beta:
+					break
+
+		if self.tt != None:
+			if alpha <= original_alpha:
+				flag = othello_tt.UPPER
+			elif alpha >= beta:
+				flag = othello_tt.LOWER
+			else:
+				flag = othello_tt.EXACT
+			move = othello_tt.NO_MOVE if best_move == None else best_move[0] * othello.COLS + best_move[1]
+			self.tt.store(key, alpha, depth, flag, move)
+		return alpha
+
+	def _apply(self, othello, move: (int, int)) -> ("undo record"):
+		"""
+		Makes move on othello and tells the evaluator about it
+		"""
+		record = othello.apply_move(move[0], move[1])
+		if self.evaluator != None:
+			self.evaluator.played(record)
+		return record
+
+	def _undo(self, othello, record: "undo record") -> None:
+		"""
+		Takes back a move made by _apply
+		"""
+		othello.undo_move(record)
+		if self.evaluator != None:
+			self.evaluator.undone(record)
+
+	def _check_budget(self) -> None:
+		"""
+		Raises _OutOfBudget if the search used up its time or nodes, or was
+		told to stop
+		"""
+		if self.max_nodes != None and self.nodes >= self.max_nodes:
+			raise _OutOfBudget
+		if self._deadline != None and time.perf_counter() >= self._deadline:
+			raise _OutOfBudget
+		if self.stop != None and self.stop():
+			raise _OutOfBudget
+
+
+def find_move(othello, max_time=1.0, max_nodes=None, max_depth=None, tt=None,
+		endgame_empties=ENDGAME_EMPTIES, book=None, evaluator=None) -> SearchResult:
+	"""
+	Searches othello's position with the given budgets and returns the result,
+	or the book move if book has one
+	"""
+	return AlphaBetaSearch(max_time, max_nodes, max_depth, tt, endgame_empties, book,
+		evaluator).search(othello)
@@ -0,0 +1,409 @@
+"""
+Whole-game analysis. Replays finished games move by move through
+Othello.take_turn, searches every position with othello_ai and compares the
+move that was played with the best one found, flagging the ones that lost
+the most. Each game keeps one transposition table for all of its positions,
+so every search starts from what the searches before it left behind.
+
+Every analysed move comes out as one JSON line as soon as it is done,
+followed by a summary line per game:
+
+	{"type": "move", "file", "game", "ply", "player": "B" or "W", "move",
+	 "best", "score", "played_score", "loss", "flag", "depth", "exact",
+	 "nodes"}
+	{"type": "game", "file", "game", "moves", "loss": {"B", "W"},
+	 "flags": {"B", "W"}, "nodes", "seconds"}
+
+Scores are othello_ai scores for the player to move, so won endgames are
+worth more than WIN_SCORE. Positions with EXACT_EMPTIES empty squares or
+fewer are solved exactly for both the best and the played move, the rest
+are searched to the same depth for both, so the two are always scored the
+same way. loss is how much worse the played move scored than the best one,
+with won and lost scores turned back into disc differences first so it is
+never counted in WIN_SCORE. flag is "best", "ok", "inaccuracy", "mistake" or
+"blunder" (any move that throws away a won game is a blunder).
+
+Game files are othello_records binary files or JSON lines from
+othello_selfplay. Several files are analysed at once, one per worker
+process, with a progress line on stderr every few seconds.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import othello_ai
+import othello_bitboard
+import othello_endgame
+import othello_patterns
+import othello_records
+import othello_tt
+
+DEPTH = 6
+TT_MB = 16
+EXACT_EMPTIES = othello_ai.ENDGAME_EMPTIES # solve positions with this many empty squares or fewer
+
+# losses at least this big get flagged, in othello_ai evaluation points
+INACCURACY = 10
+MISTAKE = 25
+BLUNDER = 50
+
+FLAGS = ["best", "ok", "inaccuracy", "mistake", "blunder"]
+
+_WORKER = {}
+
+
+############################## READING ##########################
+
+def read_games(path: str) -> "iterator of othello_records.Game":
+	"""
+	Yields the games of an othello_records file or an othello_selfplay JSON
+	lines file, telling them apart by the othello_records header
+	"""
+	with open(path, "rb") as file:
+		binary = file.read(len(othello_records.MAGIC)) == othello_records.MAGIC
+	if binary:
+		with othello_records.GameReader(path) as reader:
+			yield from reader
+		return
+	with open(path) as file:
+		for line in file:
+			if line.strip():
+				yield othello_patterns._as_game(json.loads(line))
+
+
+############################## ANALYSIS ##########################
+
+def flag(loss: int, best_score: int, played_score: int) -> str:
+	"""
+	Returns how bad a move was from how much it lost
+	"""
+	if best_score >= othello_ai.WIN_SCORE and played_score < othello_ai.WIN_SCORE:
+		return "blunder"
+	if loss <= 0:
+		return "best"
+	if loss >= BLUNDER:
+		return "blunder"
+	if loss >= MISTAKE:
+		return "mistake"
+	if loss >= INACCURACY:
+		return "inaccuracy"
+	return "ok"
+
+
+def value(search: othello_ai.AlphaBetaSearch, othello, depth: int) -> (int, bool):
+	"""
+	Returns (score, exact) of the position for the player to move, searched
+	depth plies deep. Passes and finished games are scored here since
+	search() has no move to give for them
+	"""
+	player = othello.current_player
+	if not othello.legal_moves():
+		if not othello.legal_moves(3 - player):
+			return othello_ai.final_score(othello, player), True
+		record = othello.apply_pass()
+		try:
+			score, exact = value(search, othello, depth)
+		finally:
+			othello.undo_move(record)
+		return -score, exact
+	if depth <= 0:
+		return othello_ai.evaluate(othello, player), False
+
+	moves = othello.legal_moves()
+	if len(moves) == 1:
+		# search() answers forced moves without searching, so look past it
+		move = next(iter(moves))
+		record = othello.apply_move(move[0], move[1])
+		try:
+			score, exact = value(search, othello, depth - 1)
+		finally:
+			othello.undo_move(record)
+		return -score, exact
+
+	search.max_depth = depth
+	result = search.search(othello)
+	return result.score, result.depth >= othello_endgame.empties(othello)
+
+
+def solved(search: othello_ai.AlphaBetaSearch, othello) -> ((int, int), int):
+	"""
+	Returns the best move and exact score of the position for the player to
+	move, solved with othello_ai's endgame solver. Its nodes are added to
+	search's total
+	"""
+	result = othello_ai.endgame_solver().solve(othello)
+	search.nodes_total += result.nodes
+	return result.move, othello_ai.exact_score(result.score)
+
+
+def analyse_game(game: othello_records.Game, search: othello_ai.AlphaBetaSearch, depth: int = DEPTH,
+		where: dict = None, exact_empties: int = EXACT_EMPTIES) -> "iterator of dictionaries":
+	"""
+	Replays game through take_turn and yields a move line for every move
+	(passes are skipped), then the game's summary line. where is copied into
+	every line to say which file and game it was. Positions with
+	exact_empties empty squares or fewer are solved, the rest searched depth
+	plies deep
+	"""
+	where = where or {}
+	start = time.perf_counter()
+	othello = othello_records.start_position(game, othello_bitboard.BitboardOthello)
+	if search.tt != None:
+		search.tt.clear()
+	# search() would solve positions near the end exactly while their parent
+	# was only searched to depth, so solving is left to the exact branch
+	search.endgame_empties = 0
+	losses = {"B": 0, "W": 0}
+	flags = {"B": {name: 0 for name in FLAGS}, "W": {name: 0 for name in FLAGS}}
+	nodes = 0
+	moves = 0
+
+	for ply, move in enumerate(game.moves):
+		if move == None:
+			othello.change_player()
+			continue
+		player = "B" if othello.current_player == 1 else "W"
+
+		nodes_before = search.nodes_total
+		legal = othello.legal_moves()
+		if othello_endgame.empties(othello) <= exact_empties:
+			best, best_score = solved(search, othello)
+			if tuple(move) == best:
+				played_score = best_score
+			else:
+				record = othello.apply_move(move[0], move[1])
+				try:
+					played_score = -solved(search, othello)[1]
+				finally:
+					othello.undo_move(record)
+			searched = othello_endgame.empties(othello)
+			exact = True
+		elif len(legal) == 1:
+			best = move
+			best_score, exact = value(search, othello, depth)
+			played_score = best_score
+			searched = depth
+		else:
+			search.max_depth = depth
+			result = search.search(othello)
+			best = result.move
+			best_score = result.score
+			searched = result.depth
+			exact = result.depth >= othello_endgame.empties(othello)
+			if tuple(move) == best:
+				played_score = best_score
+			else:
+				# the played move one ply shallower, so it is searched to the
+				# same depth as the best move was
+				record = othello.apply_move(move[0], move[1])
+				try:
+					played_score, _ = value(search, othello, result.depth - 1 if not exact else depth)
+				finally:
+					othello.undo_move(record)
+				played_score = -played_score
+		search_nodes = search.nodes_total - nodes_before
+
+		loss = max(0, othello_ai.discs(best_score) - othello_ai.discs(played_score))
+		name = flag(loss, best_score, played_score)
+		losses[player] += loss
+		flags[player][name] += 1
+		nodes += search_nodes
+		moves += 1
+		yield dict(where, type = "move", ply = ply, player = player, move = list(move), best = list(best),
+			score = best_score, played_score = played_score, loss = loss, flag = name, depth = searched,
+			exact = exact, nodes = search_nodes)
+
+		othello.take_turn([move[0] + 1, move[1] + 1])
+
+	yield dict(where, type = "game", moves = moves, loss = losses, flags = flags, nodes = nodes,
+		seconds = time.perf_counter() - start)
+
+
+class _CountingSearch(othello_ai.AlphaBetaSearch):
+	"""
+	AlphaBetaSearch that also keeps a running total of nodes over every
+	search, so work done in value() gets counted too
+
+	ATTRIBUTES:
+	nodes_total, nodes searched since it was made
+	"""
+
+	def __init__(self, **kwargs):
+		"""
+		Sets up the search with the total at zero
+		"""
+		super().__init__(**kwargs)
+		self.nodes_total = 0
+
+	def search(self, othello) -> othello_ai.SearchResult:
+		"""
+		Runs AlphaBetaSearch.search and adds its nodes to the total
+		"""
+		result = super().search(othello)
+		self.nodes_total += result.nodes
+		return result
+
+
+def make_search(max_time=None, tt_mb: float = TT_MB) -> _CountingSearch:
+	"""
+	Returns the search analyse_game uses, with a table of tt_mb megabytes.
+	max_time limits each search in seconds, None lets it finish its depth
+	"""
+	return _CountingSearch(max_time = max_time, tt = othello_tt.TranspositionTable(tt_mb))
+
+
+############################## PARALLEL FILES ##########################
+
+def _worker_init(results, depth: int, max_time, tt_mb: float) -> None:
+	"""
+	Runs once in every worker process to keep its search and where to send
+	lines
+	"""
+	_WORKER["results"] = results
+	_WORKER["depth"] = depth
+	_WORKER["search"] = make_search(max_time, tt_mb)
+
+
+def _analyse_file(path: str) -> None:
+	"""
+	Analyses every game of a file inside a worker process, sending each line
+	back as soon as it is made
+	"""
+	results = _WORKER["results"]
+	try:
+		for number, game in enumerate(read_games(path)):
+			try:
+				for line in analyse_game(game, _WORKER["search"], _WORKER["depth"], {"file": path, "game": number}):
+					results.put(("line", line))
+			except othello_records.othello_logic.InvalidMoveError:
+				results.put(("line", {"type": "error", "file": path, "game": number, "error": "illegal move in record"}))
+	except (OSError, ValueError, othello_records.InvalidRecordError) as error:
+		results.put(("line", {"type": "error", "file": path, "error": str(error) or type(error).__name__}))
+	finally:
+		results.put(("done", path))
+
+
+class AnalysisStats:
+	"""
+	ATTRIBUTES:
+	workers, number of worker processes
+	files, files finished out of total_files
+	games, games finished
+	positions, moves analysed
+	nodes, nodes searched
+	seconds, wall clock time of the run so far
+	"""
+
+	def __init__(self, workers: int, total_files: int):
+		"""
+		Starts the counters at zero
+		"""
+		self.workers = workers
+		self.total_files = total_files
+		self.files = 0
+		self.games = 0
+		self.positions = 0
+		self.nodes = 0
+		self.seconds = 0.0
+
+	def to_dict(self) -> dict:
+		"""
+		Returns the stats as a dictionary for printing as JSON
+		"""
+		return {
+			"workers": self.workers,
+			"files": self.files,
+			"total_files": self.total_files,
+			"games": self.games,
+			"positions": self.positions,
+			"nodes": self.nodes,
+			"seconds": self.seconds,
+			"positions_per_second": self.positions / self.seconds if self.seconds > 0 else 0.0,
+			"nodes_per_second": self.nodes / self.seconds if self.seconds > 0 else 0.0,
+		}
+
+	def line(self) -> str:
+		"""
+		Returns a one line progress report
+		"""
+		return "{}/{} files, {} games, {} positions, {:.1f} positions/s, {:.0f} nodes/s".format(
+			self.files, self.total_files, self.games, self.positions,
+			self.positions / self.seconds if self.seconds > 0 else 0.0,
+			self.nodes / self.seconds if self.seconds > 0 else 0.0)
+
+
+def analyse_files(paths: [str], workers: int = None, depth: int = DEPTH, max_time=None,
+		tt_mb: float = TT_MB, stats: AnalysisStats = None) -> "iterator of dictionaries":
+	"""
+	Analyses the files on workers processes (one per core if not given, never
+	more than there are files) and yields every line as soon as a worker
+	sends it. Lines of different files come out interleaved. Fills in stats
+	as it goes if given
+	"""
+	if workers == None:
+		workers = multiprocessing.cpu_count()
+	workers = max(1, min(workers, len(paths)))
+	start = time.perf_counter()
+	results = multiprocessing.Queue()
+
+	with multiprocessing.Pool(workers, _worker_init, (results, depth, max_time, tt_mb)) as pool:
+		pool.map_async(_analyse_file, paths, chunksize = 1)
+		left = len(paths)
+		while left:
+			kind, payload = results.get()
+			if stats != None:
+				stats.seconds = time.perf_counter() - start
+			if kind == "done":
+				left -= 1
+				if stats != None:
+					stats.files += 1
+				continue
+			if stats != None:
+				if payload["type"] == "move":
+					stats.positions += 1
+					stats.nodes += payload["nodes"]
+				elif payload["type"] == "game":
+					stats.games += 1
+			yield payload
+
+
+def main(argv=None) -> None:
+	"""
+	Reads the command line and analyses the files
+	"""
+	parser = argparse.ArgumentParser(description = "Analyses finished Othello games move by move")
+	parser.add_argument("files", nargs = "+", help = "othello_records or othello_selfplay JSON lines files")
+	parser.add_argument("--depth", type = int, default = DEPTH, help = "plies searched for every position")
+	parser.add_argument("--seconds", type = float, default = None, help = "also stop each search after this long")
+	parser.add_argument("--workers", type = int, default = None)
+	parser.add_argument("--tt-mb", type = float, default = TT_MB, help = "table size of every worker")
+	parser.add_argument("--output", default = "-", help = "output file, - for stdout")
+	parser.add_argument("--every", type = float, default = 5.0, help = "seconds between progress lines")
+	args = parser.parse_args(argv)
+
+	missing = [path for path in args.files if not os.path.exists(path)]
+	if missing:
+		parser.error("no such file: " + ", ".join(missing))
+
+	stats = AnalysisStats(max(1, min(args.workers or multiprocessing.cpu_count(), len(args.files))), len(args.files))
+	output = sys.stdout if args.output == "-" else open(args.output, "w")
+	last_report = time.perf_counter()
+	try:
+		for line in analyse_files(args.files, args.workers, args.depth, args.seconds, args.tt_mb, stats):
+			output.write(json.dumps(line) + "\n")
+			output.flush()
+			if time.perf_counter() - last_report >= args.every:
+				print(stats.line(), file = sys.stderr, flush = True)
+				last_report = time.perf_counter()
+	finally:
+		if output is not sys.stdout:
+			output.close()
+	print(json.dumps(stats.to_dict()), file = sys.stderr)
+
+
+if __name__ == "__main__":
+	main()
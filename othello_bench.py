@@ -0,0 +1,402 @@
+"""
+Benchmarks for the engine hot paths. Times placement_is_valid,
+_direction_is_valid, _make_move, legal_moves, _count_pieces and board_is_full
+on fixed opening, midgame and endgame positions, plus random games and perft
+node counts, for every board size and both backends. Positions and games come
+from fixed seeds so two runs measure the same work.
+
+	python othello_bench.py run --output new.json
+	python othello_bench.py compare old.json new.json --threshold 0.1
+
+compare exits with status 1 if anything got slower by more than the
+threshold, or if a perft count changed.
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import othello_bitboard
+import othello_logic
+
+ENGINES = {
+	"list": othello_logic.Othello,
+	"bitboard": othello_bitboard.BitboardOthello,
+}
+
+# how full the board is for each position set
+POSITION_SETS = {
+	"opening": 0.15,
+	"midgame": 0.5,
+	"endgame": 0.85,
+}
+
+ALL_SIZES = [(rows, cols) for rows in range(4, 17, 2) for cols in range(4, 17, 2)]
+
+
+def make_positions(rows: int, cols: int, fullness: float, count: int, seed: int) -> [([[str]], str)]:
+	"""
+	Returns count (setup board, player to move) pairs made by playing random
+	games from the start until the board is fullness full or the game ends
+	"""
+	rng = random.Random(seed * 1000003 + rows * 17 + cols)
+	positions = []
+	while len(positions) < count:
+		othello = othello_bitboard.BitboardOthello(rows, cols, "B", ">",
+			othello_logic.starting_board(rows, cols))
+		target = int(rows * cols * fullness)
+		while sum(othello._count_pieces()) < target:
+			moves = sorted(othello.legal_moves())
+			if not moves:
+				if not othello.legal_moves(3 - othello.current_player):
+					break
+				othello.apply_pass()
+				continue
+			othello.apply_move(*rng.choice(moves))
+		board = [[othello.REFER[cell] for cell in line] for line in othello.game]
+		positions.append((board, "B" if othello.current_player == 1 else "W"))
+	return positions
+
+
+def perft(othello, depth: int, passed: bool = False) -> (int, int):
+	"""
+	Walks the game tree depth plies deep and returns (leaves, nodes), where
+	a forced pass counts as a ply and a finished game counts as one leaf
+	"""
+	if depth == 0:
+		return 1, 1
+	moves = othello.legal_moves()
+	if not moves:
+		if passed:
+			return 1, 1
+		record = othello.apply_pass()
+		leaves, nodes = perft(othello, depth - 1, True)
+		othello.undo_move(record)
+		return leaves, nodes + 1
+
+	leaves = 0
+	nodes = 1
+	for row, col in moves:
+		record = othello.apply_move(row, col)
+		below = perft(othello, depth - 1)
+		othello.undo_move(record)
+		leaves += below[0]
+		nodes += below[1]
+	return leaves, nodes
+
+
+def _measure(setup, run, repeat: int) -> (int, int, int):
+	"""
+	Calls run(setup()) repeat times and returns (operations, best time in
+	nanoseconds, peak bytes allocated by one extra run under tracemalloc)
+	"""
+	best = None
+	ops = 0
+	for _ in range(repeat):
+		state = setup()
+		start = time.perf_counter_ns()
+		ops = run(state)
+		elapsed = time.perf_counter_ns() - start
+		if best == None or elapsed < best:
+			best = elapsed
+
+	state = setup()
+	tracemalloc.start()
+	tracemalloc.reset_peak()
+	run(state)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return ops, best, peak
+
+
+def _result(name: str, engine: str, rows: int, cols: int, position_set: str,
+		ops: int, nanoseconds: int, peak: int, **extra) -> dict:
+	"""
+	Packs one measurement into the dictionary written to the JSON output
+	"""
+	result = {
+		"name": name,
+		"engine": engine,
+		"size": "{}x{}".format(rows, cols),
+		"set": position_set,
+		"ops": ops,
+		"ns_per_op": nanoseconds / ops if ops else 0.0,
+		"ops_per_sec": ops * 1e9 / nanoseconds if nanoseconds else 0.0,
+		"peak_bytes": peak,
+	}
+	result.update(extra)
+	return result
+
+
+############################## POSITION BENCHMARKS ##########################
+
+def _bench_placement(engines) -> int:
+	"""
+	Times placement_is_valid on every square, returns the number of calls
+	"""
+	count = 0
+	for othello in engines:
+		for row in range(othello.ROWS):
+			for col in range(othello.COLS):
+				othello.placement_is_valid(row, col)
+				count += 1
+	return count
+
+def _bench_direction(engines) -> int:
+	"""
+	Times _direction_is_valid in every direction from every empty square,
+	returns the number of calls
+	"""
+	count = 0
+	for othello in engines:
+		for row in range(othello.ROWS):
+			for col in range(othello.COLS):
+				if othello.game[row][col] != 0:
+					continue
+				for dir1, dir2 in othello_bitboard.DIRECTIONS:
+					othello._direction_is_valid(row, col, dir1, dir2)
+					count += 1
+	return count
+
+def _prepare_make_move(engines) -> [("Othello", "legal moves and their flips")]:
+	"""
+	Finds every legal move and its flips before the timer starts
+	"""
+	return [(othello, [(move, othello._flips_or_raise(*move)) for move in othello.legal_moves()])
+		for othello in engines]
+
+def _bench_make_move(prepared) -> int:
+	"""
+	Times _make_move on every legal move, undoing each so the position is
+	reused, returns the number of calls
+	"""
+	count = 0
+	for othello, moves in prepared:
+		player = othello.current_player
+		for (row, col), flips in moves:
+			othello._make_move(row, col)
+			othello.undo_move(((row, col), flips, player))
+			count += 1
+	return count
+
+def _bench_legal_moves(engines) -> int:
+	"""
+	Times legal_moves once per position, returns the number of calls
+	"""
+	for othello in engines:
+		othello.legal_moves()
+	return len(engines)
+
+def _bench_count_pieces(engines) -> int:
+	"""
+	Times _count_pieces 1000 times per position, returns the number of calls
+	"""
+	for othello in engines:
+		for _ in range(1000):
+			othello._count_pieces()
+	return 1000 * len(engines)
+
+def _bench_board_is_full(engines) -> int:
+	"""
+	Times board_is_full 1000 times per position, returns the number of calls
+	"""
+	for othello in engines:
+		for _ in range(1000):
+			othello.board_is_full()
+	return 1000 * len(engines)
+
+def _as_is(engines):
+	"""
+	Nothing to prepare
+	"""
+	return engines
+
+# name: (untimed preparation, timed benchmark)
+POSITION_BENCHMARKS = {
+	"placement_is_valid": (_as_is, _bench_placement),
+	"direction_is_valid": (_as_is, _bench_direction),
+	"make_move": (_prepare_make_move, _bench_make_move), # includes the undo that puts the position back
+	"legal_moves": (_as_is, _bench_legal_moves),
+	"count_pieces": (_as_is, _bench_count_pieces),
+	"board_is_full": (_as_is, _bench_board_is_full),
+}
+
+
+def run_benchmarks(sizes: [(int, int)], engines: [str], positions: int = 8, games: int = 4,
+		perft_depth: int = 3, repeat: int = 3, seed: int = 0, progress=None) -> dict:
+	"""
+	Runs every benchmark and returns the results ready to be saved as JSON.
+	progress, if given, is called with each result as it is measured
+	"""
+	results = []
+
+	def add(result: dict) -> None:
+		"""
+		Keeps a result and reports it
+		"""
+		results.append(result)
+		if progress != None:
+			progress(result)
+
+	for rows, cols in sizes:
+		sets = {name: make_positions(rows, cols, fullness, positions, seed)
+			for name, fullness in POSITION_SETS.items()}
+
+		for engine_name in engines:
+			engine = ENGINES[engine_name]
+
+			for set_name, boards in sets.items():
+				for bench_name, (prepare, bench) in POSITION_BENCHMARKS.items():
+					def setup(boards = boards, prepare = prepare):
+						"""
+						Builds the set's positions fresh for each run
+						"""
+						return prepare([engine(rows, cols, player, ">", board) for board, player in boards])
+					ops, nanoseconds, peak = _measure(setup, bench, repeat)
+					add(_result(bench_name, engine_name, rows, cols, set_name, ops, nanoseconds, peak))
+
+			def play_games(_) -> int:
+				"""
+				Plays seeded random games through take_turn, returns the moves made
+				"""
+				moves = 0
+				for game in range(games):
+					rng = random.Random(seed + game)
+					othello = engine(rows, cols, "B", ">", othello_logic.starting_board(rows, cols))
+					while True:
+						legal = sorted(othello.legal_moves())
+						if not legal:
+							if not othello.legal_moves(3 - othello.current_player):
+								break
+							othello.change_player()
+							continue
+						row, col = rng.choice(legal)
+						othello.take_turn([row + 1, col + 1])
+						moves += 1
+				return moves
+			ops, nanoseconds, peak = _measure(lambda: None, play_games, repeat)
+			add(_result("random_game", engine_name, rows, cols, "start", ops, nanoseconds, peak))
+
+			leaves = []
+			def run_perft(othello) -> int:
+				"""
+				Runs perft from the start, returns the nodes visited
+				"""
+				counted = perft(othello, perft_depth)
+				leaves.append(counted[0])
+				return counted[1]
+			start = lambda: engine(rows, cols, "B", ">", othello_logic.starting_board(rows, cols))
+			ops, nanoseconds, peak = _measure(start, run_perft, repeat)
+			add(_result("perft", engine_name, rows, cols, "depth {}".format(perft_depth),
+				ops, nanoseconds, peak, leaves = leaves[0]))
+
+	return {
+		"meta": {
+			"python": platform.python_version(),
+			"platform": platform.platform(),
+			"positions": positions,
+			"games": games,
+			"perft_depth": perft_depth,
+			"repeat": repeat,
+			"seed": seed,
+		},
+		"results": results,
+	}
+
+
+def compare(old: dict, new: dict, threshold: float = 0.1) -> [str]:
+	"""
+	Compares two result files and returns a line for every benchmark that got
+	more than threshold (0.1 is 10%) slower, or whose perft count changed
+	"""
+	def key(result: dict) -> tuple:
+		"""
+		Identifies the same benchmark across files
+		"""
+		return (result["name"], result["engine"], result["size"], result["set"])
+
+	before = {key(result): result for result in old["results"]}
+	problems = []
+	for result in new["results"]:
+		previous = before.get(key(result))
+		if previous == None:
+			continue
+		if "leaves" in result and result["leaves"] != previous.get("leaves"):
+			problems.append("{} {} {} {}: perft leaves {} -> {}".format(*key(result),
+				previous.get("leaves"), result["leaves"]))
+		if previous["ns_per_op"] > 0:
+			change = result["ns_per_op"] / previous["ns_per_op"] - 1
+			if change > threshold:
+				problems.append("{} {} {} {}: {:.1f} -> {:.1f} ns/op (+{:.0%})".format(*key(result),
+					previous["ns_per_op"], result["ns_per_op"], change))
+	return problems
+
+
+def _parse_sizes(text: str) -> [(int, int)]:
+	"""
+	Turns "8x8,6x10" into [(8, 8), (6, 10)], "all" into every size
+	"""
+	if text == "all":
+		return ALL_SIZES
+	sizes = []
+	for size in text.split(","):
+		rows, cols = size.lower().split("x")
+		sizes.append((int(rows), int(cols)))
+	return sizes
+
+
+def main(argv=None) -> int:
+	"""
+	Reads the command line and runs or compares benchmarks, returns the
+	exit status
+	"""
+	parser = argparse.ArgumentParser(description = "Benchmarks the Othello engine hot paths")
+	commands = parser.add_subparsers(dest = "command", required = True)
+
+	run = commands.add_parser("run", help = "run the benchmarks")
+	run.add_argument("--sizes", type = _parse_sizes, default = ALL_SIZES, help = "like 8x8,6x10 or all")
+	run.add_argument("--engines", default = ",".join(ENGINES), help = "like list,bitboard")
+	run.add_argument("--positions", type = int, default = 8, help = "positions in each set")
+	run.add_argument("--games", type = int, default = 4, help = "random games per size")
+	run.add_argument("--perft-depth", type = int, default = 3)
+	run.add_argument("--repeat", type = int, default = 3, help = "runs of each benchmark, best is kept")
+	run.add_argument("--seed", type = int, default = 0)
+	run.add_argument("--output", default = "-", help = "JSON file, - for stdout")
+
+	check = commands.add_parser("compare", help = "flag slowdowns between two result files")
+	check.add_argument("old")
+	check.add_argument("new")
+	check.add_argument("--threshold", type = float, default = 0.1, help = "0.1 flags anything 10%% slower")
+
+	args = parser.parse_args(argv)
+
+	if args.command == "compare":
+		with open(args.old) as old_file, open(args.new) as new_file:
+			problems = compare(json.load(old_file), json.load(new_file), args.threshold)
+		for problem in problems:
+			print(problem)
+		return 1 if problems else 0
+
+	def progress(result: dict) -> None:
+		"""
+		Prints each result to stderr as it is measured
+		"""
+		print("{name} {engine} {size} {set}: {ns_per_op:.0f} ns/op".format(**result), file = sys.stderr)
+
+	results = run_benchmarks(args.sizes, args.engines.split(","), args.positions, args.games,
+		args.perft_depth, args.repeat, args.seed, progress)
+	text = json.dumps(results, indent = 1)
+	if args.output == "-":
+		print(text)
+	else:
+		with open(args.output, "w") as output:
+			output.write(text + "\n")
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,461 @@
+"""
+Bitboard backend for the Othello logic. Each colour is packed into a single
+python int where square (row, col) is bit row * COLS + col, so legal move
+generation, flipping and counting are done with shifts and masks instead of
+walking the list board one cell at a time.
+
+BitboardOthello is a drop in replacement for othello_logic.Othello. It keeps
+self.game up to date as well, so anything reading the list board (the GUI,
+printing) still works. That also means a walk in one direction
+(_direction_is_valid) is left to the list board, which stops at the first
+square that isn't the opponent's and beats shifting a whole bitboard.
+
+legal_moves finds every move with one legal_mask over the whole board and
+only turns a move's flips into coordinates when that move is looked up.
+"""
+
+import collections.abc
+import random
+
+import othello_logic
+
+# Same order the list implementation walks the directions in, so the flipped
+# tiles come back in the same order
+DIRECTIONS = [(dir1, dir2) for dir1 in range(-1, 2) for dir2 in range(-1, 2)
+	if not (dir1 == 0 and dir2 == 0)]
+
+# one byte per square (0, 1, 2) to "0"/"1" for reading a color's bitboard
+_BLACK_DIGITS = bytes.maketrans(b"\x00\x01\x02", b"010")
+_WHITE_DIGITS = bytes.maketrans(b"\x00\x01\x02", b"001")
+
+_SHIFT_TABLES = {}
+
+
+def shift_table(rows: int, cols: int) -> [("delta", "mask")]:
+	"""
+	Returns a list of (delta, mask) pairs, one for each direction. Shifting a
+	bitboard by delta (left if positive, right if negative) and and-ing it with
+	mask moves every piece one step in that direction without wrapping around
+	the edges of the board
+	"""
+	key = (rows, cols)
+	if key in _SHIFT_TABLES:
+		return _SHIFT_TABLES[key]
+
+	full = (1 << (rows * cols)) - 1
+	first_col = 0
+	last_col = 0
+	for row in range(rows):
+		first_col |= 1 << (row * cols)
+		last_col |= 1 << (row * cols + cols - 1)
+
+	table = []
+	for dir1, dir2 in DIRECTIONS:
+		mask = full
+		if dir2 == 1:
+			mask &= ~first_col # moving right can't land in the first column
+		elif dir2 == -1:
+			mask &= ~last_col # moving left can't land in the last column
+		table.append((dir1 * cols + dir2, mask))
+
+	_SHIFT_TABLES[key] = table
+	return table
+
+
+def legal_mask(own: int, opp: int, empty: int, table: [("delta", "mask")]) -> int:
+	"""
+	Returns a bitboard of every empty square where the owner of own would flip
+	at least one of opp's pieces
+	"""
+	moves = 0
+	for delta, mask in table:
+		between = mask & opp
+		if delta > 0:
+			run = (own << delta) & between
+			while True:
+				grown = run | ((run << delta) & between)
+				if grown == run:
+					break
+				run = grown
+			moves |= (run << delta) & mask
+		else:
+			delta = -delta
+			run = (own >> delta) & between
+			while True:
+				grown = run | ((run >> delta) & between)
+				if grown == run:
+					break
+				run = grown
+			moves |= (run >> delta) & mask
+	return moves & empty
+
+
+def flipped_tiles(row: int, col: int, own: int, opp: int, cols: int,
+		table: [("delta", "mask")]) -> ["tuples of coordinates"]:
+	"""
+	Returns the tiles flipped if the owner of own plays on the empty square
+	row, col, walking the directions in the same order as the list board
+	"""
+	index = row * cols + col
+	tiles = []
+	for (dir1, dir2), (delta, mask) in zip(DIRECTIONS, table):
+		if delta > 0:
+			step = (1 << (index + delta)) & mask
+			if not step & opp:
+				continue
+			count = 0
+			while step & opp:
+				count += 1
+				step = (step << delta) & mask
+		else:
+			step = (1 << index >> -delta) & mask
+			if not step & opp:
+				continue
+			count = 0
+			while step & opp:
+				count += 1
+				step = (step >> -delta) & mask
+		if step & own:
+			tiles.extend([(row + dir1 * distance, col + dir2 * distance) for distance in range(1, count + 1)])
+	return tiles
+
+
+def flip_mask(square: int, own: int, opp: int, table: [("delta", "mask")]) -> int:
+	"""
+	Returns the bitboard of every piece flipped if the owner of own plays on
+	the square (a single bit), 0 if the move is not legal
+	"""
+	result = 0
+	for delta, mask in table:
+		flipped = 0
+		if delta > 0:
+			step = (square << delta) & mask
+			while step & opp:
+				flipped |= step
+				step = (step << delta) & mask
+		else:
+			step = (square >> -delta) & mask
+			while step & opp:
+				flipped |= step
+				step = (step >> -delta) & mask
+		if step & own:
+			result |= flipped
+	return result
+
+
+def bits_to_squares(bits: int, cols: int) -> ["tuples of coordinates"]:
+	"""
+	Returns the (row, col) of every set bit, lowest bit first
+	"""
+	squares = []
+	while bits:
+		low = bits & -bits
+		index = low.bit_length() - 1
+		squares.append((index // cols, index % cols))
+		bits ^= low
+	return squares
+
+
+class LegalMoves(collections.abc.Mapping):
+	"""
+	What BitboardOthello.legal_moves returns: a read only dictionary of
+	every legal square to the tiles that move would flip. The squares come
+	from one legal_mask over the whole board, and a square's tiles are only
+	worked out the first time it is looked up, so callers that only need
+	the moves never pay for them
+
+	ATTRIBUTES:
+	_flips, dictionary (row, col) -> flipped tiles, None until looked up
+	_own, _opp, bitboards of the player and the opponent when it was made
+	_cols, _table, the board's width and shift table
+	"""
+
+	def __init__(self, moves: int, own: int, opp: int, cols: int, table: [("delta", "mask")]):
+		"""
+		Keeps the squares of the moves bitboard and the bitboards to work
+		their tiles out from later
+		"""
+		self._flips = dict.fromkeys(bits_to_squares(moves, cols))
+		self._own = own
+		self._opp = opp
+		self._cols = cols
+		self._table = table
+
+	def __getitem__(self, square: (int, int)) -> ["tuples of coordinates"]:
+		tiles = self._flips[square]
+		if tiles == None:
+			tiles = flipped_tiles(square[0], square[1], self._own, self._opp, self._cols, self._table)
+			self._flips[square] = tiles
+		return tiles
+
+	def __contains__(self, square) -> bool:
+		return square in self._flips
+
+	def __iter__(self):
+		return iter(self._flips)
+
+	def __len__(self) -> int:
+		return len(self._flips)
+
+	def __repr__(self) -> str:
+		return repr(dict(self.items()))
+
+
+class BitboardOthello(othello_logic.Othello):
+	"""
+	ATTRIBUTES:
+	same as Othello, plus
+	_bits, [unused, black bitboard, white bitboard]
+	_full, bitboard with every square of the board set
+	_table, (delta, mask) pairs for shifting in each direction
+	"""
+
+	#################### INIT FUNCTIONS ###############################
+	def _set_board(self, board: [[str]]) -> None:
+		"""
+		Sets the board like Othello does, then packs it into the bitboards
+		"""
+		othello_logic.Othello._set_board(self, board)
+		self._full = (1 << (self.ROWS * self.COLS)) - 1
+		self._table = shift_table(self.ROWS, self.COLS)
+		self._sync_bits()
+
+	def _sync_bits(self) -> None:
+		"""
+		Rebuilds the bitboards from self.game. Only needed if self.game was
+		changed directly instead of through the move functions
+		"""
+		self._recount_pieces()
+		self._rehash()
+		self._bits = [0, 0, 0]
+		for row in range(self.ROWS):
+			for col in range(self.COLS):
+				if self.game[row][col] != 0:
+					self._bits[self.game[row][col]] |= 1 << (row * self.COLS + col)
+
+	def copy(self) -> "BitboardOthello":
+		"""
+		Returns an independent copy of the game, see Othello.copy
+		"""
+		other = othello_logic.Othello.copy(self)
+		other._bits = self._bits[:]
+		return other
+
+	def _restore(self, cells: bytes) -> None:
+		"""
+		Builds the bitboards for from_bytes. Each color's squares are turned
+		into a string of 0s and 1s (last square first) and read as one base 2
+		number, so no Python code runs per square
+		"""
+		self._full = (1 << (self.ROWS * self.COLS)) - 1
+		self._table = shift_table(self.ROWS, self.COLS)
+		self._bits = [0, int(cells.translate(_BLACK_DIGITS)[::-1], 2), int(cells.translate(_WHITE_DIGITS)[::-1], 2)]
+
+	def set_piece(self, row: int, col: int, value: int) -> None:
+		"""
+		Puts value (0 empty, 1 black, 2 white) on the square without checking
+		if it is a legal move, used for setting up the board
+		"""
+		square = 1 << (row * self.COLS + col)
+		self._bits[1] &= ~square
+		self._bits[2] &= ~square
+		if value != 0:
+			self._bits[value] |= square
+		othello_logic.Othello.set_piece(self, row, col, value)
+
+	############################# MOVE VALIDATION ##########################
+
+	def _flip_mask(self, row: int, col: int) -> int:
+		"""
+		Returns the bitboard of tiles flipped if the current player plays at
+		row, col. Assumes the square is on the board
+		"""
+		square = 1 << (row * self.COLS + col)
+		if (self._bits[1] | self._bits[2]) & square:
+			return 0
+		return flip_mask(square, self._bits[self.current_player],
+			self._bits[3 - self.current_player], self._table)
+
+	def placement_is_valid(self, row, col) -> ["tuples of coordinates"]:
+		"""
+		Returns a list of tuples containing the coordinates of the tiles
+		to be flipped, returns empty list if the move is not valid
+		"""
+		if row >= self.ROWS or col >= self.COLS or row < -self.ROWS or col < -self.COLS:
+			raise IndexError # same as indexing past the end of the list board
+		if row < 0 or col < 0:
+			return []
+
+		square = 1 << (row * self.COLS + col)
+		if (self._bits[1] | self._bits[2]) & square:
+			return []
+
+		player = self.current_player
+		return flipped_tiles(row, col, self._bits[player], self._bits[3 - player], self.COLS, self._table)
+
+	def legal_moves(self, player=None) -> {"(row, col)": ["tuples of coordinates"]}:
+		"""
+		Returns a LegalMoves mapping every legal square for the player (the
+		current player if not given) to the tiles that move would flip, which
+		are only worked out for the squares looked up
+		"""
+		if player == None:
+			player = self.current_player
+		own = self._bits[player]
+		opp = self._bits[3 - player]
+		moves = legal_mask(own, opp, self._full & ~(own | opp), self._table)
+		return LegalMoves(moves, own, opp, self.COLS, self._table)
+
+	def _flips_or_raise(self, row, col) -> int:
+		"""
+		Returns the bitboard of tiles the current player would flip by playing
+		at row, col and raises InvalidMoveError if the move is not valid. This
+		is what ends up in the undo records instead of a list of tuples
+		"""
+		if not (0 <= row < self.ROWS and 0 <= col < self.COLS):
+			raise othello_logic.InvalidMoveError
+
+		flipped = self._flip_mask(row, col)
+		if flipped == 0:
+			raise othello_logic.InvalidMoveError
+
+		return flipped
+
+	def _place(self, row, col, flipped: int) -> None:
+		"""
+		Puts the current player's piece on row, col and flips the tiles in the
+		flipped bitboard
+		"""
+		player = self.current_player
+		self._bits[player] |= flipped | (1 << (row * self.COLS + col))
+		self._bits[3 - player] &= ~flipped
+
+		count = flipped.bit_count()
+		self._counts[0] -= 1
+		self._counts[player] += count + 1
+		self._counts[3 - player] -= count
+
+		self.game[row][col] = player
+		self._hash ^= self._keys[0][player][row * self.COLS + col]
+		for flip_row, flip_col in bits_to_squares(flipped, self.COLS):
+			self.game[flip_row][flip_col] = player
+			self._hash ^= self._keys[1][flip_row * self.COLS + flip_col]
+
+	def undo_move(self, record: ("(row, col)", "flipped bitboard", "previous player")) -> None:
+		"""
+		Takes back the move or pass that returned record. Records have to be
+		undone in the reverse order they were made
+		"""
+		square, flipped, player = record
+		if self.current_player != player:
+			self.change_player()
+		if square == None:
+			return
+
+		row, col = square
+		opponent = 3 - player
+		self._bits[player] &= ~(flipped | (1 << (row * self.COLS + col)))
+		self._bits[opponent] |= flipped
+
+		count = flipped.bit_count()
+		self._counts[0] += 1
+		self._counts[player] -= count + 1
+		self._counts[opponent] += count
+
+		self.game[row][col] = 0
+		self._hash ^= self._keys[0][player][row * self.COLS + col]
+		for flip_row, flip_col in bits_to_squares(flipped, self.COLS):
+			self.game[flip_row][flip_col] = opponent
+			self._hash ^= self._keys[1][flip_row * self.COLS + flip_col]
+
+	############################## PLAYING FUNCTIONS ##########################
+
+	def _legal_mask(self, player=None) -> int:
+		"""
+		Returns a bitboard of every square the player (the current player if
+		not given) can play on
+		"""
+		if player == None:
+			player = self.current_player
+		return legal_mask(self._bits[player], self._bits[3 - player],
+			self._full & ~(self._bits[1] | self._bits[2]), self._table)
+
+
+############################## PARITY CHECK ##########################
+
+def _random_board(rows: int, cols: int, rng: random.Random) -> [[str]]:
+	"""
+	Returns a board in the setup format with pieces scattered at random
+	"""
+	return [[rng.choice(".BW") for _ in range(cols)] for _ in range(rows)]
+
+
+def parity_check(games: int = 4, seed: int = 0, sizes=None) -> None:
+	"""
+	Plays random games on every board size (or the (rows, cols) in sizes)
+	with both the list board and the bitboard and raises AssertionError the
+	moment they disagree
+	"""
+	rng = random.Random(seed)
+	if sizes == None:
+		sizes = [(rows, cols) for rows in range(4, 17, 2) for cols in range(4, 17, 2)]
+	for rows, cols in sizes:
+		for game_number in range(games):
+			if game_number % 2 == 0:
+				board = othello_logic.starting_board(rows, cols)
+			else:
+				board = _random_board(rows, cols, rng)
+			first = rng.choice("BW")
+			style = rng.choice("<>")
+			lists = othello_logic.Othello(rows, cols, first, style, board)
+			bits = BitboardOthello(rows, cols, first, style, board)
+			passes = 0
+
+			while passes < 2 and not lists.board_is_full():
+				assert lists.game == bits.game
+				assert lists._count_pieces() == bits._count_pieces()
+				assert lists.board_is_full() == bits.board_is_full()
+				scanned = [sum(line.count(value) for line in lists.game) for value in range(3)]
+				assert lists._counts == scanned and bits._counts == scanned
+				hashed = lists.get_hash()
+				lists._rehash()
+				assert lists.get_hash() == hashed and bits.get_hash() == hashed
+
+				moves = []
+				for row in range(rows):
+					for col in range(cols):
+						flipped = lists.placement_is_valid(row, col)
+						assert flipped == bits.placement_is_valid(row, col)
+						if flipped:
+							moves.append((row, col))
+				assert moves == bits_to_squares(bits._legal_mask(), cols)
+				for player in (1, 2):
+					assert lists.legal_moves(player) == bits.legal_moves(player)
+				assert moves == list(lists.legal_moves())
+
+				if not moves:
+					lists.change_player()
+					bits.change_player()
+					passes += 1
+					continue
+
+				passes = 0
+				row, col = rng.choice(moves)
+				for engine in (lists, bits):
+					before = ([line[:] for line in engine.game], engine._counts[:],
+						engine.current_player, engine.get_hash())
+					record = engine.apply_move(row, col)
+					engine.undo_move(engine.apply_pass())
+					engine.undo_move(record)
+					assert before == (engine.game, engine._counts, engine.current_player, engine.get_hash())
+				lists.take_turn([row + 1, col + 1])
+				bits.take_turn([row + 1, col + 1])
+
+			assert lists.game == bits.game
+			assert lists._count_pieces() == bits._count_pieces()
+			assert lists.find_winner() == bits.find_winner()
+
+
+if __name__ == "__main__":
+	parity_check()
+	print("bitboard matches the list board on every size")
@@ -0,0 +1,412 @@
+"""
+Opening book. Early positions come up in almost every game, so instead of
+searching them again each time the book remembers how each move turned out
+in earlier games (from othello_selfplay or othello_records) or searches.
+
+Positions are stored in a canonical form: the board is turned and mirrored
+by every symmetry of its shape (eight for square boards, four for the rest,
+which can't be turned a quarter) and the smallest result is kept, so all the
+copies of a position share one entry. Moves are stored on the canonical board
+and turned back when looked up.
+
+A book file is MAGIC followed by fixed size entries sorted by key, one per
+(position, move), so lookups binary search a memory map and never read the
+whole book. Books built by separate workers are shards of the same format
+and merge into one with merge(), which streams them and adds up the counts.
+"""
+
+import argparse
+import hashlib
+import heapq
+import itertools
+import json
+import mmap
+import operator
+import os
+import struct
+import sys
+import tempfile
+
+import othello_logic
+import othello_records
+
+MAGIC = b"OTHB\x01"
+ENTRY = struct.Struct("<QHIII") # key, canonical square, wins, draws, losses
+STYLES = {">": 0, "<": 1}
+
+MIN_GAMES = 2 # moves played fewer times than this are not trusted
+
+_SYMMETRIES = {}
+
+
+class InvalidBookError(Exception):
+	pass
+
+
+############################## SYMMETRY ##########################
+
+def symmetries(rows: int, cols: int) -> [("getter", [int], [int])]:
+	"""
+	Returns (getter, gather, scatter) for every symmetry of the board shape.
+	gather[i] is the square that lands on square i, and scatter[i] is where
+	square i goes, so one is the inverse of the other. getter picks the
+	gather squares out of a tuple of cells in one call
+	"""
+	key = (rows, cols)
+	if key not in _SYMMETRIES:
+		transforms = [
+			lambda r, c: (r, c),
+			lambda r, c: (rows - 1 - r, c),
+			lambda r, c: (r, cols - 1 - c),
+			lambda r, c: (rows - 1 - r, cols - 1 - c),
+		]
+		if rows == cols:
+			transforms += [
+				lambda r, c: (c, r),
+				lambda r, c: (cols - 1 - c, r),
+				lambda r, c: (c, rows - 1 - r),
+				lambda r, c: (cols - 1 - c, rows - 1 - r),
+			]
+		result = []
+		for transform in transforms:
+			scatter = [0] * (rows * cols)
+			gather = [0] * (rows * cols)
+			for row in range(rows):
+				for col in range(cols):
+					new_row, new_col = transform(row, col)
+					scatter[row * cols + col] = new_row * cols + new_col
+					gather[new_row * cols + new_col] = row * cols + col
+			result.append((gather, scatter))
+		_SYMMETRIES[key] = [(operator.itemgetter(*gather), gather, scatter) for gather, scatter in result]
+	return _SYMMETRIES[key]
+
+
+def canonical(othello) -> (int, [int], [int]):
+	"""
+	Returns the book key of othello's position with the gather and scatter
+	lists of the symmetry that takes it to the canonical board. The key
+	covers the board size, the player to move and STYLE as well as the pieces
+	"""
+	cells = tuple(itertools.chain.from_iterable(othello.game))
+	best = None
+	for getter, gather, scatter in symmetries(othello.ROWS, othello.COLS):
+		board = getter(cells)
+		if best == None or board < best:
+			best = board
+			best_gather = gather
+			best_scatter = scatter
+	prefix = bytes([othello.ROWS, othello.COLS, othello.current_player, STYLES[othello.STYLE]])
+	digest = hashlib.blake2b(prefix + bytes(best), digest_size = 8).digest()
+	return int.from_bytes(digest, "little"), best_gather, best_scatter
+
+
+############################## BUILDING ##########################
+
+class BookBuilder:
+	"""
+	ATTRIBUTES:
+	plies, only positions this early in a game go in the book
+	entries, dictionary (key, canonical square) -> [wins, draws, losses]
+	"""
+
+	def __init__(self, plies: int = 20):
+		"""
+		Starts an empty book
+		"""
+		self.plies = plies
+		self.entries = {}
+
+	def add(self, othello, move: (int, int), result: int) -> None:
+		"""
+		Counts move in othello's position once, with result 1, 0 or -1 for
+		the player making it
+		"""
+		key, _, scatter = canonical(othello)
+		square = scatter[move[0] * othello.COLS + move[1]]
+		counts = self.entries.setdefault((key, square), [0, 0, 0])
+		counts[1 - result] += 1
+
+	def add_game(self, game) -> None:
+		"""
+		Adds the first plies moves of a finished game, either an
+		othello_records.Game or a record dictionary from othello_selfplay
+		"""
+		if isinstance(game, dict):
+			game = _as_game(game)
+		diff = game.black - game.white
+		if game.style == "<":
+			diff = -diff
+		winner = 0 if diff == 0 else (1 if diff > 0 else 2)
+
+		for ply, othello in othello_records.positions(game):
+			if ply >= min(self.plies, len(game.moves)):
+				break
+			move = game.moves[ply]
+			if move != None:
+				player = othello.current_player
+				self.add(othello, move, 0 if winner == 0 else (1 if winner == player else -1))
+
+	def add_search(self, othello, result) -> None:
+		"""
+		Adds an othello_ai.SearchResult for othello's position, counted as
+		a win, draw or loss by the sign of its score
+		"""
+		if result.move != None:
+			self.add(othello, result.move, (result.score > 0) - (result.score < 0))
+
+	def write(self, path: str) -> int:
+		"""
+		Writes the book sorted by key to path and returns how many entries
+		it has
+		"""
+		with open(path, "wb") as output:
+			output.write(MAGIC)
+			for (key, square), (wins, draws, losses) in sorted(self.entries.items()):
+				output.write(ENTRY.pack(key, square, wins, draws, losses))
+		return len(self.entries)
+
+
+def _as_game(record: dict) -> othello_records.Game:
+	"""
+	Turns an othello_selfplay record (maybe read back from JSON) into a Game
+	"""
+	moves = [None if move == None else tuple(move) for move in record["moves"]]
+	return othello_records.Game(record["rows"], record["cols"], record["first"], record["style"],
+		record.get("setup"), moves, record["black"], record["white"])
+
+
+def _entries(path: str) -> "iterator of entry tuples":
+	"""
+	Reads the entries of a book file in order, a buffer at a time
+	"""
+	with open(path, "rb") as book:
+		if book.read(len(MAGIC)) != MAGIC:
+			raise InvalidBookError(path)
+		while True:
+			data = book.read(ENTRY.size * 4096)
+			if not data:
+				break
+			if len(data) % ENTRY.size:
+				raise InvalidBookError(path)
+			yield from ENTRY.iter_unpack(data)
+
+
+def merge(paths: [str], output_path: str) -> int:
+	"""
+	Merges sorted book shards into one book, adding up the counts of
+	entries they share. Only one buffer per shard is in memory at a time.
+	Returns how many entries the merged book has
+	"""
+	count = 0
+	with open(output_path, "wb") as output:
+		output.write(MAGIC)
+		current = None
+		for key, square, wins, draws, losses in heapq.merge(*[_entries(path) for path in paths]):
+			if current != None and current[:2] == [key, square]:
+				current[2] += wins
+				current[3] += draws
+				current[4] += losses
+				continue
+			if current != None:
+				output.write(ENTRY.pack(*current))
+				count += 1
+			current = [key, square, wins, draws, losses]
+		if current != None:
+			output.write(ENTRY.pack(*current))
+			count += 1
+	return count
+
+
+############################## LOOKUP ##########################
+
+class Book:
+	"""
+	ATTRIBUTES:
+	path, the book file
+	min_games, moves played fewer times than this are ignored
+	"""
+
+	def __init__(self, path: str, min_games: int = MIN_GAMES):
+		"""
+		Memory maps the book, nothing else is read until a lookup
+		"""
+		self.path = path
+		self.min_games = min_games
+		self._file = open(path, "rb")
+		self._data = othello_records._map(self._file)
+		if self._data[:len(MAGIC)] != MAGIC or (len(self._data) - len(MAGIC)) % ENTRY.size:
+			raise InvalidBookError(path)
+
+	def __len__(self) -> int:
+		return (len(self._data) - len(MAGIC)) // ENTRY.size
+
+	def _first(self, key: int) -> int:
+		"""
+		Returns the number of the first entry with a key of at least key
+		"""
+		low = 0
+		high = len(self)
+		while low < high:
+			middle = (low + high) // 2
+			if ENTRY.unpack_from(self._data, len(MAGIC) + middle * ENTRY.size)[0] < key:
+				low = middle + 1
+			else:
+				high = middle
+		return low
+
+	def moves(self, othello) -> {(int, int): (int, int, int)}:
+		"""
+		Returns (wins, draws, losses) for every move the book has for
+		othello's position, keyed by (row, col) on othello's board
+		"""
+		key, gather, _ = canonical(othello)
+		result = {}
+		number = self._first(key)
+		while number < len(self):
+			entry_key, square, wins, draws, losses = ENTRY.unpack_from(self._data,
+				len(MAGIC) + number * ENTRY.size)
+			if entry_key != key:
+				break
+			result[divmod(gather[square], othello.COLS)] = (wins, draws, losses)
+			number += 1
+		return result
+
+	def lookup(self, othello) -> (int, int):
+		"""
+		Returns the book move with the best score (wins plus half the draws
+		over games played) for othello's position, or None if the book has
+		no legal move played at least min_games times. Moves that aren't
+		legal come from a hash collision and are passed over
+		"""
+		legal = othello.legal_moves()
+		best = None
+		best_rank = None
+		for move, (wins, draws, losses) in self.moves(othello).items():
+			games = wins + draws + losses
+			if games < self.min_games or move not in legal:
+				continue
+			rank = ((wins + draws / 2) / games, games)
+			if best == None or rank > best_rank:
+				best = move
+				best_rank = rank
+		return best
+
+	def close(self) -> None:
+		"""
+		Unmaps and closes the book
+		"""
+		if isinstance(self._data, mmap.mmap):
+			self._data.close()
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args) -> None:
+		self.close()
+
+
+############################## COMMAND LINE ##########################
+
+def _read_games(path: str) -> "iterator of games":
+	"""
+	Reads games from an othello_records file or a JSON lines file
+	"""
+	with open(path, "rb") as data:
+		binary = data.read(len(othello_records.MAGIC)) == othello_records.MAGIC
+	if binary:
+		with othello_records.GameReader(path) as reader:
+			yield from reader
+	else:
+		with open(path) as lines:
+			for line in lines:
+				if line.strip():
+					yield json.loads(line)
+
+
+def check(games: int = 40) -> None:
+	"""
+	Raises AssertionError if a position and its mirror images don't share a
+	key and a book move, a built book doesn't give back its moves or a
+	lookup returns an illegal move
+	"""
+	import random
+	import othello_bitboard
+
+	rng = random.Random(0)
+	for rows, cols in [(8, 8), (6, 10), (4, 16)]:
+		builder = BookBuilder(plies = 6)
+		for _ in range(games):
+			othello = othello_logic.Othello(rows, cols, "B", ">", othello_logic.starting_board(rows, cols))
+			moves = []
+			while len(moves) < 6 and othello.legal_moves():
+				move = rng.choice(sorted(othello.legal_moves()))
+				for getter, _, _ in symmetries(rows, cols):
+					cells = getter(tuple(itertools.chain.from_iterable(othello.game)))
+					board = [["."] * cols for _ in range(rows)]
+					for square, value in enumerate(cells):
+						board[square // cols][square % cols] = othello.REFER[value]
+					mirror = othello_bitboard.BitboardOthello(rows, cols, othello.REFER[othello.current_player],
+						">", board)
+					assert canonical(mirror)[0] == canonical(othello)[0]
+				othello.apply_move(*move)
+				moves.append(move)
+			black, white = othello._count_pieces()
+			builder.add_game({"rows": rows, "cols": cols, "first": "B", "style": ">",
+				"moves": moves, "black": black, "white": white})
+
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "book")
+			half = os.path.join(directory, "merged")
+			builder.write(path)
+			merged = merge([path, path], half)
+			assert merged == len(builder.entries)
+			with Book(half) as book:
+				othello = othello_logic.Othello(rows, cols, "B", ">", othello_logic.starting_board(rows, cols))
+				move = book.lookup(othello)
+				assert move in othello.legal_moves()
+				total = sum(sum(counts) for counts in book.moves(othello).values())
+				assert total == 2 * games
+
+			# an illegal move (as from a hash collision) with a better score
+			# is passed over for the legal ones
+			othello = othello_logic.Othello(rows, cols, "B", ">", othello_logic.starting_board(rows, cols))
+			for _ in range(games):
+				builder.add(othello, (0, 0), 1)
+			builder.write(path)
+			with Book(path) as book:
+				assert (0, 0) in book.moves(othello)
+				assert book.lookup(othello) in othello.legal_moves()
+
+
+def main(argv=None) -> None:
+	"""
+	Reads the command line and builds, merges or checks books
+	"""
+	parser = argparse.ArgumentParser(description = "Builds and merges Othello opening books")
+	commands = parser.add_subparsers(dest = "command", required = True)
+	build = commands.add_parser("build", help = "build a book shard from game files")
+	build.add_argument("output")
+	build.add_argument("games", nargs = "+", help = "othello_records or JSON lines files")
+	build.add_argument("--plies", type = int, default = 20)
+	merging = commands.add_parser("merge", help = "merge book shards into one book")
+	merging.add_argument("output")
+	merging.add_argument("shards", nargs = "+")
+	commands.add_parser("check", help = "check symmetries, building and merging")
+	args = parser.parse_args(argv)
+
+	if args.command == "build":
+		builder = BookBuilder(args.plies)
+		for path in args.games:
+			for game in _read_games(path):
+				builder.add_game(game)
+		print(json.dumps({"entries": builder.write(args.output)}), file = sys.stderr)
+	elif args.command == "merge":
+		print(json.dumps({"entries": merge(args.shards, args.output)}), file = sys.stderr)
+	else:
+		check()
+		print("book check passed")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,349 @@
+"""
+Exact endgame solver. Once few enough squares are empty it is cheaper to
+search every line to the end of the game than to guess with an evaluation, so
+this plays perfectly from there. It works on the two bitboards directly
+(see othello_bitboard) instead of an Othello object, because nothing else is
+needed once the game is this close to finished.
+
+Two modes: "exact" finds the final disc difference with best play, and "wld"
+only finds whether the player to move wins, loses or draws, which is faster.
+Scores follow STYLE the same way find_winner does, so with "<" having fewer
+pieces at the end is a win.
+"""
+
+import collections
+import random
+import time
+
+import othello_bitboard
+import othello_logic
+import othello_tt
+
+EXACT = "exact"
+WLD = "wld"
+
+FASTEST_FIRST_EMPTIES = 5 # order by opponent mobility above this many empties
+TT_EMPTIES = 5 # use the transposition table above this many empties
+CHECK_EVERY = 256 # how many nodes between calls to stop
+
+EndgameResult = collections.namedtuple("EndgameResult",
+	["move", "score", "mode", "empties", "nodes", "seconds"])
+
+
+class Stopped(Exception):
+	pass
+
+
+def empties(othello) -> int:
+	"""
+	Returns the number of empty squares of othello
+	"""
+	return othello.ROWS * othello.COLS - sum(othello._count_pieces())
+
+
+def _quadrants(rows: int, cols: int) -> [int]:
+	"""
+	Returns bitboards for the four quarters of the board, used for parity
+	"""
+	result = [0, 0, 0, 0]
+	for row in range(rows):
+		for col in range(cols):
+			quarter = (row >= rows // 2) * 2 + (col >= cols // 2)
+			result[quarter] |= 1 << (row * cols + col)
+	return result
+
+
+class EndgameSolver:
+	"""
+	ATTRIBUTES:
+	mode, EXACT or WLD
+	tt, othello_tt.TranspositionTable for positions with many empties
+	nodes, nodes searched by the last solve
+	"""
+
+	def __init__(self, mode: str = EXACT, tt=None):
+		"""
+		Sets the mode and the table, a small table is made if none is given
+		"""
+		self.mode = mode
+		self.tt = othello_tt.TranspositionTable(4) if tt == None else tt
+		self.nodes = 0
+
+	def solve(self, othello, stop=None) -> EndgameResult:
+		"""
+		Solves the position for othello's current player, who gets the score.
+		move is the best (row, col) starting at 0, or None if the player has
+		to pass or the game is over. Raises Stopped if stop (a function, or
+		None) returns True before the solve is done
+		"""
+		start = time.perf_counter()
+		self.nodes = 0
+		self.tt.new_search()
+		self._stop = stop
+		self._rows = othello.ROWS
+		self._cols = othello.COLS
+		self._table = othello_bitboard.shift_table(othello.ROWS, othello.COLS)
+		self._full = (1 << (othello.ROWS * othello.COLS)) - 1
+		self._quadrants = _quadrants(othello.ROWS, othello.COLS)
+		self._sign = 1 if othello.STYLE == ">" else -1
+
+		own = 0
+		opp = 0
+		for row in range(othello.ROWS):
+			for col in range(othello.COLS):
+				if othello.game[row][col] == othello.current_player:
+					own |= 1 << (row * othello.COLS + col)
+				elif othello.game[row][col] != 0:
+					opp |= 1 << (row * othello.COLS + col)
+
+		limit = othello.ROWS * othello.COLS + 1
+		if self.mode == WLD:
+			alpha, beta = -1, 1
+		else:
+			alpha, beta = -limit, limit
+		move, score = self._root(own, opp, alpha, beta)
+		if self.mode == WLD:
+			score = (score > 0) - (score < 0)
+
+		return EndgameResult(move, score, self.mode, empties(othello), self.nodes,
+			time.perf_counter() - start)
+
+	def _final(self, own: int, opp: int) -> int:
+		"""
+		Scores a finished game for the owner of own
+		"""
+		return self._sign * (own.bit_count() - opp.bit_count())
+
+	def _ordered(self, own: int, opp: int, moves: int, empty: int) -> [(int, int)]:
+		"""
+		Returns (square, flipped) for every move, fastest first (fewest
+		replies for the opponent) when many squares are empty, and moves into
+		quarters with an odd number of empties before the rest
+		"""
+		table = self._table
+		children = []
+		many = empty.bit_count() > FASTEST_FIRST_EMPTIES
+		while moves:
+			square = moves & -moves
+			moves ^= square
+			flipped = othello_bitboard.flip_mask(square, own, opp, table)
+			odd = 0
+			for quarter in self._quadrants:
+				if quarter & square:
+					odd = (quarter & empty).bit_count() & 1
+					break
+			if many:
+				replies = othello_bitboard.legal_mask(opp & ~flipped, own | flipped | square,
+					empty ^ square, table).bit_count()
+			else:
+				replies = 0
+			children.append((replies, -odd, square, flipped))
+		children.sort()
+		return [(square, flipped) for _, _, square, flipped in children]
+
+	def _root(self, own: int, opp: int, alpha: int, beta: int) -> ((int, int), int):
+		"""
+		Searches the root and returns the best move with its score
+		"""
+		empty = self._full & ~(own | opp)
+		moves = othello_bitboard.legal_mask(own, opp, empty, self._table)
+		if not moves:
+			return None, self._search(own, opp, alpha, beta, False)
+
+		best = None
+		for square, flipped in self._ordered(own, opp, moves, empty):
+			score = -self._search(opp & ~flipped, own | flipped | square, -beta, -alpha, False)
+			if best == None or score > alpha:
+				alpha = max(alpha, score)
+				best = square
+				if alpha >= beta:
+					break
+		index = best.bit_length() - 1
+		return (index // self._cols, index % self._cols), alpha
+
+	def _search(self, own: int, opp: int, alpha: int, beta: int, passed: bool) -> int:
+		"""
+		Returns the score for the owner of own with best play from both sides,
+		using principal variation search
+		"""
+		self.nodes += 1
+		if self.nodes % CHECK_EVERY == 0 and self._stop != None and self._stop():
+			raise Stopped
+		empty = self._full & ~(own | opp)
+		count = empty.bit_count()
+
+		if count == 1:
+			return self._last_square(own, opp, empty)
+
+		moves = othello_bitboard.legal_mask(own, opp, empty, self._table) if count else 0
+		if not moves:
+			if passed or count == 0:
+				return self._final(own, opp)
+			return -self._search(opp, own, -beta, -alpha, True)
+
+		key = None
+		if count > TT_EMPTIES:
+			key = hash((own, opp, self._sign, self._rows, self._cols)) & 0xFFFFFFFFFFFFFFFF
+			entry = self.tt.probe(key)
+			if entry != None:
+				score, _, flag, _ = entry
+				if flag == othello_tt.EXACT:
+					return score
+				elif flag == othello_tt.LOWER and score >= beta:
+					return score
+				elif flag == othello_tt.UPPER and score <= alpha:
+					return score
+
+		original_alpha = alpha
+		first = True
+		for square, flipped in self._ordered(own, opp, moves, empty):
+			child_own = opp & ~flipped
+			child_opp = own | flipped | square
+			if first:
+				score = -self._search(child_own, child_opp, -beta, -alpha, False)
+				first = False
+			else:
+				# prove the first move was best with a zero width window, and
+				# only search again with the full window if that fails
+				score = -self._search(child_own, child_opp, -alpha - 1, -alpha, False)
+				if alpha < score < beta:
+					score = -self._search(child_own, child_opp, -beta, -score, False)
+			if score > alpha:
+				alpha = score
+				if alpha >= beta:
+					break
+
+		if key != None:
+			if alpha <= original_alpha:
+				flag = othello_tt.UPPER
+			elif alpha >= beta:
+				flag = othello_tt.LOWER
+			else:
+				flag = othello_tt.EXACT
+			self.tt.store(key, alpha, count, flag)
+		return alpha
+
+	def _last_square(self, own: int, opp: int, square: int) -> int:
+		"""
+		Scores the game when only square is left: the player to move takes it
+		if they can, otherwise the opponent does if they can
+		"""
+		flipped = othello_bitboard.flip_mask(square, own, opp, self._table)
+		if flipped:
+			return self._final(own | flipped | square, opp & ~flipped)
+		flipped = othello_bitboard.flip_mask(square, opp, own, self._table)
+		if flipped:
+			return self._final(own & ~flipped, opp | flipped | square)
+		return self._final(own, opp)
+
+
+def solve(othello, mode: str = EXACT) -> EndgameResult:
+	"""
+	Solves othello's position exactly for its current player
+	"""
+	return EndgameSolver(mode).solve(othello)
+
+
+############################## CHECKS AND SCALING ##########################
+
+def _minimax(othello, passed: bool = False) -> int:
+	"""
+	Plain exact search through the Othello methods, to check the solver
+	"""
+	moves = othello.legal_moves()
+	if not moves:
+		if passed:
+			black, white = othello._count_pieces()
+			diff = black - white if othello.current_player == 1 else white - black
+			return diff if othello.STYLE == ">" else -diff
+		record = othello.apply_pass()
+		score = -_minimax(othello, True)
+		othello.undo_move(record)
+		return score
+	best = None
+	for row, col in moves:
+		record = othello.apply_move(row, col)
+		score = -_minimax(othello, False)
+		othello.undo_move(record)
+		if best == None or score > best:
+			best = score
+	return best
+
+
+def _position(rows: int, cols: int, left: int, seed: int, style: str = ">"):
+	"""
+	Plays a seeded random game until left squares are empty
+	"""
+	rng = random.Random(seed)
+	othello = othello_bitboard.BitboardOthello(rows, cols, "B", style,
+		othello_logic.starting_board(rows, cols))
+	while empties(othello) > left:
+		moves = sorted(othello.legal_moves())
+		if not moves:
+			if not othello.legal_moves(3 - othello.current_player):
+				return None
+			othello.apply_pass()
+			continue
+		othello.apply_move(*rng.choice(moves))
+	return othello
+
+
+def check(positions: int = 20) -> None:
+	"""
+	Raises AssertionError if the solver disagrees with plain minimax, its
+	win/loss/draw disagrees with find_winner after perfect play, or it
+	doesn't stop when told to
+	"""
+	seed = 0
+	checked = 0
+	while checked < positions:
+		seed += 1
+		style = "<" if seed % 2 else ">"
+		othello = _position(6, 6, 7, seed, style)
+		if othello == None:
+			continue
+		exact = solve(othello, EXACT)
+		assert exact.score == _minimax(othello)
+		wld = solve(othello, WLD)
+		assert wld.score == (exact.score > 0) - (exact.score < 0)
+
+		player = othello.current_player
+		while True:
+			result = solve(othello, EXACT)
+			if result.move == None:
+				if not othello.legal_moves(3 - othello.current_player):
+					break
+				othello.apply_pass()
+			else:
+				othello.apply_move(*result.move)
+		black, white = othello._count_pieces()
+		diff = black - white if player == 1 else white - black
+		assert exact.score == (diff if style == ">" else -diff)
+		winner = othello.find_winner()
+		if exact.score == 0:
+			assert winner == "NONE"
+		else:
+			winning = player if exact.score > 0 else 3 - player
+			assert winner[0] == othello.REFER[winning] # find_winner spells White "Wwhite" with "<"
+		checked += 1
+
+	try:
+		EndgameSolver().solve(_position(8, 8, 12, 1), stop = lambda: True)
+	except Stopped:
+		pass
+	else:
+		raise AssertionError("solve ignored stop")
+
+
+if __name__ == "__main__":
+	check()
+	print("solver matches minimax and find_winner")
+	for rows, cols in [(8, 8), (6, 10), (10, 10), (4, 16)]:
+		for left in (8, 12, 14, 16):
+			othello = _position(rows, cols, left, 1)
+			if othello == None:
+				continue
+			for mode in (WLD, EXACT):
+				result = solve(othello, mode)
+				print("{}x{} {} empties {}: score {} nodes {} {:.3f}s".format(rows, cols, left,
+					mode, result.score, result.nodes, result.seconds))
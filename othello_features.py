@@ -0,0 +1,277 @@
+"""
+Position features for a whole batch of boards at once. Takes (N, rows, cols)
+uint8 boards in the Othello.game encoding (0 empty, 1 black, 2 white) and
+works everything out with array operations over the batch, with no Python
+loop over positions. Every feature with two columns is (black, white), the
+same order as Othello._count_pieces:
+
+	discs          pieces of each colour
+	mobility       legal moves each colour would have if it were to move
+	frontier       pieces next to an empty square (in any of the 8 directions)
+	stable         pieces that can never be flipped, found the usual
+	               conservative way: a piece is stable when on each of the
+	               four lines through it (row, column and both diagonals) the
+	               line is full, or the next square on one side is off the
+	               board or a stable piece of the same colour. This never
+	               counts an unstable piece but can miss some stable ones
+	corners        corner squares held
+	parity         1 if an odd number of squares is empty, otherwise 0
+	odd_quadrants  quarters of the board (the ones othello_endgame uses for
+	               parity) with an odd number of empty squares
+
+scalar_features works out the same thing for one Othello object the slow
+way, square by square, and check() compares the two on random positions.
+"""
+
+import time
+
+import numpy
+
+import othello_ai
+import othello_batch
+import othello_logic
+
+AXES = [(0, 1), (1, 0), (1, 1), (1, -1)]
+
+NEIGHBOURS = [(dir1, dir2) for dir1 in range(-1, 2) for dir2 in range(-1, 2)
+	if not (dir1 == 0 and dir2 == 0)]
+
+_LINES = {} # (rows, cols) -> line matrices and indices of every axis
+
+
+############################## BATCH ##########################
+
+def _neighbour(mask: numpy.ndarray, dir1: int, dir2: int, fill: bool) -> numpy.ndarray:
+	"""
+	Returns an array holding, for every square, the value of mask one step
+	away in direction dir1, dir2, and fill where that step leaves the board
+	"""
+	rows, cols = mask.shape[1:]
+	padded = numpy.pad(mask, ((0, 0), (1, 1), (1, 1)), constant_values = fill)
+	return padded[:, 1 + dir1:1 + dir1 + rows, 1 + dir2:1 + dir2 + cols]
+
+
+def _lines(rows: int, cols: int) -> [(numpy.ndarray, numpy.ndarray)]:
+	"""
+	Returns, for every axis, a (squares, lines) 0/1 matrix saying which line
+	along that axis each square is on, and the line number of each square
+	"""
+	if (rows, cols) not in _LINES:
+		row, col = numpy.divmod(numpy.arange(rows * cols), cols)
+		result = []
+		for line in (row, col, row - col + cols - 1, row + col):
+			matrix = numpy.zeros((rows * cols, line.max() + 1), dtype = numpy.int32)
+			matrix[numpy.arange(rows * cols), line] = 1
+			result.append((matrix, line))
+		_LINES[(rows, cols)] = result
+	return _LINES[(rows, cols)]
+
+
+def _stable(boards: numpy.ndarray) -> numpy.ndarray:
+	"""
+	Returns an (N, rows, cols) mask of the stable pieces of both colours.
+	Boards stop being worked on as soon as their mask stops growing
+	"""
+	count, rows, cols = boards.shape
+	empty = (boards == 0).reshape(count, -1).astype(numpy.int32)
+	full = [((empty @ matrix) == 0)[:, line].reshape(count, rows, cols) for matrix, line in _lines(rows, cols)]
+	# a side of an axis counts if it is off the board, or once it is stable
+	# if it is the same colour
+	inside = numpy.zeros((1, rows, cols), dtype = bool)
+	edge = [(_neighbour(inside, dir1, dir2, True) | _neighbour(inside, -dir1, -dir2, True))[0] for dir1, dir2 in AXES]
+	same = [(_neighbour(boards, dir1, dir2, 255) == boards, _neighbour(boards, -dir1, -dir2, 255) == boards)
+		for dir1, dir2 in AXES]
+	done = [full[axis] | edge[axis] for axis in range(len(AXES))]
+
+	stable = numpy.zeros((count, rows, cols), dtype = bool)
+	active = numpy.arange(count)
+	occupied = boards != 0
+	while len(active):
+		current = stable[active]
+		grown = occupied[active].copy()
+		for axis, (dir1, dir2) in enumerate(AXES):
+			grown &= (done[axis][active] | (same[axis][0][active] & _neighbour(current, dir1, dir2, False))
+				| (same[axis][1][active] & _neighbour(current, -dir1, -dir2, False)))
+		changed = (grown != current).any(axis = (1, 2))
+		stable[active] = grown
+		active = active[changed]
+	return stable
+
+
+def _quadrant_ids(rows: int, cols: int) -> numpy.ndarray:
+	"""
+	Returns the quarter (0 to 3) of every square, split like
+	othello_endgame._quadrants
+	"""
+	row, col = numpy.divmod(numpy.arange(rows * cols), cols)
+	return (row >= rows // 2) * 2 + (col >= cols // 2)
+
+
+def features(boards: numpy.ndarray) -> {str: numpy.ndarray}:
+	"""
+	Returns every feature listed at the top of the module for a batch of
+	(N, rows, cols) boards
+	"""
+	boards = numpy.asarray(boards, dtype = numpy.uint8)
+	count, rows, cols = boards.shape
+	black, white = othello_batch.pack(boards)
+	empty = boards == 0
+
+	mobility = numpy.stack([othello_batch.unpack(othello_batch.legal_bits(black, white, cols), cols).sum(axis = (1, 2)),
+		othello_batch.unpack(othello_batch.legal_bits(white, black, cols), cols).sum(axis = (1, 2))], axis = 1)
+
+	near_empty = numpy.zeros_like(empty)
+	for dir1, dir2 in NEIGHBOURS:
+		near_empty |= _neighbour(empty, dir1, dir2, False)
+	frontier = numpy.stack([(near_empty & (boards == colour)).sum(axis = (1, 2)) for colour in (1, 2)], axis = 1)
+
+	stable_pieces = _stable(boards)
+	stable = numpy.stack([(stable_pieces & (boards == colour)).sum(axis = (1, 2)) for colour in (1, 2)], axis = 1)
+
+	corner_values = boards[:, [0, 0, rows - 1, rows - 1], [0, cols - 1, 0, cols - 1]]
+	corners = numpy.stack([(corner_values == colour).sum(axis = 1) for colour in (1, 2)], axis = 1)
+
+	flat_empty = empty.reshape(count, -1)
+	quadrant_empties = numpy.stack([flat_empty[:, _quadrant_ids(rows, cols) == quarter].sum(axis = 1)
+		for quarter in range(4)], axis = 1)
+
+	return {
+		"discs": numpy.stack([(boards == colour).sum(axis = (1, 2)) for colour in (1, 2)], axis = 1),
+		"mobility": mobility,
+		"frontier": frontier,
+		"stable": stable,
+		"corners": corners,
+		"parity": flat_empty.sum(axis = 1) % 2,
+		"odd_quadrants": (quadrant_empties % 2).sum(axis = 1),
+	}
+
+
+############################## ONE POSITION ##########################
+
+def _scalar_stable(othello, colour: int) -> int:
+	"""
+	Returns how many of colour's pieces are stable, by the same rule as the
+	batch version but walking the board square by square
+	"""
+	rows, cols = othello.ROWS, othello.COLS
+	game = othello.game
+
+	def on_board(row: int, col: int) -> bool:
+		return 0 <= row < rows and 0 <= col < cols
+
+	def line_full(row: int, col: int, dir1: int, dir2: int) -> bool:
+		for sign in (1, -1):
+			step_row, step_col = row, col
+			while on_board(step_row, step_col):
+				if game[step_row][step_col] == 0:
+					return False
+				step_row += sign * dir1
+				step_col += sign * dir2
+		return True
+
+	stable = set()
+	changed = True
+	while changed:
+		changed = False
+		for row in range(rows):
+			for col in range(cols):
+				if game[row][col] != colour or (row, col) in stable:
+					continue
+				for dir1, dir2 in AXES:
+					sides = [(row + dir1, col + dir2), (row - dir1, col - dir2)]
+					if not any(not on_board(*side) or side in stable for side in sides) and not line_full(row, col, dir1, dir2):
+						break
+				else:
+					stable.add((row, col))
+					changed = True
+	return len(stable)
+
+
+def scalar_features(othello) -> {str: "int or (black, white)"}:
+	"""
+	Returns the same features as features() for one Othello object, using
+	its own methods where it has them
+	"""
+	rows, cols = othello.ROWS, othello.COLS
+	game = othello.game
+	empties = [(row, col) for row in range(rows) for col in range(cols) if game[row][col] == 0]
+
+	frontier = [0, 0]
+	for row in range(rows):
+		for col in range(cols):
+			if game[row][col] != 0 and any(0 <= row + dir1 < rows and 0 <= col + dir2 < cols
+					and game[row + dir1][col + dir2] == 0 for dir1, dir2 in NEIGHBOURS):
+				frontier[game[row][col] - 1] += 1
+
+	quarters = [0, 0, 0, 0]
+	for row, col in empties:
+		quarters[(row >= rows // 2) * 2 + (col >= cols // 2)] += 1
+
+	corner_values = [game[row][col] for row, col in othello_ai.corners(othello)]
+	return {
+		"discs": othello._count_pieces(),
+		"mobility": (len(othello.legal_moves(1)), len(othello.legal_moves(2))),
+		"frontier": tuple(frontier),
+		"stable": (_scalar_stable(othello, 1), _scalar_stable(othello, 2)),
+		"corners": (corner_values.count(1), corner_values.count(2)),
+		"parity": len(empties) % 2,
+		"odd_quadrants": sum(quarter % 2 for quarter in quarters),
+	}
+
+
+############################## CHECKING ##########################
+
+def random_positions(count: int, rows: int, cols: int, seed: int = 0) -> (numpy.ndarray, numpy.ndarray):
+	"""
+	Returns (boards, players) of count positions from random games, spread
+	over every stage of the game
+	"""
+	sim = othello_batch.BatchSimulator(count, rows, cols, seed = seed)
+	rng = numpy.random.default_rng(seed)
+	stop_at = rng.integers(0, rows * cols, size = count)
+	boards = numpy.empty((count, rows, cols), dtype = numpy.uint8)
+	players = numpy.empty(count, dtype = numpy.uint8)
+	plies = 0
+	while True:
+		now = (stop_at == plies) | (sim.done & (stop_at > plies))
+		boards[now] = sim.boards[now]
+		players[now] = sim.players[now]
+		stop_at[now] = -1
+		if (stop_at < 0).all():
+			return boards, players
+		sim.random_step()
+		plies += 1
+
+
+def check(count: int = 100, seed: int = 0) -> None:
+	"""
+	Compares features() with scalar_features on random positions of several
+	board sizes and raises AssertionError if any feature differs
+	"""
+	for rows, cols in [(4, 4), (6, 6), (8, 8), (4, 10), (10, 6), (16, 16)]:
+		boards, players = random_positions(count, rows, cols, seed)
+		batch = features(boards)
+		for index in range(count):
+			othello = othello_logic.Othello(rows, cols, "B", ">",
+				[[".BW"[cell] for cell in line] for line in boards[index]])
+			for name, value in scalar_features(othello).items():
+				assert tuple(numpy.atleast_1d(batch[name][index])) == tuple(numpy.atleast_1d(value)), \
+					"{} differs on {}x{} position {}".format(name, rows, cols, index)
+
+
+def throughput(count: int = 10000, rows: int = 8, cols: int = 8) -> float:
+	"""
+	Returns positions per second of features() on a batch of count random
+	positions
+	"""
+	boards, _ = random_positions(count, rows, cols)
+	start = time.perf_counter()
+	features(boards)
+	return count / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+	check()
+	print("batch features match the scalar ones on every size")
+	for rows, cols in [(4, 4), (8, 8), (6, 10), (16, 16)]:
+		print("{}x{}: {:.0f} positions/sec".format(rows, cols, throughput(rows = rows, cols = cols)))
@@ -1,5 +1,9 @@
 # Vinh Truong 88812807, Lab Section 9
 
+import itertools
+import random
+import struct
+
 class InvalidMoveError(Exception):
 	pass
 
@@ -16,6 +20,41 @@ class InvalidBoardError(Exception):
 	def __str__(self) -> str:
 		return "Board has to be even dimensions from 4 to 16"
 
+_ZOBRIST_KEYS = {}
+
+def zobrist_keys(rows: int, cols: int) -> ("piece keys", "flip keys", "side key"):
+	"""
+	Returns the Zobrist keys for a board size. piece keys[value][square] is
+	the key for value (0 empty, 1 black, 2 white) on square row * cols + col,
+	flip keys[square] is the black key xor the white key, and side key is
+	mixed in while White is to move. The keys come from a fixed seed so every
+	process agrees on them
+	"""
+	key = (rows, cols)
+	if key not in _ZOBRIST_KEYS:
+		rng = random.Random(rows * 100 + cols)
+		black = [rng.getrandbits(64) for _ in range(rows * cols)]
+		white = [rng.getrandbits(64) for _ in range(rows * cols)]
+		flip = [black[square] ^ white[square] for square in range(rows * cols)]
+		_ZOBRIST_KEYS[key] = ([[0] * (rows * cols), black, white], flip, rng.getrandbits(64))
+	return _ZOBRIST_KEYS[key]
+
+SNAPSHOT = struct.Struct("<BBB?Q") # rows, cols, player to move, STYLE is "<", hash
+_TO_CHARACTERS = bytes.maketrans(b"\x00\x01\x02", b".BW")
+_FROM_CHARACTERS = bytes.maketrans(b".BW", b"\x00\x01\x02")
+
+def starting_board(rows: int, cols: int) -> [[str]]:
+	"""
+	Returns a board in the format Othello takes for its board argument, with
+	the usual four pieces in the middle
+	"""
+	board = [["."] * cols for _ in range(rows)]
+	board[rows//2 - 1][cols//2 - 1] = "W"
+	board[rows//2][cols//2] = "W"
+	board[rows//2 - 1][cols//2] = "B"
+	board[rows//2][cols//2 - 1] = "B"
+	return board
+
 class Othello:
 	"""
 	ATTRIBUTES:
@@ -25,6 +64,8 @@ class Othello:
 	ROWS, number of rows
 	COLS, number of cols
 	current_player, current player (1 or 2)
+	_counts, running number of [empty, black, white] squares
+	_hash, Zobrist hash of the board and player to move
 	"""
 
 	REFER = {0: ".", 1: "B", 2: "W"}
@@ -125,20 +166,55 @@ class Othello:
 				elif board[row][col] == "W":
 					self.game[row][col] = 2
 
+		self._recount_pieces()
+		self._rehash()
+
+
+	def _recount_pieces(self) -> None:
+		"""
+		Counts every square of the board once to start the running counts.
+		Only needed if self.game was changed directly instead of through
+		set_piece or the move functions
+		"""
+		self._counts = [0, 0, 0]
+		for row in self.game:
+			for col in row:
+				self._counts[col] += 1
+
+
+	def _rehash(self) -> None:
+		"""
+		Computes the Zobrist hash from scratch. Only needed if self.game was
+		changed directly instead of through set_piece or the move functions
+		"""
+		self._keys = zobrist_keys(self.ROWS, self.COLS)
+		self._hash = 0
+		for row in range(self.ROWS):
+			for col in range(self.COLS):
+				self._hash ^= self._keys[0][self.game[row][col]][row * self.COLS + col]
+		if self.current_player == 2:
+			self._hash ^= self._keys[2]
+
+
+	def set_piece(self, row: int, col: int, value: int) -> None:
+		"""
+		Puts value (0 empty, 1 black, 2 white) on the square without checking
+		if it is a legal move, used for setting up the board
+		"""
+		square = row * self.COLS + col
+		self._hash ^= self._keys[0][self.game[row][col]][square] ^ self._keys[0][value][square]
+		self._counts[self.game[row][col]] -= 1
+		self._counts[value] += 1
+		self.game[row][col] = value
+
 
 	def print_board(self) -> None:
 		"""
 		Takes in a game board and prints it out to console
 		"""
-		b = 0
-		w = 0
 		result = ""
 		for row in self.game:
 			for col in row:
-				if col == 1:
-					b += 1
-				elif col == 2:
-					w += 1
 				result += self.REFER[col] + " "
 			result = result.strip()
 			result += "\n"
@@ -150,25 +226,13 @@ class Othello:
 		"""
 		Returns the number of black pieces
 		"""
-		total = 0
-		for row in self.game:
-			for col in row:
-				if col == 1:
-					total += 1
-
-		return total
+		return self._counts[1]
 
 	def get_white_pieces(self) -> int:
 		"""
 		Returns the number of white pieces
 		"""
-		total = 0
-		for row in self.game:
-			for col in row:
-				if col == 2:
-					total += 1
-
-		return total
+		return self._counts[2]
 
 	def get_rows(self) -> int:
 		"""
@@ -192,6 +256,103 @@ class Othello:
 			return "Black"
 		return "White"
 
+	def get_hash(self) -> int:
+		"""
+		Returns the 64 bit Zobrist hash of the position, including whose turn
+		it is. Positions that transpose into each other get the same hash
+		"""
+		return self._hash
+
+	############################# COPY AND SNAPSHOTS ##########################
+
+	def copy(self) -> "Othello":
+		"""
+		Returns an independent copy of the game without going through
+		__init__, so nothing is checked, recounted or printed
+		"""
+		other = self.__class__.__new__(self.__class__)
+		other.__dict__.update(self.__dict__)
+		other.game = [line[:] for line in self.game]
+		other._counts = self._counts[:]
+		return other
+
+	def to_bytes(self) -> bytes:
+		"""
+		Returns the whole state (size, player to move, STYLE, hash and one
+		byte per square) as bytes for from_bytes
+		"""
+		return SNAPSHOT.pack(self.ROWS, self.COLS, self.current_player, self.STYLE == "<",
+			self._hash) + bytes(itertools.chain.from_iterable(self.game))
+
+	@classmethod
+	def from_bytes(cls, data: bytes) -> "Othello":
+		"""
+		Rebuilds a game from to_bytes without checking or printing it. The
+		board is sliced a row at a time and counted with bytes.count, so no
+		Python code runs per square
+		"""
+		rows, cols, player, least, position_hash = SNAPSHOT.unpack_from(data)
+		cells = bytes(data[SNAPSHOT.size:SNAPSHOT.size + rows * cols])
+		if len(cells) != rows * cols:
+			raise InvalidSizeError
+		othello = cls.__new__(cls)
+		othello.ROWS = rows
+		othello.COLS = cols
+		othello.current_player = player
+		othello.STYLE = "<" if least else ">"
+		othello.game = [list(cells[start:start + cols]) for start in range(0, rows * cols, cols)]
+		othello._counts = [cells.count(0), cells.count(1), cells.count(2)]
+		othello._keys = zobrist_keys(rows, cols)
+		othello._hash = position_hash
+		othello._restore(cells)
+		return othello
+
+	def __reduce__(self):
+		"""
+		Pickles through to_bytes, so the Zobrist keys aren't sent along
+		"""
+		return (self.__class__.from_bytes, (self.to_bytes(),))
+
+	def _restore(self, cells: bytes) -> None:
+		"""
+		Sets up anything else a subclass keeps, from one byte per square.
+		Called by from_bytes, nothing to do here
+		"""
+		pass
+
+	def to_string(self) -> str:
+		"""
+		Returns the state as one line like "8x8 B > ...BW... 1f0c...", with
+		the board in the characters the board argument of __init__ uses and
+		the hash in hex last
+		"""
+		cells = bytes(itertools.chain.from_iterable(self.game)).translate(_TO_CHARACTERS).decode()
+		return "{}x{} {} {} {} {:x}".format(self.ROWS, self.COLS, self.REFER[self.current_player],
+			self.STYLE, cells, self._hash)
+
+	@classmethod
+	def from_string(cls, text: str) -> "Othello":
+		"""
+		Rebuilds a game from to_string. The hash can be left off a string
+		written by hand, then it is worked out from the board. Raises
+		InvalidBoardError if a cell isn't B, W or .
+		"""
+		size, player, style, cells, *position_hash = text.split()
+		rows, cols = size.split("x")
+		cells = cells.encode()
+		if cells.translate(None, b".BW"):
+			raise InvalidBoardError
+		cells = cells.translate(_FROM_CHARACTERS)
+		if position_hash:
+			position_hash = int(position_hash[0], 16)
+		else:
+			keys = zobrist_keys(int(rows), int(cols))
+			position_hash = keys[2] if player == "W" else 0
+			for square, value in enumerate(cells):
+				position_hash ^= keys[0][value][square]
+		return cls.from_bytes(SNAPSHOT.pack(int(rows), int(cols), 1 if player == "B" else 2,
+			style == "<", position_hash) + cells)
+
 	############################# MOVE VALIDATION ##########################
 
 	def _direction_is_valid(self, row, col, dir1, dir2) -> ["tuples of coordinate"]:
@@ -259,6 +420,43 @@ class Othello:
 		return result
 
 
+	def legal_moves(self, player=None) -> {"(row, col)": ["tuples of coordinates"]}:
+		"""
+		Returns a dictionary mapping every legal square for the player (the
+		current player if not given) to the tiles that move would flip, found
+		in a single pass over the board. Empty dictionary means the player has
+		to pass
+		"""
+		if player == None:
+			player = self.current_player
+		opponent = 3 - player
+
+		result = {}
+		for row in range(self.ROWS):
+			for col in range(self.COLS):
+				if self.game[row][col] != 0:
+					continue
+
+				flips = []
+				for dir1 in range(-1, 2):
+					for dir2 in range(-1, 2):
+						if dir1 == 0 and dir2 == 0:
+							continue
+						tiles = []
+						r = row + dir1
+						c = col + dir2
+						while 0 <= r < self.ROWS and 0 <= c < self.COLS and self.game[r][c] == opponent:
+							tiles.append((r, c))
+							r += dir1
+							c += dir2
+						if tiles and 0 <= r < self.ROWS and 0 <= c < self.COLS and self.game[r][c] == player:
+							flips.extend(tiles)
+
+				if flips:
+					result[(row, col)] = flips
+		return result
+
+
 	def take_turn(self, move: list) -> None:
 		"""
 		Places a piece from the current player. If the move is invalid,
@@ -283,6 +481,15 @@ class Othello:
 		Makes a move for the current player, returns true if
 		a move was made, false if not
 		"""
+		self._place(row, col, self._flips_or_raise(row, col))
+		return True
+
+
+	def _flips_or_raise(self, row, col) -> ["tuples of coordinates"]:
+		"""
+		Returns the tiles the current player would flip by playing at row, col
+		and raises InvalidMoveError if the move is not valid
+		"""
 		try:
 			moves = self.placement_is_valid(row, col)
 		except IndexError:
@@ -291,6 +498,13 @@ class Othello:
 		if len(moves) == 0:
 			raise InvalidMoveError
 
+		return moves
+
+
+	def _place(self, row, col, moves: ["tuples of coordinates"]) -> None:
+		"""
+		Puts the current player's piece on row, col and flips the tiles in moves
+		"""
 		self.game[row][col] = self.current_player
 
 		for move in moves:
@@ -299,7 +513,63 @@ class Othello:
 			else:
 				self.game[move[0]][move[1]] = 1
 
-		return True
+		self._counts[0] -= 1
+		self._counts[self.current_player] += len(moves) + 1
+		self._counts[3 - self.current_player] -= len(moves)
+
+		self._hash ^= self._keys[0][self.current_player][row * self.COLS + col]
+		for move in moves:
+			self._hash ^= self._keys[1][move[0] * self.COLS + move[1]]
+
+
+	############################## MAKE/UNMAKE FOR SEARCH ##########################
+
+	def apply_move(self, row, col) -> ("(row, col)", "flipped tiles", "previous player"):
+		"""
+		Makes a move for the current player (rows and cols start at 0) and
+		switches players. Returns an undo record to give back to undo_move.
+		Raises InvalidMoveError if the move is not valid
+		"""
+		moves = self._flips_or_raise(row, col)
+		player = self.current_player
+		self._place(row, col, moves)
+		self.change_player()
+		return ((row, col), moves, player)
+
+
+	def apply_pass(self) -> ("None", "no flipped tiles", "previous player"):
+		"""
+		Passes the current player's turn. Returns an undo record to give back
+		to undo_move
+		"""
+		player = self.current_player
+		self.change_player()
+		return (None, [], player)
+
+
+	def undo_move(self, record: ("(row, col)", "flipped tiles", "previous player")) -> None:
+		"""
+		Takes back the move or pass that returned record. Records have to be
+		undone in the reverse order they were made
+		"""
+		square, moves, player = record
+		if self.current_player != player:
+			self.change_player()
+		if square == None:
+			return
+
+		opponent = 3 - player
+		self.game[square[0]][square[1]] = 0
+		for move in moves:
+			self.game[move[0]][move[1]] = opponent
+
+		self._counts[0] += 1
+		self._counts[player] -= len(moves) + 1
+		self._counts[opponent] += len(moves)
+
+		self._hash ^= self._keys[0][player][square[0] * self.COLS + square[1]]
+		for move in moves:
+			self._hash ^= self._keys[1][move[0] * self.COLS + move[1]]
 
 
 
@@ -310,11 +580,7 @@ class Othello:
 		"""
 		Method to check if the board is full, returns True if it is, False if not
 		"""
-		for row in self.game:
-			for col in row:
-				if col == 0:
-					return False
-		return True
+		return self._counts[0] == 0
 
 
 	def find_winner(self) -> str:
@@ -346,17 +612,7 @@ class Othello:
 		"""
 		Helper method to count the pieces in the board
 		"""
-		b = 0
-		w = 0
-
-		for row in self.game:
-			for col in row:
-				if col == 1:
-					b += 1
-				elif col == 2:
-					w += 1
-
-		return (b, w)
+		return (self._counts[1], self._counts[2])
 
 
 	def change_player(self) -> None:
@@ -366,4 +622,17 @@ class Othello:
 		if self.current_player == 1:
 			self.current_player = 2
 		elif self.current_player == 2:
-			self.current_player = 1
\ No newline at end of file
+			self.current_player = 1
+		self._hash ^= self._keys[2]
+
+	def pass_or_end(self) -> bool:
+		"""
+		If the current player has no valid move, the turn goes to the other
+		player. Returns True if they can't move either, so the game is over.
+		This is the rule the GUI plays by after every move
+		"""
+		if len(self.legal_moves()) == 0:
+			self.change_player()
+			if len(self.legal_moves()) == 0:
+				return True
+		return False
@@ -0,0 +1,438 @@
+"""
+Headless matches between two players, for telling whether one engine version
+is stronger than another. Games are played by the same rules as the GUI
+(take_turn for every move, then Othello.pass_or_end to pass or finish), from
+a set of balanced opening positions. Each opening is played twice with the
+colours swapped, so neither player gets the better side of it more often.
+
+After every game the match updates the Elo difference with a 95% error bar
+and a sequential probability ratio test (SPRT) between elo0 (the change is
+no better than this) and elo1 (it is at least this much better). The match
+stops as soon as the test decides either way, which usually takes far fewer
+games than a fixed length match.
+
+A player is anything with new_game(othello) and choose_move(othello), see
+Player. Run it as a script to play two players against each other, like
+
+	python othello_match.py alphabeta:nodes=4000 alphabeta:nodes=2000 --elo1 50
+"""
+
+import argparse
+import collections
+import json
+import math
+import random
+import sys
+import time
+
+import othello_ai
+import othello_bitboard
+import othello_logic
+import othello_mcts
+import othello_tt
+
+GameResult = collections.namedtuple("GameResult",
+	["winner", "black", "white", "plies", "seconds"])
+
+SECONDS = 1.0 # thinking time per move for players given no budget
+
+
+############################## PLAYERS ##########################
+
+class Player:
+	"""
+	Something that picks moves. choose_move gets the game being played and
+	must leave it as it was
+
+	ATTRIBUTES:
+	name, shown in match results
+	"""
+
+	name = "player"
+
+	def new_game(self, othello) -> None:
+		"""
+		Called before every game with its starting position
+		"""
+		pass
+
+	def choose_move(self, othello) -> (int, int):
+		"""
+		Returns the (row, col) to play for othello's current player, which
+		always has at least one legal move
+		"""
+		raise NotImplementedError
+
+
+class RandomPlayer(Player):
+	"""
+	Plays a random legal move
+
+	ATTRIBUTES:
+	name, "random"
+	"""
+
+	def __init__(self, seed=None):
+		"""
+		Seeds the player's own random generator
+		"""
+		self.name = "random"
+		self._rng = random.Random(seed)
+
+	def choose_move(self, othello) -> (int, int):
+		"""
+		Returns a random legal move
+		"""
+		return self._rng.choice(sorted(othello.legal_moves()))
+
+
+class SearchPlayer(Player):
+	"""
+	Plays othello_ai's alpha-beta move. The transposition table is kept for
+	the whole game and cleared between games
+
+	ATTRIBUTES:
+	name, the settings, like "alphabeta:nodes=2000"
+	search, the othello_ai.AlphaBetaSearch used
+	"""
+
+	def __init__(self, max_time=None, max_nodes=None, max_depth=None, tt_mb: float = 16, name: str = None, **kwargs):
+		"""
+		Makes the search with the given budgets (SECONDS a move if none is
+		given), anything else is passed to AlphaBetaSearch
+		"""
+		if max_time == None and max_nodes == None and max_depth == None:
+			max_time = SECONDS
+		self.search = othello_ai.AlphaBetaSearch(max_time, max_nodes, max_depth,
+			othello_tt.TranspositionTable(tt_mb), **kwargs)
+		self.name = name or "alphabeta"
+
+	def new_game(self, othello) -> None:
+		"""
+		Empties the table so games don't depend on the ones before them
+		"""
+		self.search.tt.clear()
+
+	def choose_move(self, othello) -> (int, int):
+		"""
+		Returns the search's best move
+		"""
+		return self.search.search(othello).move
+
+
+class MCTSPlayer(Player):
+	"""
+	Plays othello_mcts's most visited move
+
+	ATTRIBUTES:
+	name, the settings, like "mcts:playouts=400"
+	max_time, max_playouts, budget of every move
+	"""
+
+	def __init__(self, max_time=None, max_playouts=None, name: str = None, seed=None, **kwargs):
+		"""
+		Keeps the budget (SECONDS a move if none is given), anything else is
+		passed to MCTS
+		"""
+		if max_time == None and max_playouts == None:
+			max_time = SECONDS
+		self.max_time = max_time
+		self.max_playouts = max_playouts
+		self.name = name or "mcts"
+		self._seed = seed
+		self._kwargs = kwargs
+		self._mcts = None
+
+	def new_game(self, othello) -> None:
+		"""
+		Starts a new tree
+		"""
+		self._mcts = othello_mcts.MCTS(seed = self._seed, **self._kwargs)
+
+	def choose_move(self, othello) -> (int, int):
+		"""
+		Returns the most visited move
+		"""
+		return self._mcts.search(othello, self.max_time, self.max_playouts).move
+
+
+############################## PLAYING ##########################
+
+def play_game(black: Player, white: Player, othello) -> GameResult:
+	"""
+	Plays othello's position out between two players the way the GUI does:
+	take_turn for every move, then pass_or_end. Returns the winner following
+	STYLE (1 black, 2 white, 0 a tie) and the final piece counts
+	"""
+	start = time.perf_counter()
+	black.new_game(othello)
+	white.new_game(othello)
+	plies = 0
+	ended = othello.pass_or_end()
+	while not ended:
+		player = black if othello.current_player == 1 else white
+		row, col = player.choose_move(othello)
+		othello.take_turn([row + 1, col + 1])
+		plies += 1
+		ended = othello.pass_or_end()
+
+	winner = othello.find_winner() # "Black", "White" (or "Wwhite") or "NONE"
+	black_pieces, white_pieces = othello._count_pieces()
+	return GameResult(1 if winner == "Black" else (0 if winner == "NONE" else 2), black_pieces, white_pieces,
+		plies, time.perf_counter() - start)
+
+
+def openings(rows: int, cols: int, count: int, plies: int = 6, style: str = ">", margin: int = 10,
+		depth: int = 3, seed: int = 0, backend=othello_bitboard.BitboardOthello) -> [bytes]:
+	"""
+	Returns count different opening positions (Othello.to_bytes) reached by
+	plies random moves from the start, keeping only the ones a depth ply
+	search scores within margin of even
+	"""
+	rng = random.Random(seed)
+	search = othello_ai.AlphaBetaSearch(max_time = None, max_depth = depth, endgame_empties = 0)
+	found = {}
+	tries = 0
+	while len(found) < count and tries < count * 200:
+		tries += 1
+		othello = backend(rows, cols, "B", style, othello_logic.starting_board(rows, cols))
+		for _ in range(plies):
+			if othello.pass_or_end():
+				break
+			move = rng.choice(sorted(othello.legal_moves()))
+			othello.take_turn([move[0] + 1, move[1] + 1])
+		if othello.pass_or_end() or othello.get_hash() in found:
+			continue
+		if abs(search.search(othello).score) <= margin:
+			found[othello.get_hash()] = othello.to_bytes()
+	return list(found.values())
+
+
+############################## RATING ##########################
+
+def _elo(score: float) -> float:
+	"""
+	Returns the Elo difference that gives an expected score of score
+	"""
+	score = min(max(score, 1e-6), 1 - 1e-6)
+	return 400 * math.log10(score / (1 - score))
+
+
+def _expected(elo: float) -> float:
+	"""
+	Returns the expected score of a player elo points stronger
+	"""
+	return 1 / (1 + 10 ** (-elo / 400))
+
+
+class MatchStats:
+	"""
+	Results from the first player's side
+
+	ATTRIBUTES:
+	wins, draws, losses, games the first player won, drew and lost
+	elo0, elo1, the two Elo differences the SPRT decides between
+	alpha, beta, chances of wrongly accepting elo1 and wrongly accepting elo0
+	"""
+
+	def __init__(self, elo0: float = 0, elo1: float = 30, alpha: float = 0.05, beta: float = 0.05):
+		"""
+		Starts with no games
+		"""
+		self.wins = 0
+		self.draws = 0
+		self.losses = 0
+		self.elo0 = elo0
+		self.elo1 = elo1
+		self.alpha = alpha
+		self.beta = beta
+
+	@property
+	def games(self) -> int:
+		"""
+		Returns the number of games played
+		"""
+		return self.wins + self.draws + self.losses
+
+	def add(self, score: float) -> None:
+		"""
+		Counts one game, score 1 for a win, 0.5 for a draw and 0 for a loss
+		"""
+		if score == 1:
+			self.wins += 1
+		elif score == 0:
+			self.losses += 1
+		else:
+			self.draws += 1
+
+	def score(self) -> float:
+		"""
+		Returns the first player's average score
+		"""
+		return (self.wins + self.draws / 2) / self.games if self.games else 0.5
+
+	def _variance(self) -> float:
+		"""
+		Returns the variance of one game's score. Half a game of every kind
+		is added so it isn't zero before all three results have happened
+		"""
+		wins, draws, losses = self.wins + 0.5, self.draws + 0.5, self.losses + 0.5
+		total = wins + draws + losses
+		mean = (wins + draws / 2) / total
+		return (wins * (1 - mean) ** 2 + draws * (0.5 - mean) ** 2 + losses * mean ** 2) / total
+
+	def elo(self) -> (float, float, float):
+		"""
+		Returns the Elo difference and the low and high ends of its 95%
+		error bar
+		"""
+		if not self.games:
+			return 0.0, -math.inf, math.inf
+		score = self.score()
+		error = 1.96 * math.sqrt(self._variance() / self.games)
+		return _elo(score), _elo(score - error), _elo(score + error)
+
+	def llr(self) -> float:
+		"""
+		Returns the log likelihood ratio of elo1 over elo0, using the usual
+		normal approximation of the trinomial results
+		"""
+		if not self.games:
+			return 0.0
+		score0 = _expected(self.elo0)
+		score1 = _expected(self.elo1)
+		return self.games * (score1 - score0) * (2 * self.score() - score0 - score1) / (2 * self._variance())
+
+	def bounds(self) -> (float, float):
+		"""
+		Returns the (lower, upper) LLR bounds where the test accepts elo0 and
+		elo1
+		"""
+		return math.log(self.beta / (1 - self.alpha)), math.log((1 - self.beta) / self.alpha)
+
+	def decision(self) -> str:
+		"""
+		Returns "elo1" once the first player is shown to be at least elo1
+		better, "elo0" once it is shown not to be, otherwise None
+		"""
+		lower, upper = self.bounds()
+		llr = self.llr()
+		if llr >= upper:
+			return "elo1"
+		if llr <= lower:
+			return "elo0"
+		return None
+
+	def to_dict(self) -> dict:
+		"""
+		Returns the results as a dictionary for printing as JSON
+		"""
+		elo, low, high = self.elo()
+		lower, upper = self.bounds()
+		return {
+			"games": self.games,
+			"wins": self.wins,
+			"draws": self.draws,
+			"losses": self.losses,
+			"score": self.score(),
+			"elo": elo,
+			"elo_low": low,
+			"elo_high": high,
+			"llr": self.llr(),
+			"llr_bounds": [lower, upper],
+			"decision": self.decision(),
+		}
+
+
+def play_match(first: Player, second: Player, positions: [bytes], max_games: int,
+		stats: MatchStats = None, sprt: bool = True, backend=othello_bitboard.BitboardOthello) -> "iterator of (GameResult, MatchStats)":
+	"""
+	Plays up to max_games games, going through positions in order and
+	playing each one twice so first gets both colours. Yields every game's
+	result with the stats so far, and stops early once the SPRT decides if
+	sprt is True
+	"""
+	stats = MatchStats() if stats == None else stats
+	for number in range(max_games):
+		othello = backend.from_bytes(positions[(number // 2) % len(positions)])
+		first_colour = 1 if number % 2 == 0 else 2
+		if first_colour == 1:
+			result = play_game(first, second, othello)
+		else:
+			result = play_game(second, first, othello)
+		stats.add(0.5 if result.winner == 0 else float(result.winner == first_colour))
+		yield result, stats
+		if sprt and stats.decision() != None:
+			break
+
+
+############################## COMMAND LINE ##########################
+
+PLAYERS = {"random": RandomPlayer, "alphabeta": SearchPlayer, "mcts": MCTSPlayer}
+
+# short option names in player specs
+OPTIONS = {"time": "max_time", "nodes": "max_nodes", "depth": "max_depth", "playouts": "max_playouts"}
+
+
+def make_player(spec: str, seed: int = 0) -> Player:
+	"""
+	Makes a player from "kind:option=value,...", like "alphabeta:nodes=2000"
+	or "mcts:playouts=400". Options are time, nodes, depth, playouts or any
+	keyword of the player's class. Searching players given none of time,
+	nodes, depth or playouts think for SECONDS a move
+	"""
+	kind, _, options = spec.partition(":")
+	if kind not in PLAYERS:
+		raise ValueError("unknown player " + kind)
+	kwargs = {}
+	for option in filter(None, options.split(",")):
+		key, _, text = option.partition("=")
+		value = float(text) if "." in text else int(text)
+		kwargs[OPTIONS.get(key, key)] = value
+	if kind == "random" or kind == "mcts":
+		kwargs["seed"] = seed
+	if kind != "random":
+		kwargs["name"] = spec
+	return PLAYERS[kind](**kwargs)
+
+
+def main(argv=None) -> None:
+	"""
+	Reads the command line and plays the match
+	"""
+	parser = argparse.ArgumentParser(description = "Plays two Othello players against each other")
+	parser.add_argument("first", help = "player to test, like alphabeta:nodes=4000")
+	parser.add_argument("second", help = "player to compare with, like alphabeta:nodes=2000")
+	parser.add_argument("--size", default = "8x8")
+	parser.add_argument("--style", choices = [">", "<"], default = ">")
+	parser.add_argument("--games", type = int, default = 1000, help = "most games to play")
+	parser.add_argument("--openings", type = int, default = 50)
+	parser.add_argument("--plies", type = int, default = 6, help = "random moves in each opening")
+	parser.add_argument("--elo0", type = float, default = 0)
+	parser.add_argument("--elo1", type = float, default = 30)
+	parser.add_argument("--alpha", type = float, default = 0.05)
+	parser.add_argument("--beta", type = float, default = 0.05)
+	parser.add_argument("--no-sprt", action = "store_true", help = "always play every game")
+	parser.add_argument("--seed", type = int, default = 0)
+	parser.add_argument("--quiet", action = "store_true", help = "only print the final result")
+	args = parser.parse_args(argv)
+
+	rows, cols = (int(size) for size in args.size.lower().split("x"))
+	first = make_player(args.first, args.seed)
+	second = make_player(args.second, args.seed + 1)
+	positions = openings(rows, cols, args.openings, args.plies, args.style, seed = args.seed)
+	stats = MatchStats(args.elo0, args.elo1, args.alpha, args.beta)
+
+	start = time.perf_counter()
+	for result, stats in play_match(first, second, positions, args.games, stats, not args.no_sprt):
+		if not args.quiet:
+			elo, low, high = stats.elo()
+			print("game {}: {}-{}-{}  elo {:+.0f} [{:+.0f}, {:+.0f}]  llr {:.2f}".format(stats.games,
+				stats.wins, stats.draws, stats.losses, elo, low, high, stats.llr()), file = sys.stderr)
+	summary = dict(stats.to_dict(), first = first.name, second = second.name,
+		seconds = time.perf_counter() - start, openings = len(positions))
+	print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+	main()
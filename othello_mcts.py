@@ -0,0 +1,391 @@
+"""
+Monte Carlo Tree Search player. Needs no hand tuned evaluation, so it plays
+odd board shapes like 4x16 as well as square ones. Leaves are collected in
+batches (virtual loss keeps one batch from piling onto the same line) and
+evaluated together, by default with random playouts run side by side in an
+othello_batch.BatchSimulator, or by any evaluator that takes a batch of
+boards, like a neural network.
+
+The tree is kept between moves: when search is called again it looks for the
+new position among the old tree's children and grandchildren and carries on
+from there. Nodes that are no longer reachable go back to a free list and
+get reused, and the tree never grows past max_nodes.
+"""
+
+import collections
+import math
+import time
+
+import numpy
+
+import othello_batch
+
+MCTSResult = collections.namedtuple("MCTSResult",
+	["move", "visits", "value", "playouts", "seconds", "playouts_per_second", "tree_size"])
+
+
+class Node:
+	"""
+	ATTRIBUTES:
+	move, (row, col) played to get here, None for a pass or the root
+	player, player who made that move (1 or 2)
+	key, Othello.get_hash() of the position
+	children, list of child Nodes, None until expanded
+	visits, times this node was on a backed up path (including virtual loss)
+	total, sum of the values backed up, from player's point of view
+	prior, probability the evaluator gave this move (for PUCT)
+	terminal, None if the game goes on, else the final value for player
+	"""
+
+	__slots__ = ["move", "player", "key", "children", "visits", "total", "prior", "terminal"]
+
+	def reset(self, move, player: int, key: int, prior: float) -> "Node":
+		"""
+		Sets the node up for a position, used for new and recycled nodes
+		"""
+		self.move = move
+		self.player = player
+		self.key = key
+		self.children = None
+		self.visits = 0
+		self.total = 0.0
+		self.prior = prior
+		self.terminal = None
+		return self
+
+
+def rollout_evaluator(style: str, rollouts: int = 1, seed=None):
+	"""
+	Returns an evaluator that plays rollouts random games from each board in
+	one BatchSimulator. It returns the average result for the player to move
+	(1 win, 0 draw, -1 loss) and no priors
+	"""
+	rng = numpy.random.default_rng(seed)
+
+	def evaluate(boards: numpy.ndarray, players: numpy.ndarray) -> (numpy.ndarray, None):
+		"""
+		Plays the batch out and scores it
+		"""
+		simulator = othello_batch.BatchSimulator.from_boards(
+			numpy.repeat(boards, rollouts, axis = 0), numpy.repeat(players, rollouts),
+			style, int(rng.integers(1 << 31)))
+		simulator.play_out()
+		winners = simulator.winners().reshape(len(boards), rollouts)
+		to_move = players.reshape(-1, 1)
+		values = numpy.where(winners == to_move, 1.0, numpy.where(winners == 0, 0.0, -1.0))
+		return values.mean(axis = 1), None
+
+	return evaluate
+
+
+class MCTS:
+	"""
+	ATTRIBUTES:
+	evaluator, function (boards, players) -> (values, priors or None) where
+		values are for the player to move and priors are (N, rows * cols)
+	batch_size, leaves collected before each call to the evaluator
+	exploration, the c constant of UCT or PUCT
+	puct, True to use PUCT with the evaluator's priors instead of UCT
+	max_nodes, most nodes the tree can hold
+	root, root Node of the tree
+	"""
+
+	VIRTUAL_LOSS = 1
+
+	def __init__(self, evaluator=None, batch_size: int = 64, exploration: float = 1.4,
+			puct: bool = False, max_nodes: int = 200000, seed=None):
+		"""
+		Sets up an empty tree. Without an evaluator, leaves are scored by
+		random playouts
+		"""
+		self.evaluator = evaluator
+		self.batch_size = batch_size
+		self.exploration = exploration
+		self.puct = puct
+		self.max_nodes = max_nodes
+		self.root = None
+		self._seed = seed
+		self._free = []
+		self._live = 0
+
+	############################## NODE MEMORY ##########################
+
+	def _new_node(self, move, player: int, key: int, prior: float) -> Node:
+		"""
+		Returns a recycled node if there is one, otherwise a new one
+		"""
+		node = self._free.pop() if self._free else Node()
+		self._live += 1
+		return node.reset(move, player, key, prior)
+
+	def _recycle(self, node: Node, keep: Node = None) -> None:
+		"""
+		Puts node and everything below it on the free list, except keep and
+		its subtree
+		"""
+		stack = [node]
+		while stack:
+			current = stack.pop()
+			if current is keep:
+				continue
+			if current.children:
+				stack.extend(current.children)
+			current.children = None
+			self._free.append(current)
+			self._live -= 1
+
+	def tree_size(self) -> int:
+		"""
+		Returns the number of nodes in the tree
+		"""
+		return self._live
+
+	def _reroot(self, othello) -> None:
+		"""
+		Makes the node for othello's position the root, reusing the old tree
+		if the position is one or two plies below the old root
+		"""
+		key = othello.get_hash()
+		if self.root != None and self.root.key == key:
+			return
+
+		found = None
+		if self.root != None and self.root.children:
+			for child in self.root.children:
+				if child.key == key:
+					found = child
+				elif child.children:
+					for grandchild in child.children:
+						if grandchild.key == key:
+							found = grandchild
+				if found != None:
+					break
+
+		if self.root != None:
+			self._recycle(self.root, found)
+		if found == None:
+			found = self._new_node(None, 3 - othello.current_player, key, 1.0)
+		self.root = found
+
+	############################## SEARCH ##########################
+
+	def search(self, othello, max_time: float = 1.0, max_playouts: int = None) -> MCTSResult:
+		"""
+		Searches from othello's position until the time or playouts run out
+		and returns the most visited move. othello is changed while searching
+		but is back to how it was when this returns
+		"""
+		if self.evaluator == None:
+			self.evaluator = rollout_evaluator(othello.STYLE, seed = self._seed)
+		start = time.perf_counter()
+		deadline = None if max_time == None else start + max_time
+		self._reroot(othello)
+
+		playouts = 0
+		while True:
+			if max_playouts != None and playouts >= max_playouts:
+				break
+			if deadline != None and time.perf_counter() >= deadline and playouts > 0:
+				break
+			batch = self.batch_size
+			if max_playouts != None:
+				batch = min(batch, max_playouts - playouts)
+			playouts += self._run_batch(othello, batch)
+			if self.root.terminal != None:
+				break
+
+		seconds = time.perf_counter() - start
+		move = None
+		visits = 0
+		value = 0.0
+		if self.root.children:
+			best = max(self.root.children, key = lambda child: child.visits)
+			move = best.move
+			visits = best.visits
+			value = best.total / best.visits if best.visits else 0.0
+		return MCTSResult(move, visits, value, playouts, seconds,
+			playouts / seconds if seconds > 0 else 0.0, self._live)
+
+	def _run_batch(self, othello, size: int) -> int:
+		"""
+		Selects up to size leaves, evaluates them together and backs the
+		values up. Returns the number of playouts done
+		"""
+		leaves = []
+		boards = []
+		players = []
+		done = 0
+
+		for _ in range(size):
+			path, records = self._select(othello)
+			leaf = path[-1]
+			if leaf.terminal == None:
+				children = self._children(leaf, othello)
+			if leaf.terminal != None:
+				self._backup(path, leaf.terminal, leaf.player)
+				done += 1
+			else:
+				leaves.append((path, children, othello.current_player))
+				boards.append([line[:] for line in othello.game])
+				players.append(othello.current_player)
+
+			for record in reversed(records):
+				othello.undo_move(record)
+			if leaf is self.root and leaf.terminal != None:
+				break
+
+		if leaves:
+			values, priors = self.evaluator(numpy.array(boards, dtype = numpy.uint8),
+				numpy.array(players, dtype = numpy.uint8))
+			for index, (path, children, to_move) in enumerate(leaves):
+				self._expand(path[-1], children, to_move, othello.COLS,
+					None if priors is None else priors[index])
+				self._backup(path, float(values[index]), to_move)
+				done += 1
+		return done
+
+	def _select(self, othello) -> ([Node], ["undo records"]):
+		"""
+		Walks down from the root picking the best child each time until it
+		reaches a leaf, playing the moves on othello and adding virtual loss
+		along the way
+		"""
+		node = self.root
+		path = [node]
+		records = []
+		node.visits += self.VIRTUAL_LOSS
+		node.total -= self.VIRTUAL_LOSS
+		while node.children:
+			node = self._best_child(node)
+			if node.move == None:
+				records.append(othello.apply_pass())
+			else:
+				records.append(othello.apply_move(node.move[0], node.move[1]))
+			node.visits += self.VIRTUAL_LOSS
+			node.total -= self.VIRTUAL_LOSS
+			path.append(node)
+		return path, records
+
+	def _best_child(self, node: Node) -> Node:
+		"""
+		Picks the child with the highest UCT (or PUCT) score
+		"""
+		best = None
+		best_score = None
+		log_visits = math.log(max(node.visits, 1))
+		sqrt_visits = math.sqrt(max(node.visits, 1))
+		for child in node.children:
+			if child.visits == 0:
+				if not self.puct:
+					return child
+				score = self.exploration * child.prior * sqrt_visits
+			elif self.puct:
+				score = child.total / child.visits + self.exploration * child.prior * sqrt_visits / (1 + child.visits)
+			else:
+				score = child.total / child.visits + self.exploration * math.sqrt(log_visits / child.visits)
+			if best == None or score > best_score:
+				best = child
+				best_score = score
+		return best
+
+	def _children(self, leaf: Node, othello) -> [((int, int), int)]:
+		"""
+		Returns (move, hash) for every child of the leaf, which othello is
+		at, with a single None move if the player to move has to pass. Marks
+		the leaf terminal instead if neither player can move, with the
+		result for the player who moved into it
+		"""
+		moves = othello.legal_moves()
+		children = []
+		if not moves:
+			if not othello.legal_moves(3 - othello.current_player):
+				black, white = othello._count_pieces()
+				diff = black - white if leaf.player == 1 else white - black
+				if othello.STYLE == "<":
+					diff = -diff
+				leaf.terminal = float((diff > 0) - (diff < 0))
+				return children
+			moves = [None]
+		for move in moves:
+			record = othello.apply_pass() if move == None else othello.apply_move(move[0], move[1])
+			children.append((move, othello.get_hash()))
+			othello.undo_move(record)
+		return children
+
+	def _expand(self, leaf: Node, children: [((int, int), int)], to_move: int, cols: int, priors) -> None:
+		"""
+		Gives the leaf its children, unless an earlier leaf of the same batch
+		already did or the tree has no room for all of them
+		"""
+		if leaf.children != None:
+			return
+		if self._live + len(children) > self.max_nodes:
+			return
+		uniform = 1.0 / len(children)
+		nodes = []
+		for move, key in children:
+			if move == None or priors is None:
+				prior = uniform
+			else:
+				prior = float(priors[move[0] * cols + move[1]])
+			nodes.append(self._new_node(move, to_move, key, prior))
+		leaf.children = nodes
+
+	def _backup(self, path: [Node], value: float, player: int) -> None:
+		"""
+		Takes the virtual loss back off every node of path and adds value,
+		which is from player's point of view
+		"""
+		for node in path:
+			node.visits += 1 - self.VIRTUAL_LOSS
+			node.total += self.VIRTUAL_LOSS
+			node.total += value if node.player == player else -value
+
+
+############################## CHECKS ##########################
+
+def _versus_random(rows: int, cols: int, games: int, playouts: int, seed: int = 0) -> (int, [MCTSResult]):
+	"""
+	Plays MCTS against random moves, MCTS taking Black in even games and
+	White in odd ones, keeping one tree per game. Returns the MCTS wins and
+	the result of every search
+	"""
+	import random
+	import othello_bitboard
+	import othello_logic
+
+	rng = random.Random(seed)
+	wins = 0
+	results = []
+	for game in range(games):
+		othello = othello_bitboard.BitboardOthello(rows, cols, "B", ">",
+			othello_logic.starting_board(rows, cols))
+		mcts = MCTS(seed = seed + game)
+		side = 1 if game % 2 == 0 else 2
+		while True:
+			moves = sorted(othello.legal_moves())
+			if not moves:
+				if not othello.legal_moves(3 - othello.current_player):
+					break
+				othello.apply_pass()
+				continue
+			if othello.current_player == side:
+				before = othello.get_hash()
+				result = mcts.search(othello, max_time = None, max_playouts = playouts)
+				assert othello.get_hash() == before
+				results.append(result)
+				othello.apply_move(*result.move)
+			else:
+				othello.apply_move(*rng.choice(moves))
+		if othello.find_winner()[0] == othello.REFER[side]:
+			wins += 1
+	return wins, results
+
+
+if __name__ == "__main__":
+	for rows, cols in [(6, 6), (8, 8), (4, 16)]:
+		wins, results = _versus_random(rows, cols, 2, 256)
+		playouts = sum(result.playouts for result in results)
+		seconds = sum(result.seconds for result in results)
+		print("{}x{}: won {}/2 against random, {:.0f} playouts/s, largest tree {} nodes".format(
+			rows, cols, wins, playouts / seconds, max(result.tree_size for result in results)))
@@ -0,0 +1,451 @@
+"""
+Small policy and value network in plain NumPy, for CPU only. The input is
+four planes per square: the player to move's pieces, the opponent's pieces,
+the empty squares and the legal moves. A few 3x3 convolutions feed two heads:
+
+	policy  a 1x1 convolution giving one score per square, turned into move
+	        probabilities over the legal moves
+	value   the average over the board of the last layer, two dense layers
+	        and tanh, the expected result for the player to move (1 win,
+	        0 draw, -1 loss, following STYLE)
+
+Nothing depends on the board size, so the same weights run on any rows x
+cols. Arrays are kept channels last, (N, rows, cols, channels), so every
+convolution is one matrix multiply.
+
+NetEvaluator puts a bounded cache keyed by Zobrist hash (the same hash as
+Othello.get_hash) in front of the network and evaluates all the cache misses
+of a batch in one call. It can be passed straight to othello_mcts.MCTS as its
+evaluator.
+"""
+
+import collections
+import time
+
+import numpy
+
+import othello_batch
+import othello_bitboard
+import othello_logic
+import othello_patterns
+import othello_records
+
+PLANES = 4
+GRADIENT_TOLERANCE = 1e-6 # largest error _gradient_check allows
+
+
+############################## INPUTS ##########################
+
+def planes(boards: numpy.ndarray, players: numpy.ndarray) -> numpy.ndarray:
+	"""
+	Turns (N, rows, cols) boards in the Othello.game encoding and the player
+	to move on each into (N, rows, cols, 4) float32 input planes
+	"""
+	boards = numpy.asarray(boards, dtype = numpy.uint8)
+	players = numpy.asarray(players, dtype = numpy.uint8)
+	to_move = players[:, None, None]
+	result = numpy.empty(boards.shape + (PLANES,), dtype = numpy.float32)
+	result[..., 0] = boards == to_move
+	result[..., 1] = (boards != 0) & (boards != to_move)
+	result[..., 2] = boards == 0
+	result[..., 3] = othello_batch.legal_masks(boards, players)
+	return result
+
+
+def _columns(padded: numpy.ndarray, rows: int, cols: int) -> numpy.ndarray:
+	"""
+	Lays the 3x3 neighbourhood of every square side by side, giving
+	(N, rows, cols, 9 * channels) from a board padded by one square
+	"""
+	return numpy.concatenate([padded[:, dy:dy + rows, dx:dx + cols] for dy in range(3) for dx in range(3)],
+		axis = 3)
+
+
+############################## NETWORK ##########################
+
+class PolicyValueNet:
+	"""
+	ATTRIBUTES:
+	STYLE, win condition the value is trained for
+	params, dictionary of parameter name -> array
+	filters, channels of every convolution
+	"""
+
+	def __init__(self, filters: int = 32, layers: int = 3, hidden: int = 32, style: str = ">", seed: int = 0):
+		"""
+		Makes a network with random weights
+		"""
+		rng = numpy.random.default_rng(seed)
+		self.STYLE = style
+		self.filters = filters
+		self.params = {}
+		channels = PLANES
+		for layer in range(layers):
+			self.params["conv{}".format(layer)] = (rng.normal(size = (9 * channels, filters))
+				* numpy.sqrt(2 / (9 * channels))).astype(numpy.float32)
+			self.params["conv{}_bias".format(layer)] = numpy.zeros(filters, dtype = numpy.float32)
+			channels = filters
+		self.params["policy"] = (rng.normal(size = (filters, 1)) * numpy.sqrt(1 / filters)).astype(numpy.float32)
+		self.params["policy_bias"] = numpy.zeros(1, dtype = numpy.float32)
+		self.params["value1"] = (rng.normal(size = (filters, hidden)) * numpy.sqrt(2 / filters)).astype(numpy.float32)
+		self.params["value1_bias"] = numpy.zeros(hidden, dtype = numpy.float32)
+		self.params["value2"] = (rng.normal(size = (hidden, 1)) * numpy.sqrt(1 / hidden)).astype(numpy.float32)
+		self.params["value2_bias"] = numpy.zeros(1, dtype = numpy.float32)
+		self._adam = None
+
+	@property
+	def layers(self) -> int:
+		"""
+		Returns the number of convolution layers
+		"""
+		return sum(1 for name in self.params if name.startswith("conv") and not name.endswith("bias"))
+
+	def _forward(self, inputs: numpy.ndarray) -> (numpy.ndarray, numpy.ndarray, dict):
+		"""
+		Runs the network and returns the policy scores (N, rows * cols)
+		before the legal move mask, the values (N,) and what backward needs
+		"""
+		count, rows, cols, _ = inputs.shape
+		cache = {"columns": [], "activations": []}
+		x = inputs
+		for layer in range(self.layers):
+			padded = numpy.pad(x, ((0, 0), (1, 1), (1, 1), (0, 0)))
+			columns = _columns(padded, rows, cols)
+			x = numpy.maximum(columns @ self.params["conv{}".format(layer)] + self.params["conv{}_bias".format(layer)], 0)
+			cache["columns"].append(columns)
+			cache["activations"].append(x)
+
+		scores = (x @ self.params["policy"])[..., 0].reshape(count, rows * cols) + self.params["policy_bias"][0]
+		pooled = x.mean(axis = (1, 2))
+		hidden = numpy.maximum(pooled @ self.params["value1"] + self.params["value1_bias"], 0)
+		values = numpy.tanh(hidden @ self.params["value2"] + self.params["value2_bias"])[:, 0]
+		cache.update(pooled = pooled, hidden = hidden, values = values)
+		return scores, values, cache
+
+	def predict(self, inputs: numpy.ndarray) -> (numpy.ndarray, numpy.ndarray):
+		"""
+		Returns (policy, values) for a batch of input planes from planes().
+		policy is (N, rows * cols) move probabilities, zero off the legal
+		moves (all zero if there are none), values is (N,)
+		"""
+		scores, values, _ = self._forward(inputs)
+		return _masked_softmax(scores, inputs[..., 3].reshape(len(inputs), -1)), values
+
+	############################## TRAINING ##########################
+
+	def train_step(self, inputs: numpy.ndarray, moves: numpy.ndarray, results: numpy.ndarray,
+			rate: float = 0.001) -> (float, float):
+		"""
+		Takes one Adam step on a batch. moves is the square played from each
+		position (-1 for a pass, which only trains the value) and results the
+		final result for the player to move. Returns (policy loss, value loss)
+		"""
+		count, rows, cols, _ = inputs.shape
+		scores, values, cache = self._forward(inputs)
+		policy = _masked_softmax(scores, inputs[..., 3].reshape(count, -1))
+		played = moves >= 0
+		targets = numpy.zeros_like(policy)
+		targets[numpy.flatnonzero(played), moves[played]] = 1
+		policy_loss = float(-(numpy.log(policy[played, moves[played]] + 1e-9)).sum() / max(played.sum(), 1))
+		value_loss = float(((values - results) ** 2).mean())
+
+		grads = {}
+		d_scores = (policy - targets) * played[:, None] / max(played.sum(), 1)
+		x = cache["activations"][-1]
+		grads["policy"] = x.reshape(-1, self.filters).T @ d_scores.reshape(-1, 1)
+		grads["policy_bias"] = d_scores.sum().reshape(1)
+		d_x = d_scores.reshape(count, rows, cols, 1) * self.params["policy"][:, 0]
+
+		d_values = 2 * (values - results) / count * (1 - values ** 2)
+		grads["value2"] = cache["hidden"].T @ d_values[:, None]
+		grads["value2_bias"] = d_values.sum().reshape(1)
+		d_hidden = (d_values[:, None] @ self.params["value2"].T) * (cache["hidden"] > 0)
+		grads["value1"] = cache["pooled"].T @ d_hidden
+		grads["value1_bias"] = d_hidden.sum(axis = 0)
+		d_x = d_x + (d_hidden @ self.params["value1"].T)[:, None, None, :] / (rows * cols)
+
+		for layer in reversed(range(self.layers)):
+			d_x = d_x * (cache["activations"][layer] > 0)
+			columns = cache["columns"][layer]
+			weights = self.params["conv{}".format(layer)]
+			grads["conv{}".format(layer)] = columns.reshape(-1, columns.shape[3]).T @ d_x.reshape(-1, d_x.shape[3])
+			grads["conv{}_bias".format(layer)] = d_x.sum(axis = (0, 1, 2))
+			if layer > 0:
+				d_columns = d_x @ weights.T
+				channels = weights.shape[0] // 9
+				d_padded = numpy.zeros((count, rows + 2, cols + 2, channels), dtype = d_x.dtype)
+				for offset in range(9):
+					dy, dx = divmod(offset, 3)
+					d_padded[:, dy:dy + rows, dx:dx + cols] += d_columns[..., offset * channels:(offset + 1) * channels]
+				d_x = d_padded[:, 1:-1, 1:-1]
+
+		self._apply(grads, rate)
+		return policy_loss, value_loss
+
+	def _apply(self, grads: dict, rate: float, beta1: float = 0.9, beta2: float = 0.999) -> None:
+		"""
+		Updates the parameters with Adam
+		"""
+		if self._adam == None:
+			self._adam = {"step": 0, "m": {name: numpy.zeros_like(value) for name, value in self.params.items()},
+				"v": {name: numpy.zeros_like(value) for name, value in self.params.items()}}
+		adam = self._adam
+		adam["step"] += 1
+		correction = numpy.sqrt(1 - beta2 ** adam["step"]) / (1 - beta1 ** adam["step"])
+		for name, grad in grads.items():
+			adam["m"][name] = beta1 * adam["m"][name] + (1 - beta1) * grad
+			adam["v"][name] = beta2 * adam["v"][name] + (1 - beta2) * grad * grad
+			self.params[name] -= (rate * correction * adam["m"][name] / (numpy.sqrt(adam["v"][name]) + 1e-8)).astype(numpy.float32)
+
+	############################## SAVING ##########################
+
+	def save(self, path: str) -> None:
+		"""
+		Writes the weights to path
+		"""
+		with open(path, "wb") as output:
+			numpy.savez_compressed(output, style = self.STYLE, **self.params)
+
+	@classmethod
+	def load(cls, path: str) -> "PolicyValueNet":
+		"""
+		Reads weights written by save
+		"""
+		with numpy.load(path) as data:
+			net = cls(filters = data["conv0"].shape[1], layers = 0, hidden = data["value1"].shape[1],
+				style = str(data["style"]))
+			net.params = {name: data[name] for name in data.files if name != "style"}
+		return net
+
+
+def _masked_softmax(scores: numpy.ndarray, mask: numpy.ndarray) -> numpy.ndarray:
+	"""
+	Softmax of each row over the squares where mask is set
+	"""
+	scores = numpy.where(mask > 0, scores, -numpy.inf)
+	top = scores.max(axis = 1, keepdims = True)
+	top[~numpy.isfinite(top)] = 0
+	exponents = numpy.exp(scores - top)
+	totals = exponents.sum(axis = 1, keepdims = True)
+	return exponents / numpy.where(totals > 0, totals, 1)
+
+
+############################## TRAINING DATA ##########################
+
+def training_data(games, style: str = ">") -> [(numpy.ndarray, numpy.ndarray, numpy.ndarray)]:
+	"""
+	Returns (inputs, moves, results) for every position of the games played
+	with style, one tuple per board size since sizes can't share a batch.
+	Games are othello_records Games or othello_selfplay dictionaries
+	"""
+	by_size = collections.defaultdict(lambda: ([], [], [], []))
+	for game in games:
+		game = othello_patterns._as_game(game)
+		if game.style != style:
+			continue
+		diff = game.black - game.white
+		if style == "<":
+			diff = -diff
+		winner = 0 if diff == 0 else (1 if diff > 0 else 2)
+		boards, players, moves, results = by_size[(game.rows, game.cols)]
+		for ply, othello in othello_records.positions(game, othello_bitboard.BitboardOthello):
+			if ply == len(game.moves):
+				break
+			move = game.moves[ply]
+			boards.append([line[:] for line in othello.game])
+			players.append(othello.current_player)
+			moves.append(-1 if move == None else move[0] * game.cols + move[1])
+			results.append(0 if winner == 0 else (1 if winner == othello.current_player else -1))
+
+	data = []
+	for boards, players, moves, results in by_size.values():
+		data.append((planes(numpy.array(boards), numpy.array(players)), numpy.array(moves),
+			numpy.array(results, dtype = numpy.float32)))
+	return data
+
+
+def train(net: PolicyValueNet, data, epochs: int = 5, batch: int = 256, rate: float = 0.001,
+		seed: int = 0) -> [(float, float)]:
+	"""
+	Trains on training_data in shuffled batches and returns the average
+	(policy loss, value loss) of each epoch
+	"""
+	rng = numpy.random.default_rng(seed)
+	history = []
+	for _ in range(epochs):
+		batches = [(inputs, moves, results, order[start:start + batch]) for inputs, moves, results in data
+			for order in [rng.permutation(len(inputs))] for start in range(0, len(inputs), batch)]
+		rng.shuffle(batches)
+		losses = [net.train_step(inputs[picked], moves[picked], results[picked], rate)
+			for inputs, moves, results, picked in batches]
+		history.append(tuple(numpy.mean(losses, axis = 0).tolist()))
+	return history
+
+
+############################## CACHED EVALUATION ##########################
+
+class NetEvaluator:
+	"""
+	ATTRIBUTES:
+	net, the PolicyValueNet
+	cache_size, most positions kept in the cache
+	hits, misses, cache lookups that found or didn't find the position
+	"""
+
+	def __init__(self, net: PolicyValueNet, cache_size: int = 100000):
+		"""
+		Starts with an empty cache
+		"""
+		self.net = net
+		self.cache_size = cache_size
+		self.hits = 0
+		self.misses = 0
+		self._cache = collections.OrderedDict()
+		self._keys = {}
+
+	def _hashes(self, boards: numpy.ndarray, players: numpy.ndarray) -> [int]:
+		"""
+		Returns the Othello.get_hash of every board, worked out for the
+		whole batch at once
+		"""
+		count, rows, cols = boards.shape
+		if (rows, cols) not in self._keys:
+			pieces, _, side = othello_logic.zobrist_keys(rows, cols)
+			self._keys[(rows, cols)] = (numpy.array(pieces, dtype = numpy.uint64), numpy.uint64(side))
+		pieces, side = self._keys[(rows, cols)]
+		keys = pieces[boards.reshape(count, -1), numpy.arange(rows * cols)]
+		hashes = numpy.bitwise_xor.reduce(keys, axis = 1) ^ numpy.where(players == 2, side, numpy.uint64(0))
+		return hashes.tolist()
+
+	def __call__(self, boards: numpy.ndarray, players: numpy.ndarray) -> (numpy.ndarray, numpy.ndarray):
+		"""
+		Returns (values, policy) for a batch of (N, rows, cols) boards and the
+		players to move, running the network once for every position not in
+		the cache. Matches the evaluator othello_mcts.MCTS takes
+		"""
+		boards = numpy.asarray(boards, dtype = numpy.uint8)
+		players = numpy.asarray(players, dtype = numpy.uint8)
+		count, rows, cols = boards.shape
+		values = numpy.empty(count, dtype = numpy.float32)
+		policy = numpy.empty((count, rows * cols), dtype = numpy.float32)
+
+		missing = []
+		for index, key in enumerate(self._hashes(boards, players)):
+			key = (rows, cols, key)
+			found = self._cache.get(key)
+			if found == None:
+				missing.append((index, key))
+			else:
+				self._cache.move_to_end(key)
+				values[index], policy[index] = found
+		self.hits += count - len(missing)
+		self.misses += len(missing)
+
+		if missing:
+			picked = [index for index, _ in missing]
+			new_policy, new_values = self.net.predict(planes(boards[picked], players[picked]))
+			policy[picked] = new_policy
+			values[picked] = new_values
+			for (index, key), row_policy, value in zip(missing, new_policy, new_values):
+				self._cache[key] = (value, row_policy)
+			while len(self._cache) > self.cache_size:
+				self._cache.popitem(last = False)
+		return values, policy
+
+	def evaluate(self, othello) -> (float, numpy.ndarray):
+		"""
+		Returns (value, policy) for othello's position
+		"""
+		values, policy = self(numpy.array([othello.game]), numpy.array([othello.current_player]))
+		return float(values[0]), policy[0]
+
+
+############################## THROUGHPUT ##########################
+
+def throughput(net: PolicyValueNet, rows: int, cols: int, batch_sizes=(1, 16, 64, 256, 1024),
+		seconds: float = 1.0) -> {int: float}:
+	"""
+	Returns positions per second of net.predict on random boards for each
+	batch size, planes included
+	"""
+	rng = numpy.random.default_rng(0)
+	result = {}
+	for size in batch_sizes:
+		boards = rng.integers(0, 3, size = (size, rows, cols), dtype = numpy.uint8)
+		players = rng.integers(1, 3, size = size, dtype = numpy.uint8)
+		done = 0
+		start = time.perf_counter()
+		while time.perf_counter() - start < seconds:
+			net.predict(planes(boards, players))
+			done += size
+		result[size] = done / (time.perf_counter() - start)
+	return result
+
+
+def _gradient_check() -> float:
+	"""
+	Returns the largest difference between train_step's gradients and
+	numerical ones on a tiny network run in float64. The difference is
+	relative to the gradients' size but never to less than 1e-3, so
+	gradients that should be zero (like policy_bias, which softmax ignores)
+	don't turn rounding into a big error. Should be under GRADIENT_TOLERANCE
+	"""
+	net = PolicyValueNet(filters = 4, layers = 2, hidden = 3, seed = 1)
+	for name in net.params:
+		net.params[name] = net.params[name].astype(numpy.float64)
+	rng = numpy.random.default_rng(2)
+	boards = rng.integers(0, 3, size = (3, 4, 6), dtype = numpy.uint8)
+	inputs = planes(boards, numpy.array([1, 2, 1])).astype(numpy.float64)
+	inputs[..., 3] = 1
+	moves = numpy.array([0, 5, -1])
+	results = numpy.array([1.0, -1.0, 0.0])
+
+	def loss() -> float:
+		scores, values, _ = net._forward(inputs)
+		policy = _masked_softmax(scores, inputs[..., 3].reshape(3, -1))
+		return -numpy.log(policy[[0, 1], [0, 5]]).sum() / 2 + ((values - results) ** 2).mean()
+
+	captured = {}
+	net._apply = lambda grads, rate: captured.update(grads)
+	net.train_step(inputs, moves, results)
+	worst = 0.0
+	for name, grad in captured.items():
+		flat = net.params[name].reshape(-1)
+		for index in range(0, flat.size, max(1, flat.size // 5)):
+			saved = flat[index]
+			flat[index] = saved + 1e-6
+			above = loss()
+			flat[index] = saved - 1e-6
+			below = loss()
+			flat[index] = saved
+			numeric = (above - below) / 2e-6
+			analytic = grad.reshape(-1)[index]
+			worst = max(worst, abs(numeric - analytic) / max(1e-3, abs(numeric) + abs(analytic)))
+	return worst
+
+
+if __name__ == "__main__":
+	import othello_selfplay
+
+	error = _gradient_check()
+	print("largest gradient error {:.2e}".format(error))
+	assert error < GRADIENT_TOLERANCE
+	specs = othello_selfplay.game_specs(300, [(8, 8), (6, 10)], ["B", "W"], [">"], 0)
+	games = [othello_selfplay.play_game(spec) for spec in specs]
+	net = PolicyValueNet()
+	start = time.perf_counter()
+	for epoch, (policy_loss, value_loss) in enumerate(train(net, training_data(games), epochs = 3), 1):
+		print("epoch {}: policy loss {:.3f}, value loss {:.3f}".format(epoch, policy_loss, value_loss))
+	print("trained in {:.1f}s".format(time.perf_counter() - start))
+
+	for rows, cols in [(4, 4), (8, 8), (6, 10), (16, 16)]:
+		numbers = throughput(net, rows, cols, seconds = 0.5)
+		print("{}x{}: ".format(rows, cols) + ", ".join("batch {} {:.0f}/s".format(size, speed)
+			for size, speed in numbers.items()))
+
+	othello = othello_bitboard.BitboardOthello(8, 8, "B", ">", othello_logic.starting_board(8, 8))
+	evaluator = NetEvaluator(net)
+	value, policy = evaluator.evaluate(othello)
+	assert evaluator._hashes(numpy.array([othello.game]), numpy.array([othello.current_player]))[0] == othello.get_hash()
+	evaluator.evaluate(othello)
+	print("start position value {:.3f}, cache hits {} misses {}".format(value, evaluator.hits, evaluator.misses))
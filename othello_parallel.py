@@ -0,0 +1,257 @@
+"""
+Lazy SMP: the same othello_ai search run by several processes at once, all
+sharing one transposition table in multiprocessing.shared_memory. Nothing is
+split up between the workers, they just run into each other's results in the
+table, so the main worker (worker 0) reaches each depth sooner. The helpers
+are nudged apart by searching one ply deeper on odd workers and by trying
+the root moves in a different order.
+
+The table is an othello_tt.SharedTranspositionTable, which needs no locks.
+The worker processes and the table stay up between searches, like
+othello_worker.SearchWorker, so starting a search costs one message per
+worker.
+
+scaling() measures time to depth and search overhead (extra nodes searched
+compared to one worker) for a list of worker counts.
+"""
+
+import argparse
+import collections
+import multiprocessing
+import multiprocessing.shared_memory
+import random
+import time
+
+import othello_ai
+import othello_bitboard
+import othello_logic
+import othello_tt
+
+TT_MB = 64
+
+ParallelResult = collections.namedtuple("ParallelResult",
+	["move", "score", "depth", "nodes", "seconds", "nodes_per_second", "workers", "depth_seconds"])
+
+
+############################## WORKERS ##########################
+
+class _LazySearch(othello_ai.AlphaBetaSearch):
+	"""
+	AlphaBetaSearch that also records when each depth finished, and for
+	helpers searches a bit differently from the main worker
+
+	ATTRIBUTES:
+	offset, plies added to every iteration's depth (0 for the main worker)
+	depth_seconds, (depth, seconds since the search started) of every
+	finished iteration
+	"""
+
+	def __init__(self, worker: int, **kwargs):
+		"""
+		Sets up the search for worker number worker
+		"""
+		super().__init__(**kwargs)
+		self.offset = worker % 2
+		self.depth_seconds = []
+		self._rng = random.Random(worker) if worker else None
+		self._started = 0.0
+
+	def search(self, othello) -> othello_ai.SearchResult:
+		"""
+		Runs AlphaBetaSearch.search, timing every depth
+		"""
+		self.depth_seconds = []
+		self._started = time.perf_counter()
+		return super().search(othello)
+
+	def _search_root(self, othello, moves: [(int, int)], depth: int, best) -> ((int, int), int):
+		"""
+		Searches the root moves to depth plus offset, helpers in shuffled order
+		(corners and the best move so far still go first)
+		"""
+		if self._rng != None:
+			moves = list(moves)
+			self._rng.shuffle(moves)
+		depth += self.offset
+		result = super()._search_root(othello, moves, depth, best)
+		self.depth_seconds.append((depth, time.perf_counter() - self._started))
+		return result
+
+
+def _serve(worker: int, connection, memory_name: str, stopped) -> None:
+	"""
+	Runs in each worker process: searches every position sent over
+	connection and sends back (job, SearchResult, depth_seconds) until it
+	gets None
+	"""
+	memory = multiprocessing.shared_memory.SharedMemory(memory_name)
+	tt = othello_tt.SharedTranspositionTable(buffer = memory.buf)
+	try:
+		while True:
+			message = connection.recv()
+			if message == None:
+				break
+			job, position, max_time, max_depth = message
+			othello = othello_bitboard.BitboardOthello.from_bytes(position)
+			search = _LazySearch(worker, max_time = max_time, max_depth = max_depth, tt = tt,
+				stop = lambda: stopped.value >= job)
+			result = search.search(othello)
+			connection.send((job, result, search.depth_seconds))
+	finally:
+		del tt
+		memory.close()
+
+
+class ParallelSearch:
+	"""
+	ATTRIBUTES:
+	workers, number of search processes
+	tt, the shared table as seen from this process (for clearing and stats)
+	job, number of the latest search
+	"""
+
+	def __init__(self, workers: int = None, tt_mb: float = TT_MB):
+		"""
+		Makes the shared table and starts the worker processes, one per core
+		if workers isn't given
+		"""
+		self.workers = workers or multiprocessing.cpu_count()
+		entries = 1 << ((int(tt_mb * 1024 * 1024) // othello_tt.ENTRY.size).bit_length() - 1)
+		self._memory = multiprocessing.shared_memory.SharedMemory(create = True,
+			size = entries * othello_tt.ENTRY.size)
+		self.tt = othello_tt.SharedTranspositionTable(buffer = self._memory.buf)
+		self.job = 0
+		self._stopped = multiprocessing.Value("q", 0, lock = False)
+		self._connections = []
+		self._processes = []
+		for worker in range(self.workers):
+			connection, child = multiprocessing.Pipe()
+			process = multiprocessing.Process(target = _serve,
+				args = (worker, child, self._memory.name, self._stopped), daemon = True)
+			process.start()
+			self._connections.append(connection)
+			self._processes.append(process)
+
+	def search(self, othello, max_time=1.0, max_depth=None) -> ParallelResult:
+		"""
+		Searches othello's position on every worker until the main worker
+		runs out of time or finishes max_depth, then stops the helpers. nodes
+		counts every worker's nodes, depth and depth_seconds are the main
+		worker's
+		"""
+		start = time.perf_counter()
+		self.job += 1
+		position = othello.to_bytes()
+		for connection in self._connections:
+			connection.send((self.job, position, max_time, max_depth))
+
+		results = [None] * self.workers
+		job, results[0], depth_seconds = self._connections[0].recv()
+		self._stopped.value = self.job
+		for worker in range(1, self.workers):
+			job, results[worker], _ = self._connections[worker].recv()
+		seconds = time.perf_counter() - start
+
+		main = results[0]
+		nodes = sum(result.nodes for result in results)
+		return ParallelResult(main.move, main.score, main.depth, nodes, seconds,
+			nodes / seconds if seconds > 0 else 0.0, self.workers, depth_seconds)
+
+	def close(self) -> None:
+		"""
+		Stops the workers and frees the shared table
+		"""
+		for connection in self._connections:
+			connection.send(None)
+		for process in self._processes:
+			process.join(5)
+			if process.is_alive():
+				process.terminate()
+		self._connections = []
+		self._processes = []
+		del self.tt
+		self._memory.close()
+		self._memory.unlink()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args) -> None:
+		self.close()
+
+
+############################## MEASURING ##########################
+
+def sample_positions(rows: int, cols: int, count: int, plies: int, seed: int = 0) -> [othello_bitboard.BitboardOthello]:
+	"""
+	Returns count positions reached by plies random moves from the start
+	"""
+	rng = random.Random(seed)
+	result = []
+	while len(result) < count:
+		othello = othello_bitboard.BitboardOthello(rows, cols, "B", ">", othello_logic.starting_board(rows, cols))
+		for _ in range(plies):
+			legal = sorted(othello.legal_moves())
+			if not legal:
+				break
+			move = rng.choice(legal)
+			othello.apply_move(move[0], move[1])
+		if othello.legal_moves():
+			result.append(othello)
+	return result
+
+
+def scaling(positions: [othello_bitboard.BitboardOthello], worker_counts: [int], depth: int,
+		tt_mb: float = TT_MB) -> [dict]:
+	"""
+	Searches every position to depth with each worker count, starting from
+	an empty table each time. Returns one row per worker count with the
+	total time to depth, nodes, speedup and search overhead compared to the
+	first worker count
+	"""
+	rows = []
+	for workers in worker_counts:
+		seconds = 0.0
+		nodes = 0
+		with ParallelSearch(workers, tt_mb) as parallel:
+			for othello in positions:
+				parallel.tt.clear()
+				result = parallel.search(othello, max_time = None, max_depth = depth)
+				seconds += result.seconds
+				nodes += result.nodes
+		rows.append({"workers": workers, "seconds": seconds, "nodes": nodes})
+	for row in rows:
+		row["speedup"] = rows[0]["seconds"] / row["seconds"] if row["seconds"] > 0 else 0.0
+		row["overhead"] = row["nodes"] / rows[0]["nodes"] - 1 if rows[0]["nodes"] else 0.0
+	return rows
+
+
+def main(argv=None) -> None:
+	"""
+	Prints time to depth, speedup and search overhead for several worker
+	counts
+	"""
+	parser = argparse.ArgumentParser(description = "Measures lazy SMP speedup")
+	parser.add_argument("--size", default = "8x8")
+	parser.add_argument("--depth", type = int, default = 6)
+	parser.add_argument("--positions", type = int, default = 4)
+	parser.add_argument("--plies", type = int, default = 12, help = "random moves played to reach each position")
+	parser.add_argument("--workers", default = None, help = "comma separated worker counts")
+	parser.add_argument("--tt-mb", type = float, default = TT_MB)
+	args = parser.parse_args(argv)
+
+	rows, cols = (int(size) for size in args.size.lower().split("x"))
+	if args.workers == None:
+		counts = sorted({1, 2, 4, 8, multiprocessing.cpu_count()})
+	else:
+		counts = [int(count) for count in args.workers.split(",")]
+	positions = sample_positions(rows, cols, args.positions, args.plies)
+	print("{}x{} depth {}, {} positions, {} cores".format(rows, cols, args.depth, len(positions),
+		multiprocessing.cpu_count()))
+	print("workers  seconds     nodes  speedup  overhead")
+	for row in scaling(positions, counts, args.depth, args.tt_mb):
+		print("{workers:7d} {seconds:8.2f} {nodes:9d} {speedup:8.2f} {overhead:8.1%}".format(**row))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,439 @@
+"""
+Pattern evaluation learned from game records. A pattern is a fixed line or
+block of squares (an edge, the 3x3 corner, a diagonal or a 2x5 block along
+an edge) read as a base 3 number using the Othello.game encoding (0 empty,
+1 black, 2 white), and that number picks a weight out of the pattern's
+table. Every corner of the board gets its own copy of each pattern, read
+from the corner outwards, so all the copies share one table. The score is
+the sum of the weights plus a bias, with a separate set of tables for each
+phase of the game (by number of pieces on the board).
+
+Weights are fitted with NumPy to the final disc difference of recorded games
+(following STYLE, from Black's point of view) and saved in one file per board
+size. PatternEvaluator keeps the pattern numbers of a position up to date as
+moves are made and taken back, so inside a search only the patterns touching
+the placed and flipped squares are changed.
+"""
+
+import collections
+
+import numpy
+
+import othello_bitboard
+import othello_records
+
+PHASES = 4
+EDGE = 8 # longest edge and diagonal pattern
+SCALE = 100 # evaluate returns hundredths of a disc
+
+Pattern = collections.namedtuple("Pattern", ["name", "instances"])
+
+
+############################## PATTERNS ##########################
+
+def _corner_frames(rows: int, cols: int) -> ["function (i, j) -> (row, col)", bool]:
+	"""
+	Returns a function for every corner and direction that turns (i, j), i
+	squares away from the edge and j squares along it, into (row, col),
+	along with whether that direction runs along the rows
+	"""
+	frames = []
+	for corner_row, corner_col in [(0, 0), (0, cols - 1), (rows - 1, 0), (rows - 1, cols - 1)]:
+		row_step = 1 if corner_row == 0 else -1
+		col_step = 1 if corner_col == 0 else -1
+		frames.append((lambda i, j, r=corner_row, c=corner_col, dr=row_step, dc=col_step:
+			(r + dr * i, c + dc * j), True))
+		frames.append((lambda i, j, r=corner_row, c=corner_col, dr=row_step, dc=col_step:
+			(r + dr * j, c + dc * i), False))
+	return frames
+
+
+def patterns(rows: int, cols: int) -> [Pattern]:
+	"""
+	Returns every pattern for the board size, each with its instances as
+	lists of squares (row * cols + col) in base 3 digit order. Patterns that
+	don't fit the board are left out, and edges of different lengths (on
+	boards that aren't square) get separate tables
+	"""
+	found = {}
+	order = []
+
+	def add(name: str, instance: [(int, int)]) -> None:
+		if name not in found:
+			found[name] = []
+			order.append(name)
+		found[name].append([row * cols + col for row, col in instance])
+
+	for frame, along_rows in _corner_frames(rows, cols):
+		along = cols if along_rows else rows
+		across = rows if along_rows else cols
+		length = min(EDGE, along)
+		add("edge{}".format(length), [frame(0, j) for j in range(length)])
+		if along >= 5 and across >= 2:
+			add("block", [frame(i, j) for i in range(2) for j in range(5)])
+		if along_rows:
+			if rows >= 3 and cols >= 3:
+				add("corner", [frame(i, j) for i in range(3) for j in range(3)])
+			add("diagonal", [frame(k, k) for k in range(min(EDGE, rows, cols))])
+
+	return [Pattern(name, found[name]) for name in order]
+
+
+def phase(pieces: int, squares: int, phases: int = PHASES) -> int:
+	"""
+	Returns the phase for a position with pieces on a board of squares
+	"""
+	return min(phases - 1, pieces * phases // (squares + 1))
+
+
+############################## WEIGHTS ##########################
+
+class PatternWeights:
+	"""
+	ATTRIBUTES:
+	ROWS, COLS, board size the weights are for
+	STYLE, win condition the games were played with
+	patterns, the Patterns from patterns(ROWS, COLS)
+	offsets, where each pattern's table starts in a row of weights
+	weights, (phases, size) array, one row of every table per phase
+	bias, (phases,) array added to every score
+	"""
+
+	def __init__(self, rows: int, cols: int, style: str = ">", phases: int = PHASES):
+		"""
+		Sets up all zero weights for the board size
+		"""
+		self.ROWS = rows
+		self.COLS = cols
+		self.STYLE = style
+		self.patterns = patterns(rows, cols)
+		self.offsets = []
+		size = 0
+		for pattern in self.patterns:
+			self.offsets.append(size)
+			size += 3 ** len(pattern.instances[0])
+		self.weights = numpy.zeros((phases, size))
+		self.bias = numpy.zeros(phases)
+
+	@property
+	def phases(self) -> int:
+		return len(self.bias)
+
+	def save(self, path: str = None) -> str:
+		"""
+		Writes the weights to path (weights_path(ROWS, COLS) if not given)
+		and returns the path
+		"""
+		if path == None:
+			path = weights_path(self.ROWS, self.COLS)
+		with open(path, "wb") as output:
+			numpy.savez_compressed(output, rows = self.ROWS, cols = self.COLS, style = self.STYLE,
+				names = [pattern.name for pattern in self.patterns], weights = self.weights, bias = self.bias)
+		return path
+
+	@classmethod
+	def load(cls, path: str) -> "PatternWeights":
+		"""
+		Reads weights written by save. Raises ValueError if the patterns in
+		the file don't match the ones for its board size
+		"""
+		with numpy.load(path) as data:
+			weights = cls(int(data["rows"]), int(data["cols"]), str(data["style"]), len(data["bias"]))
+			if [str(name) for name in data["names"]] != [pattern.name for pattern in weights.patterns] \
+					or data["weights"].shape != weights.weights.shape:
+				raise ValueError("{} doesn't match the patterns for its board size".format(path))
+			weights.weights = data["weights"]
+			weights.bias = data["bias"]
+		return weights
+
+
+def weights_path(rows: int, cols: int) -> str:
+	"""
+	Returns the default weight file name for a board size
+	"""
+	return "patterns_{}x{}.npz".format(rows, cols)
+
+
+############################## EVALUATION ##########################
+
+class PatternEvaluator:
+	"""
+	ATTRIBUTES:
+	weights, the PatternWeights being used
+	indices, current table position of every instance of every pattern
+	"""
+
+	def __init__(self, weights: PatternWeights):
+		"""
+		Prepares the tables and which instances every square belongs to
+		"""
+		self.weights = weights
+		self._cols = weights.COLS
+		self._squares = weights.ROWS * weights.COLS
+		self._tables = [row.tolist() for row in weights.weights]
+		self._bias = weights.bias.tolist()
+
+		self._instances = []
+		self._touches = [[] for _ in range(self._squares)]
+		for pattern, offset in zip(weights.patterns, weights.offsets):
+			for instance in pattern.instances:
+				number = len(self._instances)
+				self._instances.append((offset, instance))
+				for digit, square in enumerate(instance):
+					self._touches[square].append((number, 3 ** digit))
+		self.indices = [offset for offset, _ in self._instances]
+		self._pieces = 0
+
+	def reset(self, othello) -> None:
+		"""
+		Reads every pattern of othello's board from scratch
+		"""
+		cells = [value for line in othello.game for value in line]
+		for number, (offset, instance) in enumerate(self._instances):
+			index = 0
+			for square in reversed(instance):
+				index = index * 3 + cells[square]
+			self.indices[number] = offset + index
+		self._pieces = sum(othello._count_pieces())
+
+	def _squares_of(self, square: (int, int), flips) -> (int, [int]):
+		"""
+		Returns the placed square and the flipped squares of an undo record
+		as square numbers, for either backend
+		"""
+		if isinstance(flips, int):
+			flips = othello_bitboard.bits_to_squares(flips, self._cols)
+		return square[0] * self._cols + square[1], [row * self._cols + col for row, col in flips]
+
+	def played(self, record: ("(row, col)", "flips", "player")) -> None:
+		"""
+		Updates the patterns after the move of an apply_move record
+		"""
+		square, flips, player = record
+		if square == None:
+			return
+		placed, flipped = self._squares_of(square, flips)
+		indices = self.indices
+		for number, power in self._touches[placed]:
+			indices[number] += player * power
+		change = player - (3 - player)
+		for flip in flipped:
+			for number, power in self._touches[flip]:
+				indices[number] += change * power
+		self._pieces += 1
+
+	def undone(self, record: ("(row, col)", "flips", "player")) -> None:
+		"""
+		Updates the patterns after the move of record was taken back
+		"""
+		square, flips, player = record
+		if square == None:
+			return
+		placed, flipped = self._squares_of(square, flips)
+		indices = self.indices
+		for number, power in self._touches[placed]:
+			indices[number] -= player * power
+		change = player - (3 - player)
+		for flip in flipped:
+			for number, power in self._touches[flip]:
+				indices[number] -= change * power
+		self._pieces -= 1
+
+	def score(self) -> float:
+		"""
+		Returns the predicted final disc difference for Black (following
+		STYLE) of the current position
+		"""
+		stage = phase(self._pieces, self._squares, len(self._tables))
+		table = self._tables[stage]
+		return self._bias[stage] + sum([table[index] for index in self.indices])
+
+	def evaluate(self, othello, player: int) -> int:
+		"""
+		Scores the current position for player in hundredths of a disc, like
+		othello_ai.evaluate does with its own units
+		"""
+		value = int(self.score() * SCALE)
+		return value if player == 1 else -value
+
+
+############################## TRAINING ##########################
+
+def _as_game(record) -> othello_records.Game:
+	"""
+	Turns an othello_selfplay record dictionary into a Game, and leaves Games
+	as they are
+	"""
+	if isinstance(record, dict):
+		moves = [None if move == None else tuple(move) for move in record["moves"]]
+		return othello_records.Game(record["rows"], record["cols"], record["first"], record["style"],
+			record.get("setup"), moves, record["black"], record["white"])
+	return record
+
+
+def training_data(weights: PatternWeights, games) -> (numpy.ndarray, numpy.ndarray, numpy.ndarray):
+	"""
+	Returns (indices, phases, targets) for every position of the games that
+	match the weights' board size and STYLE. indices is (positions,
+	instances), phases and targets are (positions,)
+	"""
+	evaluator = PatternEvaluator(weights)
+	rows = []
+	stages = []
+	targets = []
+	for game in games:
+		game = _as_game(game)
+		if (game.rows, game.cols, game.style) != (weights.ROWS, weights.COLS, weights.STYLE):
+			continue
+		target = game.black - game.white
+		if game.style == "<":
+			target = -target
+		othello = othello_records.start_position(game, othello_bitboard.BitboardOthello)
+		evaluator.reset(othello)
+		for move in game.moves:
+			rows.append(list(evaluator.indices))
+			stages.append(phase(evaluator._pieces, evaluator._squares, weights.phases))
+			targets.append(target)
+			if move == None:
+				othello.apply_pass()
+			else:
+				evaluator.played(othello.apply_move(move[0], move[1]))
+	return (numpy.array(rows, dtype = numpy.int64).reshape(len(rows), len(evaluator.indices)),
+		numpy.array(stages, dtype = numpy.int64), numpy.array(targets, dtype = numpy.float64))
+
+
+def _flat(weights: PatternWeights, indices: numpy.ndarray, stages: numpy.ndarray) -> numpy.ndarray:
+	"""
+	Turns training indices into positions in the flattened weights
+	"""
+	return indices + (stages * weights.weights.shape[1])[:, None]
+
+
+def predict(weights: PatternWeights, indices: numpy.ndarray, stages: numpy.ndarray) -> numpy.ndarray:
+	"""
+	Returns the score of every position of the training data at once
+	"""
+	return weights.weights.ravel()[_flat(weights, indices, stages)].sum(axis = 1) + weights.bias[stages]
+
+
+def fit(weights: PatternWeights, indices: numpy.ndarray, stages: numpy.ndarray, targets: numpy.ndarray,
+		epochs: int = 50, rate: float = 0.5, decay: float = 1.0) -> [float]:
+	"""
+	Fits the weights to the training data by gradient descent on the mean
+	squared error. Each weight's step is divided by how often it was seen,
+	since rare pattern numbers would otherwise barely move and common ones
+	would overshoot, and by the number of instances, which all share the
+	error of a position. decay pulls weights towards zero so the ones only
+	seen in a few games don't just learn those games' results. Returns the
+	mean absolute error after each epoch
+	"""
+	flat = _flat(weights, indices, stages)
+	seen = numpy.bincount(flat.ravel(), minlength = weights.weights.size).reshape(weights.weights.shape)
+	step = rate / (numpy.maximum(seen, 1) * indices.shape[1])
+	phase_seen = numpy.maximum(numpy.bincount(stages, minlength = weights.phases), 1)
+
+	errors = []
+	for _ in range(epochs):
+		error = targets - predict(weights, indices, stages)
+		gradient = numpy.zeros(weights.weights.size)
+		numpy.add.at(gradient, flat, error[:, None])
+		gradient = gradient.reshape(weights.weights.shape) - decay * seen * weights.weights
+		weights.weights += step * gradient
+		weights.bias += rate * numpy.bincount(stages, error, weights.phases) / phase_seen
+		errors.append(float(numpy.abs(error).mean()))
+	return errors
+
+
+def train(rows: int, cols: int, games, style: str = ">", phases: int = PHASES,
+		epochs: int = 50) -> (PatternWeights, [float]):
+	"""
+	Fits new weights for a board size from game records (othello_records
+	Games or othello_selfplay dictionaries) and returns them with the mean
+	absolute error after each epoch
+	"""
+	weights = PatternWeights(rows, cols, style, phases)
+	indices, stages, targets = training_data(weights, games)
+	return weights, fit(weights, indices, stages, targets, epochs)
+
+
+############################## CHECKS ##########################
+
+def check(games: int = 20) -> None:
+	"""
+	Raises AssertionError if updating the patterns move by move ever
+	disagrees with reading them from scratch, on either backend, or if
+	weights don't survive a save and load
+	"""
+	import os
+	import random
+	import othello_logic
+
+	rng = random.Random(0)
+	for rows, cols in [(4, 4), (8, 8), (6, 10), (4, 16), (16, 16)]:
+		weights = PatternWeights(rows, cols)
+		weights.weights = numpy.random.default_rng(rows * cols).normal(size = weights.weights.shape)
+		for engine in (othello_logic.Othello, othello_bitboard.BitboardOthello):
+			incremental = PatternEvaluator(weights)
+			fresh = PatternEvaluator(weights)
+			for _ in range(games // 4):
+				othello = engine(rows, cols, "B", ">", othello_logic.starting_board(rows, cols))
+				incremental.reset(othello)
+				records = []
+				while True:
+					moves = sorted(othello.legal_moves())
+					if not moves:
+						if not othello.legal_moves(3 - othello.current_player):
+							break
+						records.append(othello.apply_pass())
+						continue
+					records.append(othello.apply_move(*rng.choice(moves)))
+					incremental.played(records[-1])
+					fresh.reset(othello)
+					assert incremental.indices == fresh.indices
+					assert incremental.evaluate(othello, 1) == fresh.evaluate(othello, 1)
+				for record in reversed(records):
+					othello.undo_move(record)
+					incremental.undone(record)
+				fresh.reset(othello)
+				assert incremental.indices == fresh.indices
+
+		path = weights.save("patterns_check.tmp")
+		try:
+			loaded = PatternWeights.load(path)
+			assert (loaded.weights == weights.weights).all() and loaded.STYLE == weights.STYLE
+		finally:
+			os.remove(path)
+
+
+if __name__ == "__main__":
+	import time
+	import othello_logic
+	import othello_selfplay
+
+	check()
+	print("incremental patterns match, weights save and load")
+	for rows, cols in [(8, 8), (6, 10)]:
+		specs = othello_selfplay.game_specs(2000, [(rows, cols)], ["B", "W"], [">"], 0)
+		games = [othello_selfplay.play_game(spec) for spec in specs]
+		start = time.perf_counter()
+		weights, errors = train(rows, cols, games[:1600])
+		seconds = time.perf_counter() - start
+		indices, stages, targets = training_data(weights, games[1600:])
+		test_error = float(numpy.abs(predict(weights, indices, stages) - targets).mean())
+		print("{}x{}: trained in {:.1f}s, mean error {:.2f} -> {:.2f} discs, held out games {:.2f}".format(
+			rows, cols, seconds, errors[0], errors[-1], test_error))
+
+		evaluator = PatternEvaluator(weights)
+		othello = othello_bitboard.BitboardOthello(rows, cols, "B", ">", othello_logic.starting_board(rows, cols))
+		evaluator.reset(othello)
+		move = sorted(othello.legal_moves())[0]
+		count = 20000
+		start = time.perf_counter()
+		for _ in range(count):
+			record = othello.apply_move(*move)
+			evaluator.played(record)
+			evaluator.evaluate(othello, 1)
+			othello.undo_move(record)
+			evaluator.undone(record)
+		print("{}x{}: make, evaluate, unmake {:.1f} us".format(rows, cols,
+			(time.perf_counter() - start) / count * 1e6))
@@ -0,0 +1,316 @@
+"""
+Compact binary game records. A file starts with MAGIC and then holds games
+back to back, each one a small header followed by one byte per move:
+
+	rows, cols, first (1 black, 2 white), style (0 ">", 1 "<"), flags,
+	black pieces, white pieces, move count, [setup], moves
+
+If flags has SETUP_FLAG set the starting board follows the header packed at
+2 bits a square, otherwise the game started from othello_logic.starting_board.
+A move is the square row * cols + col, and a pass is PASS_BYTE. On 16x16
+boards PASS_BYTE is also the bottom right square, but only one of the two is
+possible in any position (a player passes only when they have no moves), so
+replaying the game tells them apart.
+
+Next to every data file the writer keeps an index file (the same name plus
+".idx") of 8 byte offsets, one per game, so the reader can jump straight to
+any game through a memory map without reading the games before it.
+"""
+
+import collections
+import mmap
+import os
+import struct
+
+import othello_bitboard
+import othello_logic
+
+MAGIC = b"OTHR\x01"
+HEADER = struct.Struct("<BBBBBHHH")
+OFFSET = struct.Struct("<Q")
+SETUP_FLAG = 1
+PASS_BYTE = 0xFF
+
+STYLES = {">": 0, "<": 1}
+FIRSTS = {"B": 1, "W": 2}
+CELLS = {".": 0, "B": 1, "W": 2, 0: 0, 1: 1, 2: 2}
+
+Game = collections.namedtuple("Game",
+	["rows", "cols", "first", "style", "setup", "moves", "black", "white"])
+
+
+class InvalidRecordError(Exception):
+	pass
+
+
+def encode(game: dict) -> bytes:
+	"""
+	Encodes a game given as a dictionary with rows, cols, first ("B" or "W"),
+	style, moves ((row, col) or None for a pass), black and white, and
+	optionally setup (a board in the format Othello takes)
+	"""
+	rows = game["rows"]
+	cols = game["cols"]
+	setup = game.get("setup")
+	moves = game["moves"]
+
+	flags = 0 if setup == None else SETUP_FLAG
+	result = bytearray(HEADER.pack(rows, cols, FIRSTS[game["first"]], STYLES[game["style"]],
+		flags, game["black"], game["white"], len(moves)))
+
+	if setup != None:
+		packed = bytearray((rows * cols + 3) // 4)
+		for row in range(rows):
+			for col in range(cols):
+				square = row * cols + col
+				packed[square // 4] |= CELLS[setup[row][col]] << (2 * (square % 4))
+		result += packed
+
+	for move in moves:
+		if move == None:
+			result.append(PASS_BYTE)
+		else:
+			result.append(move[0] * cols + move[1])
+	return bytes(result)
+
+
+def decode(data, offset: int = 0) -> (Game, int):
+	"""
+	Decodes the game starting at offset of data and returns it along with
+	the offset just past it
+	"""
+	if offset + HEADER.size > len(data):
+		raise InvalidRecordError
+	rows, cols, first, style, flags, black, white, count = HEADER.unpack_from(data, offset)
+	offset += HEADER.size
+
+	setup = None
+	if flags & SETUP_FLAG:
+		size = (rows * cols + 3) // 4
+		packed = data[offset:offset + size]
+		offset += size
+		setup = [[othello_logic.Othello.REFER[(packed[(row * cols + col) // 4] >> (2 * ((row * cols + col) % 4))) & 3]
+			for col in range(cols)] for row in range(rows)]
+
+	raw = data[offset:offset + count]
+	if len(raw) != count:
+		raise InvalidRecordError
+	offset += count
+
+	moves = [None if byte == PASS_BYTE else (byte // cols, byte % cols) for byte in raw]
+	game = Game(rows, cols, "B" if first == 1 else "W", ">" if style == 0 else "<",
+		setup, moves, black, white)
+	if rows * cols > PASS_BYTE and PASS_BYTE in raw:
+		game = game._replace(moves = _resolve_passes(game))
+	return game, offset
+
+
+def _next_offset(data, offset: int) -> int:
+	"""
+	Returns the offset just past the game starting at offset, without
+	decoding it
+	"""
+	if offset + HEADER.size > len(data):
+		raise InvalidRecordError
+	rows, cols, _, _, flags, _, _, count = HEADER.unpack_from(data, offset)
+	offset += HEADER.size + count
+	if flags & SETUP_FLAG:
+		offset += (rows * cols + 3) // 4
+	if offset > len(data):
+		raise InvalidRecordError
+	return offset
+
+
+def _resolve_passes(game: Game) -> [(int, int)]:
+	"""
+	Decides whether each PASS_BYTE of a 16x16 game was a pass or a move on
+	the last square, by replaying the game
+	"""
+	othello = start_position(game, othello_bitboard.BitboardOthello)
+	last = divmod(PASS_BYTE, game.cols)
+	moves = []
+	for move in game.moves:
+		if move == None and othello.legal_moves():
+			move = last
+		moves.append(move)
+		if move == None:
+			othello.apply_pass()
+		else:
+			othello.apply_move(move[0], move[1])
+	return moves
+
+
+def start_position(game: Game, engine=othello_logic.Othello) -> othello_logic.Othello:
+	"""
+	Returns an engine (Othello or a subclass) set up where the game started
+	"""
+	setup = game.setup
+	if setup == None:
+		setup = othello_logic.starting_board(game.rows, game.cols)
+	return engine(game.rows, game.cols, game.first, game.style, setup)
+
+
+def replay(game: Game, plies: int = None, engine=othello_logic.Othello) -> othello_logic.Othello:
+	"""
+	Returns the position after the first plies moves and passes of the game,
+	or after the whole game if plies is None
+	"""
+	othello = start_position(game, engine)
+	for move in game.moves[:plies]:
+		if move == None:
+			othello.apply_pass()
+		else:
+			othello.apply_move(move[0], move[1])
+	return othello
+
+
+def positions(game: Game, engine=othello_logic.Othello) -> "iterator of (ply, Othello)":
+	"""
+	Yields every position of the game, starting with the first one, along
+	with how many plies were played to reach it. The same Othello object is
+	yielded each time, changed in place, so copy it to keep a position
+	"""
+	othello = start_position(game, engine)
+	yield 0, othello
+	for ply, move in enumerate(game.moves, 1):
+		if move == None:
+			othello.apply_pass()
+		else:
+			othello.apply_move(move[0], move[1])
+		yield ply, othello
+
+
+class GameWriter:
+	"""
+	ATTRIBUTES:
+	path, the data file being appended to
+	count, number of games in the file
+	"""
+
+	def __init__(self, path: str):
+		"""
+		Opens path for appending, writing the file header if it is new
+		"""
+		self.path = path
+		self._data = open(path, "ab")
+		if self._data.tell() == 0:
+			self._data.write(MAGIC)
+		if not os.path.exists(path + ".idx") and self._data.tell() > len(MAGIC):
+			self._data.flush()
+			build_index(path)
+		self._index = open(path + ".idx", "ab")
+		self.count = self._index.tell() // OFFSET.size
+
+	def write(self, game: dict) -> int:
+		"""
+		Appends a game (see encode) and returns its number in the file
+		"""
+		self._index.write(OFFSET.pack(self._data.tell()))
+		self._data.write(encode(game))
+		self.count += 1
+		return self.count - 1
+
+	def close(self) -> None:
+		"""
+		Flushes and closes the data and index files
+		"""
+		self._data.close()
+		self._index.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args) -> None:
+		self.close()
+
+
+class GameReader:
+	"""
+	ATTRIBUTES:
+	path, the data file being read
+	"""
+
+	def __init__(self, path: str):
+		"""
+		Memory maps the data file and its index. The index is rebuilt by
+		scanning the data if it is missing
+		"""
+		self.path = path
+		if not os.path.exists(path + ".idx"):
+			build_index(path)
+		self._data_file = open(path, "rb")
+		self._index_file = open(path + ".idx", "rb")
+		self._data = _map(self._data_file)
+		self._index = _map(self._index_file)
+		if self._data[:len(MAGIC)] != MAGIC:
+			raise InvalidRecordError
+
+	def __len__(self) -> int:
+		return len(self._index) // OFFSET.size
+
+	def __getitem__(self, number: int) -> Game:
+		"""
+		Decodes game number straight from its offset
+		"""
+		if number < 0:
+			number += len(self)
+		if not 0 <= number < len(self):
+			raise IndexError
+		return decode(self._data, OFFSET.unpack_from(self._index, number * OFFSET.size)[0])[0]
+
+	def __iter__(self) -> "iterator of Game":
+		"""
+		Decodes the games in order, only touching the pages being read
+		"""
+		offset = len(MAGIC)
+		end = len(self._data)
+		while offset < end:
+			game, offset = decode(self._data, offset)
+			yield game
+
+	def close(self) -> None:
+		"""
+		Unmaps and closes the files
+		"""
+		for mapped in (self._data, self._index):
+			if isinstance(mapped, mmap.mmap):
+				mapped.close()
+		self._data_file.close()
+		self._index_file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args) -> None:
+		self.close()
+
+
+def _map(file) -> "mmap or bytes":
+	"""
+	Memory maps an open file for reading. Empty files can't be mapped, so
+	they come back as empty bytes
+	"""
+	if os.fstat(file.fileno()).st_size == 0:
+		return b""
+	return mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+
+
+def build_index(path: str) -> int:
+	"""
+	Scans a data file and writes its index file from scratch. Returns the
+	number of games found
+	"""
+	with open(path, "rb") as data_file:
+		data = _map(data_file)
+		if data[:len(MAGIC)] != MAGIC:
+			raise InvalidRecordError
+		count = 0
+		offset = len(MAGIC)
+		with open(path + ".idx", "wb") as index_file:
+			while offset < len(data):
+				index_file.write(OFFSET.pack(offset))
+				offset = _next_offset(data, offset)
+				count += 1
+		if isinstance(data, mmap.mmap):
+			data.close()
+	return count
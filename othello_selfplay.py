@@ -0,0 +1,253 @@
+"""
+Headless self-play. Plays a number of games across board sizes, first players
+and win conditions on a pool of worker processes, without tkinter. Every game
+gets its own seed, so the same settings always produce the same games no
+matter how many workers play them. The alphabeta player always picks the same
+move in the same position, so its games open with a few seeded random moves
+to keep them apart.
+
+Run it as a script to write the games out as JSON lines, or with --scaling to
+measure games per second for several worker counts.
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+import othello_ai
+import othello_bitboard
+import othello_logic
+import othello_records
+
+GameSpec = collections.namedtuple("GameSpec",
+	["index", "seed", "rows", "cols", "first", "style"])
+
+RANDOM_PLIES = 4 # random moves opening every alphabeta game
+
+_WORKER = {}
+
+
+def game_specs(games: int, sizes: [(int, int)], firsts: [str], styles: [str], seed: int) -> [GameSpec]:
+	"""
+	Returns the settings for each game, going round every combination of
+	size, first player and style. Game i always gets seed + i
+	"""
+	combos = list(itertools.product(sizes, firsts, styles))
+	specs = []
+	for index in range(games):
+		(rows, cols), first, style = combos[index % len(combos)]
+		specs.append(GameSpec(index, seed + index, rows, cols, first, style))
+	return specs
+
+
+def play_game(spec: GameSpec, player: str = "random", max_nodes: int = 2000,
+		random_plies: int = RANDOM_PLIES) -> dict:
+	"""
+	Plays one game with both sides using player ("random" or "alphabeta",
+	which searches max_nodes nodes a move after random_plies random moves)
+	and returns its record. Moves are (row, col) starting at 0, or None for
+	a pass
+	"""
+	rng = random.Random(spec.seed)
+	othello = othello_bitboard.BitboardOthello(spec.rows, spec.cols, spec.first, spec.style,
+		othello_logic.starting_board(spec.rows, spec.cols))
+	search = othello_ai.AlphaBetaSearch(max_time = None, max_nodes = max_nodes)
+
+	moves = []
+	while True:
+		legal = sorted(othello.legal_moves())
+		if not legal:
+			if not othello.legal_moves(3 - othello.current_player):
+				break # neither player can move, same as the GUI ending the game
+			othello.apply_pass()
+			moves.append(None)
+			continue
+
+		if player == "random" or len(legal) == 1 or len(moves) < random_plies:
+			move = rng.choice(legal)
+		else:
+			move = search.search(othello).move
+		othello.apply_move(move[0], move[1])
+		moves.append(move)
+
+	black, white = othello._count_pieces()
+	return {
+		"index": spec.index,
+		"seed": spec.seed,
+		"rows": spec.rows,
+		"cols": spec.cols,
+		"first": spec.first,
+		"style": spec.style,
+		"moves": moves,
+		"black": black,
+		"white": white,
+		"winner": othello.find_winner(),
+	}
+
+
+def _worker_init(player: str, max_nodes: int, random_plies: int) -> None:
+	"""
+	Runs once in every worker process to keep its own settings
+	"""
+	_WORKER["player"] = player
+	_WORKER["max_nodes"] = max_nodes
+	_WORKER["random_plies"] = random_plies
+
+
+def _play_chunk(specs: [GameSpec]) -> [dict]:
+	"""
+	Plays a chunk of games inside a worker process
+	"""
+	return [play_game(spec, _WORKER["player"], _WORKER["max_nodes"], _WORKER["random_plies"]) for spec in specs]
+
+
+class SelfPlayStats:
+	"""
+	ATTRIBUTES:
+	workers, number of worker processes
+	games, games finished
+	positions, moves and passes played over every game
+	seconds, wall clock time of the run
+	"""
+
+	def __init__(self, workers: int):
+		"""
+		Starts the counters at zero for a run on workers processes
+		"""
+		self.workers = workers
+		self.games = 0
+		self.positions = 0
+		self.seconds = 0.0
+
+	def games_per_second(self) -> float:
+		"""
+		Returns the finished games per second of wall clock time
+		"""
+		return self.games / self.seconds if self.seconds > 0 else 0.0
+
+	def to_dict(self) -> dict:
+		"""
+		Returns the stats as a dictionary for printing as JSON
+		"""
+		return {
+			"workers": self.workers,
+			"games": self.games,
+			"positions": self.positions,
+			"seconds": self.seconds,
+			"games_per_second": self.games_per_second(),
+			"positions_per_second": self.positions / self.seconds if self.seconds > 0 else 0.0,
+		}
+
+
+def run_selfplay(specs: [GameSpec], workers: int = None, chunk: int = 16,
+		player: str = "random", max_nodes: int = 2000, stats: SelfPlayStats = None,
+		random_plies: int = RANDOM_PLIES) -> "iterator of game records":
+	"""
+	Plays every game in specs on workers processes (one per core if not
+	given) and yields the records as each chunk of games finishes, so they
+	come back in no particular order. Fills in stats as it goes if given
+	"""
+	if workers == None:
+		workers = multiprocessing.cpu_count()
+	chunks = [specs[start:start + chunk] for start in range(0, len(specs), chunk)]
+	start = time.perf_counter()
+
+	with multiprocessing.Pool(workers, _worker_init, (player, max_nodes, random_plies)) as pool:
+		for records in pool.imap_unordered(_play_chunk, chunks):
+			for record in records:
+				if stats != None:
+					stats.games += 1
+					stats.positions += len(record["moves"])
+					stats.seconds = time.perf_counter() - start
+				yield record
+
+
+def scaling(specs: [GameSpec], worker_counts: [int], chunk: int = 16,
+		player: str = "random", max_nodes: int = 2000, random_plies: int = RANDOM_PLIES) -> [dict]:
+	"""
+	Plays the same games with each worker count and returns the stats of
+	each run, with the speedup and efficiency against the first count
+	"""
+	results = []
+	for workers in worker_counts:
+		stats = SelfPlayStats(workers)
+		for _ in run_selfplay(specs, workers, chunk, player, max_nodes, stats, random_plies):
+			pass
+		results.append(stats.to_dict())
+
+	base = results[0]
+	for result in results:
+		speedup = result["games_per_second"] / base["games_per_second"] if base["games_per_second"] else 0.0
+		result["speedup"] = speedup
+		result["efficiency"] = speedup * base["workers"] / result["workers"]
+	return results
+
+
+def _parse_sizes(text: str) -> [(int, int)]:
+	"""
+	Turns "8x8,6x10" into [(8, 8), (6, 10)]
+	"""
+	sizes = []
+	for size in text.split(","):
+		rows, cols = size.lower().split("x")
+		sizes.append((int(rows), int(cols)))
+	return sizes
+
+
+def main(argv=None) -> None:
+	"""
+	Reads the command line and plays the games
+	"""
+	parser = argparse.ArgumentParser(description = "Plays Othello games headless on a process pool")
+	parser.add_argument("--games", type = int, default = 100)
+	parser.add_argument("--workers", type = int, default = None)
+	parser.add_argument("--sizes", type = _parse_sizes, default = [(8, 8)], help = "like 8x8,6x10")
+	parser.add_argument("--first", default = "B,W", help = "first players, like B,W")
+	parser.add_argument("--style", default = ">,<", help = "win conditions, like >,<")
+	parser.add_argument("--seed", type = int, default = 0)
+	parser.add_argument("--chunk", type = int, default = 16, help = "games sent to a worker at a time")
+	parser.add_argument("--player", choices = ["random", "alphabeta"], default = "random")
+	parser.add_argument("--max-nodes", type = int, default = 2000, help = "alphabeta nodes per move")
+	parser.add_argument("--random-plies", type = int, default = RANDOM_PLIES,
+		help = "random moves opening each alphabeta game")
+	parser.add_argument("--output", default = "-", help = "output file, - for stdout")
+	parser.add_argument("--format", choices = ["jsonl", "binary"], default = "jsonl",
+		help = "binary appends othello_records games, needs an --output file")
+	parser.add_argument("--scaling", default = None, help = "worker counts to compare, like 1,2,4")
+	args = parser.parse_args(argv)
+
+	specs = game_specs(args.games, args.sizes, args.first.split(","), args.style.split(","), args.seed)
+
+	if args.scaling != None:
+		counts = [int(count) for count in args.scaling.split(",")]
+		for result in scaling(specs, counts, args.chunk, args.player, args.max_nodes, args.random_plies):
+			print(json.dumps(result))
+		return
+
+	stats = SelfPlayStats(args.workers or multiprocessing.cpu_count())
+	games = run_selfplay(specs, args.workers, args.chunk, args.player, args.max_nodes, stats,
+		args.random_plies)
+	if args.format == "binary":
+		if args.output == "-":
+			parser.error("--format binary needs an --output file")
+		with othello_records.GameWriter(args.output) as writer:
+			for record in games:
+				writer.write(record)
+	else:
+		output = sys.stdout if args.output == "-" else open(args.output, "w")
+		try:
+			for record in games:
+				output.write(json.dumps(record) + "\n")
+		finally:
+			if output is not sys.stdout:
+				output.close()
+	print(json.dumps(stats.to_dict()), file = sys.stderr)
+
+
+if __name__ == "__main__":
+	main()
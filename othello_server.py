@@ -0,0 +1,549 @@
+"""
+Engine server. Hosts any number of games in one process behind a line based
+protocol on a TCP or Unix socket, using asyncio so thousands of clients can
+be connected at once. Every request is one line of words and every reply is
+one line of JSON with "ok" true or false (and "error" when false):
+
+	NEW rows cols first style [setup]  starts a game, setup is the board rows
+	                                   joined by "/", like ..../.WB./.BW./....
+	MOVE game row col                  plays for the player to move, from 0
+	LEGAL game                         lists the legal moves
+	SCORE game                         black and white pieces
+	BOARD game                         the whole game state
+	UNDO game                          takes back the last move (and any
+	                                   passes made after it)
+	AI game [seconds]                  lets the computer move
+	CLOSE game                         ends the game
+	STATS                              latency percentiles and sessions
+	QUIT                               closes the connection
+
+Passes are made automatically: after a move (or a setup), a player with no
+legal moves is skipped if the other player can still move, and the game is over when
+neither can. AI moves are searched on a pool of worker processes so the event
+loop never waits on them.
+
+Run it with "serve" to start a server, or "bench" to start one and play many
+random games against it at once with the test client.
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import random
+import sys
+import time
+
+import othello_ai
+import othello_bitboard
+import othello_logic
+import othello_tt
+
+AI_SECONDS = 1.0 # default thinking time of AI
+LATENCY_SAMPLES = 100000 # latencies kept per command
+
+_WORKER = {}
+
+
+class ProtocolError(Exception):
+	pass
+
+
+############################## AI WORKERS ##########################
+
+def _think(position: bytes, seconds: float) -> (int, int):
+	"""
+	Runs in a worker process: searches the position (from Othello.to_bytes)
+	and returns the move. Each worker keeps one transposition table between
+	calls
+	"""
+	if "tt" not in _WORKER:
+		_WORKER["tt"] = othello_tt.TranspositionTable(16)
+	othello = othello_bitboard.BitboardOthello.from_bytes(position)
+	return othello_ai.find_move(othello, max_time = seconds, tt = _WORKER["tt"]).move
+
+
+############################## SESSIONS ##########################
+
+class Session:
+	"""
+	ATTRIBUTES:
+	number, the game's id
+	othello, the game being played
+	history, undo records of every move and pass so far
+	busy, True while the AI is thinking about this game
+	"""
+
+	def __init__(self, number: int, othello):
+		"""
+		Starts a session for a game
+		"""
+		self.number = number
+		self.othello = othello
+		self.history = []
+		self.busy = False
+
+	def play(self, row: int, col: int) -> int:
+		"""
+		Makes a move and any passes that follow it. Returns the passes made
+		"""
+		if not (0 <= row < self.othello.ROWS and 0 <= col < self.othello.COLS):
+			raise ProtocolError("square off the board")
+		self.history.append(self.othello.apply_move(row, col))
+		return self.pass_while_stuck()
+
+	def pass_while_stuck(self) -> int:
+		"""
+		Passes for the player to move as long as they have no move and the
+		other player does. Returns the passes made
+		"""
+		passes = 0
+		while not self.othello.legal_moves() and self.othello.legal_moves(3 - self.othello.current_player):
+			self.history.append(self.othello.apply_pass())
+			passes += 1
+		return passes
+
+	def undo(self) -> None:
+		"""
+		Takes back the last move along with the passes after it. Raises
+		ProtocolError if there is nothing to take back
+		"""
+		if all(record[0] == None for record in self.history):
+			raise ProtocolError("nothing to undo") # only the passes a setup started with
+		while self.history and self.history[-1][0] == None:
+			self.othello.undo_move(self.history.pop())
+		if not self.history:
+			raise ProtocolError("nothing to undo")
+		self.othello.undo_move(self.history.pop())
+
+	def over(self) -> bool:
+		"""
+		Returns True if neither player can move
+		"""
+		return not self.othello.legal_moves() and not self.othello.legal_moves(3 - self.othello.current_player)
+
+	def state(self) -> dict:
+		"""
+		Returns everything about the game for a reply
+		"""
+		othello = self.othello
+		black, white = othello._count_pieces()
+		result = {
+			"game": self.number,
+			"board": "/".join("".join(othello.REFER[value] for value in line) for line in othello.game),
+			"player": othello.REFER[othello.current_player],
+			"black": black,
+			"white": white,
+			"over": self.over(),
+		}
+		if result["over"]:
+			winner = othello.find_winner()
+			result["winner"] = winner if winner == "NONE" else winner[0]
+		return result
+
+
+class LatencyStats:
+	"""
+	ATTRIBUTES:
+	samples, dictionary of command -> recent latencies in seconds
+	counts, dictionary of command -> requests handled
+	"""
+
+	def __init__(self):
+		"""
+		Starts with no samples
+		"""
+		self.samples = collections.defaultdict(lambda: collections.deque(maxlen = LATENCY_SAMPLES))
+		self.counts = collections.Counter()
+
+	def add(self, command: str, seconds: float) -> None:
+		"""
+		Records one request
+		"""
+		self.samples[command].append(seconds)
+		self.counts[command] += 1
+
+	def percentiles(self) -> dict:
+		"""
+		Returns the count and the 50th, 90th and 99th percentile and largest
+		latency in milliseconds of each command
+		"""
+		result = {}
+		for command, samples in self.samples.items():
+			ordered = sorted(samples)
+			pick = lambda fraction: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+			result[command] = {"count": self.counts[command], "p50": pick(0.5), "p90": pick(0.9),
+				"p99": pick(0.99), "max": ordered[-1] * 1000}
+		return result
+
+
+############################## SERVER ##########################
+
+class OthelloServer:
+	"""
+	ATTRIBUTES:
+	games, dictionary of game id -> Session
+	latency, LatencyStats of every command
+	sessions, games started since the server started
+	workers, number of AI worker processes
+	"""
+
+	def __init__(self, workers: int = None):
+		"""
+		Sets up an empty server, the worker pool is started with the server
+		"""
+		self.games = {}
+		self.latency = LatencyStats()
+		self.sessions = 0
+		self.workers = workers or os.cpu_count()
+		self._ids = itertools.count(1)
+		self._pool = None
+		self._server = None
+		self._started = time.perf_counter()
+		self._commands = {
+			"NEW": self._new,
+			"MOVE": self._move,
+			"LEGAL": self._legal,
+			"SCORE": self._score,
+			"BOARD": self._board,
+			"UNDO": self._undo,
+			"AI": self._ai,
+			"CLOSE": self._close,
+			"STATS": self._stats,
+		}
+
+	async def start(self, host: str = "127.0.0.1", port: int = 0, path: str = None) -> None:
+		"""
+		Starts listening on host and port, or on a Unix socket at path. With
+		port 0 a free port is picked, see address
+		"""
+		self._pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+		self._started = time.perf_counter()
+		if path != None:
+			self._server = await asyncio.start_unix_server(self._handle, path, limit = 2 ** 16)
+		else:
+			self._server = await asyncio.start_server(self._handle, host, port, limit = 2 ** 16, backlog = 4096)
+
+	def address(self):
+		"""
+		Returns the (host, port) or path the server is listening on
+		"""
+		return self._server.sockets[0].getsockname()
+
+	async def serve_forever(self) -> None:
+		"""
+		Handles clients until cancelled
+		"""
+		await self._server.serve_forever()
+
+	async def close(self) -> None:
+		"""
+		Stops listening and shuts the worker pool down
+		"""
+		self._server.close()
+		await self._server.wait_closed()
+		self._pool.shutdown(cancel_futures = True)
+
+	async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+		"""
+		Answers one client's requests in order until it quits or hangs up
+		"""
+		try:
+			while True:
+				try:
+					line = await reader.readline()
+					if not line:
+						break
+					words = line.decode().split()
+				except ValueError as error:
+					# a line over the stream limit (dropped by readline) or not UTF-8
+					message = "request is not UTF-8" if isinstance(error, UnicodeDecodeError) else "request line too long"
+					writer.write(json.dumps({"ok": False, "error": message}).encode() + b"\n")
+					await writer.drain()
+					continue
+				if not words:
+					continue
+				command = words[0].upper()
+				if command == "QUIT":
+					break
+				start = time.perf_counter()
+				reply = await self.execute(command, words[1:])
+				self.latency.add(command if command in self._commands else "UNKNOWN", time.perf_counter() - start)
+				writer.write(json.dumps(reply).encode() + b"\n")
+				await writer.drain()
+		except (ConnectionError, asyncio.IncompleteReadError):
+			pass
+		finally:
+			writer.close()
+
+	async def execute(self, command: str, args: [str]) -> dict:
+		"""
+		Runs one command and returns its reply
+		"""
+		if command not in self._commands:
+			return {"ok": False, "error": "unknown command {}".format(command)}
+		try:
+			reply = await self._commands[command](args)
+		except ProtocolError as error:
+			return {"ok": False, "error": str(error)}
+		except (ValueError, IndexError):
+			return {"ok": False, "error": "bad arguments for {}".format(command)}
+		except othello_logic.InvalidMoveError:
+			return {"ok": False, "error": "invalid move"}
+		except (othello_logic.InvalidSizeError, othello_logic.InvalidBoardError, othello_logic.InvalidValueError):
+			return {"ok": False, "error": "invalid game settings"}
+		except Exception as error:
+			# a bug in one command shouldn't take the client's connection down
+			return {"ok": False, "error": "internal error in {}: {}".format(command, type(error).__name__)}
+		reply["ok"] = True
+		return reply
+
+	def _session(self, args: [str], allow_busy: bool = False) -> Session:
+		"""
+		Returns the session named by the first argument
+		"""
+		session = self.games.get(int(args[0]))
+		if session == None:
+			raise ProtocolError("no game {}".format(args[0]))
+		if session.busy and not allow_busy:
+			raise ProtocolError("game {} is waiting for the AI".format(session.number))
+		return session
+
+	############################## COMMANDS ##########################
+
+	async def _new(self, args: [str]) -> dict:
+		"""
+		NEW rows cols first style [setup]
+		"""
+		rows, cols = int(args[0]), int(args[1])
+		first, style = args[2].upper(), args[3]
+		if len(args) > 4:
+			board = [list(line.upper()) for line in args[4].split("/")]
+			if len(board) != rows or any(len(line) != cols or set(line) - set(".BW") for line in board):
+				raise ProtocolError("setup has to be {} rows of {} squares".format(rows, cols))
+		else:
+			board = othello_logic.starting_board(rows, cols)
+		othello = othello_bitboard.BitboardOthello(rows, cols, first, style, board)
+		session = Session(next(self._ids), othello)
+		passes = session.pass_while_stuck() # a setup can start with the player to move stuck
+		self.games[session.number] = session
+		self.sessions += 1
+		reply = session.state()
+		reply["passes"] = passes
+		return reply
+
+	async def _move(self, args: [str]) -> dict:
+		"""
+		MOVE game row col
+		"""
+		session = self._session(args)
+		if session.over():
+			raise ProtocolError("game is over")
+		passes = session.play(int(args[1]), int(args[2]))
+		reply = session.state()
+		reply["passes"] = passes
+		return reply
+
+	async def _legal(self, args: [str]) -> dict:
+		"""
+		LEGAL game
+		"""
+		session = self._session(args, True)
+		return {"game": session.number, "moves": sorted(session.othello.legal_moves())}
+
+	async def _score(self, args: [str]) -> dict:
+		"""
+		SCORE game
+		"""
+		session = self._session(args, True)
+		black, white = session.othello._count_pieces()
+		return {"game": session.number, "black": black, "white": white}
+
+	async def _board(self, args: [str]) -> dict:
+		"""
+		BOARD game
+		"""
+		return self._session(args, True).state()
+
+	async def _undo(self, args: [str]) -> dict:
+		"""
+		UNDO game
+		"""
+		session = self._session(args)
+		session.undo()
+		return session.state()
+
+	async def _ai(self, args: [str]) -> dict:
+		"""
+		AI game [seconds], the search runs in the worker pool
+		"""
+		session = self._session(args)
+		if session.over():
+			raise ProtocolError("game is over")
+		seconds = float(args[1]) if len(args) > 1 else AI_SECONDS
+		session.busy = True
+		try:
+			move = await asyncio.get_running_loop().run_in_executor(self._pool, _think,
+				session.othello.to_bytes(), seconds)
+		finally:
+			session.busy = False
+		if move == None:
+			passes = session.pass_while_stuck() # nothing to play, the game is over or has to pass
+		else:
+			passes = session.play(move[0], move[1])
+		reply = session.state()
+		reply["move"] = move
+		reply["passes"] = passes
+		return reply
+
+	async def _close(self, args: [str]) -> dict:
+		"""
+		CLOSE game
+		"""
+		session = self._session(args)
+		del self.games[session.number]
+		return {"game": session.number}
+
+	async def _stats(self, args: [str]) -> dict:
+		"""
+		STATS
+		"""
+		uptime = time.perf_counter() - self._started
+		return {
+			"uptime": uptime,
+			"sessions": self.sessions,
+			"active": len(self.games),
+			"sessions_per_second": self.sessions / uptime if uptime > 0 else 0.0,
+			"latency_ms": self.latency.percentiles(),
+		}
+
+
+############################## TEST CLIENT ##########################
+
+class OthelloClient:
+	"""
+	ATTRIBUTES:
+	reader, writer, the connection's streams
+	"""
+
+	@classmethod
+	async def connect(cls, host: str = "127.0.0.1", port: int = None, path: str = None) -> "OthelloClient":
+		"""
+		Connects to a server on host and port, or on a Unix socket at path
+		"""
+		client = cls()
+		if path != None:
+			client.reader, client.writer = await asyncio.open_unix_connection(path)
+		else:
+			client.reader, client.writer = await asyncio.open_connection(host, port)
+		return client
+
+	async def request(self, *words) -> dict:
+		"""
+		Sends one command and returns the reply
+		"""
+		self.writer.write(" ".join(str(word) for word in words).encode() + b"\n")
+		await self.writer.drain()
+		return json.loads(await self.reader.readline())
+
+	async def close(self) -> None:
+		"""
+		Says goodbye and closes the connection
+		"""
+		self.writer.write(b"QUIT\n")
+		self.writer.close()
+		await self.writer.wait_closed()
+
+
+async def _random_games(address, games: int, rows: int, cols: int, seed: int, ai_seconds: float) -> int:
+	"""
+	Plays games random games one after the other on one connection, with
+	the AI taking White if ai_seconds is given. Returns the moves played
+	"""
+	rng = random.Random(seed)
+	if isinstance(address, str):
+		client = await OthelloClient.connect(path = address)
+	else:
+		client = await OthelloClient.connect(address[0], address[1])
+	moves = 0
+	try:
+		for _ in range(games):
+			state = await client.request("NEW", rows, cols, "B", ">")
+			number = state["game"]
+			while not state["over"]:
+				if ai_seconds != None and state["player"] == "W":
+					state = await client.request("AI", number, ai_seconds)
+				else:
+					legal = (await client.request("LEGAL", number))["moves"]
+					row, col = rng.choice(legal)
+					state = await client.request("MOVE", number, row, col)
+				assert state["ok"], state
+				moves += 1
+			await client.request("CLOSE", number)
+	finally:
+		await client.close()
+	return moves
+
+
+async def bench(clients: int = 1000, games: int = 2, rows: int = 8, cols: int = 8,
+		ai_seconds: float = None, workers: int = None, path: str = None) -> dict:
+	"""
+	Starts a server and plays games random games on each of clients
+	connections at once. Returns the server's stats with the client's moves
+	per second added
+	"""
+	server = OthelloServer(workers)
+	await server.start(path = path)
+	address = path if path != None else server.address()[:2]
+	try:
+		start = time.perf_counter()
+		moves = await asyncio.gather(*[_random_games(address, games, rows, cols, seed, ai_seconds)
+			for seed in range(clients)])
+		seconds = time.perf_counter() - start
+		stats = await server.execute("STATS", [])
+	finally:
+		await server.close()
+	stats["clients"] = clients
+	stats["seconds"] = seconds
+	stats["moves_per_second"] = sum(moves) / seconds
+	return stats
+
+
+def main(argv=None) -> None:
+	"""
+	Reads the command line and serves or benchmarks
+	"""
+	parser = argparse.ArgumentParser(description = "Othello engine server")
+	commands = parser.add_subparsers(dest = "command", required = True)
+	serve = commands.add_parser("serve", help = "run the server")
+	serve.add_argument("--host", default = "127.0.0.1")
+	serve.add_argument("--port", type = int, default = 7744)
+	serve.add_argument("--unix", default = None, help = "listen on a Unix socket at this path instead")
+	serve.add_argument("--workers", type = int, default = None, help = "AI worker processes")
+	testing = commands.add_parser("bench", help = "play random games against a local server")
+	testing.add_argument("--clients", type = int, default = 1000)
+	testing.add_argument("--games", type = int, default = 2, help = "games per client")
+	testing.add_argument("--size", default = "8x8")
+	testing.add_argument("--ai", type = float, default = None, help = "AI seconds per move for White")
+	testing.add_argument("--workers", type = int, default = None)
+	testing.add_argument("--unix", default = None)
+	args = parser.parse_args(argv)
+
+	if args.command == "serve":
+		async def run() -> None:
+			server = OthelloServer(args.workers)
+			await server.start(args.host, args.port, args.unix)
+			print("listening on {}".format(server.address()), file = sys.stderr)
+			await server.serve_forever()
+		asyncio.run(run())
+	else:
+		rows, cols = (int(size) for size in args.size.lower().split("x"))
+		print(json.dumps(asyncio.run(bench(args.clients, args.games, rows, cols, args.ai,
+			args.workers, args.unix)), indent = 1))
+
+
+if __name__ == "__main__":
+	main()
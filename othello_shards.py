@@ -0,0 +1,441 @@
+"""
+Training positions packed into shard files, and a loader that streams
+shuffled minibatches out of them. A shard starts with MAGIC and the board
+size, then holds fixed size records back to back, one per position:
+
+	cells    2 bits a square (0 empty, 1 black, 2 white), packed four to a
+	         byte in the same order as othello_records setups
+	info     bit 0 set if white is to move, bit 1 set if STYLE is "<"
+	result   final result for the player to move: 1 win, 0 draw, -1 loss
+	move     square played from the position (row * cols + col), NO_MOVE
+	         for a pass
+
+An 8x8 position takes 20 bytes, so a hundred million fit in 2 GB of shards
+that are memory mapped rather than read in.
+
+Loader reads the shards in random chunks on a background thread, mixes the
+records through a bounded shuffle buffer, turns each minibatch into arrays
+(optionally under a random board symmetry) and keeps a few batches ready in
+a queue, so the trainer never waits on it.
+"""
+
+import argparse
+import collections
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy
+
+import othello_bitboard
+import othello_book
+import othello_patterns
+import othello_records
+
+MAGIC = b"OTHS\x01"
+HEADER = struct.Struct("<BB")
+NO_MOVE = 0xFFFF
+
+WHITE_FLAG = 1
+STYLE_FLAG = 2
+
+CHUNK = 4096 # records read from a shard at a time
+
+Batch = collections.namedtuple("Batch", ["boards", "players", "styles", "results", "moves"])
+
+
+class InvalidShardError(Exception):
+	pass
+
+
+def record_dtype(rows: int, cols: int) -> numpy.dtype:
+	"""
+	Returns the NumPy dtype of one record for a rows by cols board
+	"""
+	return numpy.dtype([("cells", numpy.uint8, ((rows * cols + 3) // 4,)), ("info", numpy.uint8),
+		("result", numpy.int8), ("move", "<u2")])
+
+
+def pack_cells(boards: numpy.ndarray) -> numpy.ndarray:
+	"""
+	Packs (N, rows, cols) boards into (N, bytes) at 2 bits a square
+	"""
+	count = len(boards)
+	flat = numpy.asarray(boards, dtype = numpy.uint8).reshape(count, -1)
+	padded = numpy.zeros((count, (flat.shape[1] + 3) // 4 * 4), dtype = numpy.uint8)
+	padded[:, :flat.shape[1]] = flat
+	quads = padded.reshape(count, -1, 4)
+	return quads[..., 0] | (quads[..., 1] << 2) | (quads[..., 2] << 4) | (quads[..., 3] << 6)
+
+
+def unpack_cells(packed: numpy.ndarray, rows: int, cols: int) -> numpy.ndarray:
+	"""
+	Turns (N, bytes) packed cells back into (N, rows, cols) boards
+	"""
+	cells = (packed[:, :, None] >> numpy.array([0, 2, 4, 6], dtype = numpy.uint8)) & 3
+	return cells.reshape(len(packed), -1)[:, :rows * cols].reshape(len(packed), rows, cols)
+
+
+def decode(records: numpy.ndarray, rows: int, cols: int) -> Batch:
+	"""
+	Turns records into a Batch: boards (N, rows, cols) in the Othello.game
+	encoding, players to move (1 or 2), styles (">" is 0, "<" is 1),
+	results as float32 and moves as square numbers with -1 for a pass
+	"""
+	moves = records["move"].astype(numpy.int64)
+	moves[moves == NO_MOVE] = -1
+	return Batch(unpack_cells(records["cells"], rows, cols), 1 + (records["info"] & WHITE_FLAG),
+		(records["info"] & STYLE_FLAG) >> 1, records["result"].astype(numpy.float32), moves)
+
+
+############################## WRITING ##########################
+
+class ShardWriter:
+	"""
+	ATTRIBUTES:
+	path, the shard being written
+	rows, cols, board size of every position in it
+	count, records written
+	"""
+
+	def __init__(self, path: str, rows: int, cols: int):
+		"""
+		Creates the shard, replacing any file already there
+		"""
+		self.path = path
+		self.rows = rows
+		self.cols = cols
+		self.count = 0
+		self._dtype = record_dtype(rows, cols)
+		self._file = open(path, "wb")
+		self._file.write(MAGIC + HEADER.pack(rows, cols))
+
+	def add(self, boards: numpy.ndarray, players: numpy.ndarray, styles: numpy.ndarray,
+			results: numpy.ndarray, moves: numpy.ndarray) -> None:
+		"""
+		Writes a batch of positions, each argument laid out like the Batch
+		fields
+		"""
+		moves = numpy.asarray(moves)
+		records = numpy.empty(len(moves), dtype = self._dtype)
+		records["cells"] = pack_cells(boards)
+		records["info"] = (numpy.asarray(players) == 2) * WHITE_FLAG | (numpy.asarray(styles) != 0) * STYLE_FLAG
+		records["result"] = results
+		records["move"] = numpy.where(moves < 0, NO_MOVE, moves)
+		self._file.write(records.tobytes())
+		self.count += len(records)
+
+	def add_game(self, game) -> int:
+		"""
+		Writes every position of a finished game (an othello_records Game or
+		othello_selfplay record) with the move played from it. Returns how
+		many positions were written
+		"""
+		game = othello_patterns._as_game(game)
+		diff = game.black - game.white
+		if game.style == "<":
+			diff = -diff
+		winner = 0 if diff == 0 else (1 if diff > 0 else 2)
+		boards, players, moves, results = [], [], [], []
+		for ply, othello in othello_records.positions(game, othello_bitboard.BitboardOthello):
+			if ply == len(game.moves):
+				break
+			move = game.moves[ply]
+			boards.append([line[:] for line in othello.game])
+			players.append(othello.current_player)
+			moves.append(-1 if move == None else move[0] * game.cols + move[1])
+			results.append(0 if winner == 0 else (1 if winner == othello.current_player else -1))
+		if moves:
+			self.add(numpy.array(boards, dtype = numpy.uint8), numpy.array(players),
+				numpy.full(len(moves), int(game.style == "<")), numpy.array(results), numpy.array(moves))
+		return len(moves)
+
+	def close(self) -> None:
+		"""
+		Flushes and closes the shard
+		"""
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args) -> None:
+		self.close()
+
+
+def write_shards(games, directory: str, positions: int = 1000000) -> [str]:
+	"""
+	Writes the positions of the games into shards of about positions records
+	each in directory, one set of shards per board size. Returns the paths
+	written
+	"""
+	os.makedirs(directory, exist_ok = True)
+	writers = {}
+	numbers = collections.Counter()
+	paths = []
+	try:
+		for game in games:
+			game = othello_patterns._as_game(game)
+			size = (game.rows, game.cols)
+			if size not in writers:
+				path = os.path.join(directory, "positions_{}x{}_{:05d}.shard".format(*size, numbers[size]))
+				writers[size] = ShardWriter(path, *size)
+				numbers[size] += 1
+				paths.append(path)
+			writers[size].add_game(game)
+			if writers[size].count >= positions:
+				writers.pop(size).close()
+	finally:
+		for writer in writers.values():
+			writer.close()
+	return paths
+
+
+############################## READING ##########################
+
+class Shard:
+	"""
+	ATTRIBUTES:
+	path, the shard file
+	rows, cols, board size of its positions
+	records, memory mapped structured array of every record
+	"""
+
+	def __init__(self, path: str):
+		"""
+		Checks the header and maps the records
+		"""
+		self.path = path
+		with open(path, "rb") as file:
+			header = file.read(len(MAGIC) + HEADER.size)
+		if len(header) != len(MAGIC) + HEADER.size or header[:len(MAGIC)] != MAGIC:
+			raise InvalidShardError(path)
+		self.rows, self.cols = HEADER.unpack_from(header, len(MAGIC))
+		dtype = record_dtype(self.rows, self.cols)
+		if (os.path.getsize(path) - len(header)) % dtype.itemsize:
+			raise InvalidShardError(path)
+		if os.path.getsize(path) == len(header):
+			self.records = numpy.empty(0, dtype = dtype) # empty files can't be mapped
+		else:
+			self.records = numpy.memmap(path, dtype = dtype, mode = "r", offset = len(header))
+
+	def __len__(self) -> int:
+		"""
+		Returns the number of records
+		"""
+		return len(self.records)
+
+	def batch(self, start: int, stop: int) -> Batch:
+		"""
+		Returns records start to stop as a Batch
+		"""
+		return decode(numpy.asarray(self.records[start:stop]), self.rows, self.cols)
+
+
+class Loader:
+	"""
+	ATTRIBUTES:
+	shards, the Shards read, all of one board size
+	rows, cols, their board size
+	batch_size, positions in every minibatch
+	buffer_size, records held in the shuffle buffer
+	augment, True to put every position under a random symmetry
+	epochs, times to go through the shards (None never stops)
+	"""
+
+	def __init__(self, paths: [str], batch_size: int = 256, buffer_size: int = 100000, augment: bool = True,
+			epochs=1, prefetch: int = 4, seed=None):
+		"""
+		Maps the shards. Nothing is read until iteration starts
+		"""
+		self.shards = [Shard(path) for path in paths]
+		sizes = {(shard.rows, shard.cols) for shard in self.shards}
+		if len(sizes) != 1:
+			raise InvalidShardError("shards must all have the same board size, got {}".format(sorted(sizes)))
+		self.rows, self.cols = sizes.pop()
+		self.batch_size = batch_size
+		self.buffer_size = max(buffer_size, batch_size)
+		self.augment = augment
+		self.epochs = epochs
+		self._prefetch = prefetch
+		self._rng = numpy.random.default_rng(seed)
+		self._symmetries = [(numpy.array(gather), numpy.array(scatter))
+			for _, gather, scatter in othello_book.symmetries(self.rows, self.cols)]
+		self._stopped = threading.Event()
+
+	def __len__(self) -> int:
+		"""
+		Returns the number of records over every shard
+		"""
+		return sum(len(shard) for shard in self.shards)
+
+	def _chunks(self) -> "iterator of record arrays":
+		"""
+		Yields the records of every epoch in chunks, in a random order of
+		shards and of chunks within each shard
+		"""
+		epoch = 0
+		while self.epochs == None or epoch < self.epochs:
+			pieces = [(shard, start) for shard in self.shards for start in range(0, len(shard), CHUNK)]
+			for index in self._rng.permutation(len(pieces)):
+				shard, start = pieces[index]
+				yield numpy.array(shard.records[start:start + CHUNK])
+			epoch += 1
+
+	def _batches(self) -> "iterator of record arrays":
+		"""
+		Yields shuffled minibatches of records. Every record waits in the
+		buffer, and each batch takes random ones out and puts new ones in
+		their place. What is left at the end comes out shuffled, with a
+		smaller last batch
+		"""
+		dtype = record_dtype(self.rows, self.cols)
+		buffer = numpy.empty(self.buffer_size, dtype = dtype)
+		filled = 0
+		pending = numpy.empty(0, dtype = dtype)
+		for chunk in self._chunks():
+			pending = numpy.concatenate([pending, chunk])
+			if filled < self.buffer_size:
+				take = min(self.buffer_size - filled, len(pending))
+				buffer[filled:filled + take] = pending[:take]
+				filled += take
+				pending = pending[take:]
+			while filled == self.buffer_size and len(pending) >= self.batch_size:
+				slots = self._rng.choice(self.buffer_size, self.batch_size, replace = False)
+				batch = buffer[slots]
+				buffer[slots] = pending[:self.batch_size]
+				pending = pending[self.batch_size:]
+				yield batch
+
+		left = numpy.concatenate([buffer[:filled], pending])
+		left = left[self._rng.permutation(len(left))]
+		for start in range(0, len(left), self.batch_size):
+			yield left[start:start + self.batch_size]
+
+	def _augment(self, batch: Batch) -> Batch:
+		"""
+		Puts every position of the batch under a random symmetry of the
+		board, moving the policy targets with it
+		"""
+		count = len(batch.moves)
+		flat = batch.boards.reshape(count, -1)
+		moves = batch.moves.copy()
+		picks = self._rng.integers(len(self._symmetries), size = count)
+		for number, (gather, scatter) in enumerate(self._symmetries):
+			chosen = picks == number
+			if number == 0 or not chosen.any():
+				continue # the first symmetry leaves the board as it is
+			flat[chosen] = flat[chosen][:, gather]
+			played = chosen & (moves >= 0)
+			moves[played] = scatter[moves[played]]
+		return batch._replace(boards = flat.reshape(batch.boards.shape), moves = moves)
+
+	def _produce(self, ready: queue.Queue) -> None:
+		"""
+		Runs on the prefetch thread: decodes and augments batches and puts
+		them on ready, then None when the data runs out
+		"""
+		try:
+			for records in self._batches():
+				batch = decode(records, self.rows, self.cols)
+				if self.augment:
+					batch = self._augment(batch)
+				while not self._stopped.is_set():
+					try:
+						ready.put(batch, timeout = 0.1)
+						break
+					except queue.Full:
+						pass
+				if self._stopped.is_set():
+					return
+		finally:
+			ready.put(None)
+
+	def __iter__(self) -> "iterator of Batch":
+		"""
+		Starts the prefetch thread and yields its batches as they are ready
+		"""
+		self._stopped.clear()
+		ready = queue.Queue(self._prefetch + 1)
+		thread = threading.Thread(target = self._produce, args = (ready,), daemon = True)
+		thread.start()
+		try:
+			while True:
+				batch = ready.get()
+				if batch == None:
+					break
+				yield batch
+		finally:
+			self._stopped.set()
+			while thread.is_alive():
+				try:
+					ready.get(timeout = 0.1)
+				except queue.Empty:
+					pass
+
+	def close(self) -> None:
+		"""
+		Stops a running iteration's prefetch thread
+		"""
+		self._stopped.set()
+
+
+############################## MEASURING ##########################
+
+def throughput(loader: Loader, batches: int = 200) -> float:
+	"""
+	Returns minibatches per second out of the loader
+	"""
+	start = time.perf_counter()
+	done = 0
+	for _ in loader:
+		done += 1
+		if done == batches:
+			break
+	return done / (time.perf_counter() - start)
+
+
+def main(argv=None) -> None:
+	"""
+	Writes shards from game files, or measures how fast the loader produces
+	minibatches next to how fast othello_net trains on them
+	"""
+	parser = argparse.ArgumentParser(description = "Packs training positions into shards and streams them back")
+	commands = parser.add_subparsers(dest = "command", required = True)
+	write = commands.add_parser("write", help = "write shards from othello_records or othello_selfplay files")
+	write.add_argument("files", nargs = "+")
+	write.add_argument("--output", required = True, help = "directory for the shards")
+	write.add_argument("--positions", type = int, default = 1000000, help = "records per shard")
+	bench = commands.add_parser("bench", help = "minibatches per second of the loader and the trainer")
+	bench.add_argument("shards", nargs = "+")
+	bench.add_argument("--batch", type = int, default = 256)
+	bench.add_argument("--buffer", type = int, default = 100000)
+	args = parser.parse_args(argv)
+
+	if args.command == "write":
+		import othello_analysis
+
+		games = (game for path in args.files for game in othello_analysis.read_games(path))
+		for path in write_shards(games, args.output, args.positions):
+			print("{}: {} positions".format(path, len(Shard(path))))
+		return
+
+	import othello_net
+
+	loader = Loader(args.shards, args.batch, args.buffer, epochs = None, seed = 0)
+	print("loader: {:.0f} batches/s of {} ({} positions in the shards)".format(throughput(loader),
+		args.batch, len(loader)))
+	net = othello_net.PolicyValueNet()
+	batches = iter(loader)
+	start = time.perf_counter()
+	for _ in range(5):
+		batch = next(batches)
+		net.train_step(othello_net.planes(batch.boards, batch.players), batch.moves, batch.results)
+	print("trainer: {:.1f} batches/s".format(5 / (time.perf_counter() - start)))
+	batches.close()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,314 @@
+"""
+Opt-in instrumentation. enable() wraps the hot methods of othello_logic,
+othello_bitboard, othello_ai and (if given or loaded) othello_GUI with versions
+that count calls and time them, and disable() puts the plain methods back,
+so nothing at all is added to those paths while it is off.
+
+What is collected (in STATS):
+
+	counters  direction_walks (_direction_is_valid calls plus the eight
+	          walks from every empty square in Othello.legal_moves; the
+	          bitboard finds moves with whole-board shifts and adds none),
+	          flips (tiles flipped), legal_move_generations, nodes
+	          (apply_move calls), undos, searches
+	timers    legal_moves, apply_move, undo_move, search by game phase
+	          (search.opening, search.midgame, search.endgame) and canvas
+	          drawing (gui.draw_board, gui.layout, gui.draw_circles)
+
+STATS can be dumped as JSON or as one stats line, printed every few seconds
+by periodic(), and profile() runs anything under cProfile and saves the
+output for pstats or snakeviz.
+"""
+
+import argparse
+import collections
+import contextlib
+import cProfile
+import functools
+import json
+import pstats
+import sys
+import threading
+import time
+
+import othello_ai
+import othello_bitboard
+import othello_endgame
+import othello_logic
+
+
+class Stats:
+	"""
+	ATTRIBUTES:
+	counters, Counter of event name -> times it happened
+	timers, dictionary of timer name -> [calls, total seconds, longest call]
+	started, perf_counter when the stats were last reset
+	"""
+
+	def __init__(self):
+		"""
+		Starts with everything at zero
+		"""
+		self.reset()
+
+	def reset(self) -> None:
+		"""
+		Sets everything back to zero
+		"""
+		self.counters = collections.Counter()
+		self.timers = collections.defaultdict(lambda: [0, 0.0, 0.0])
+		self.started = time.perf_counter()
+
+	def count(self, name: str, amount: int = 1) -> None:
+		"""
+		Adds amount to a counter
+		"""
+		self.counters[name] += amount
+
+	def add_time(self, name: str, seconds: float) -> None:
+		"""
+		Adds one timed call to a timer
+		"""
+		timer = self.timers[name]
+		timer[0] += 1
+		timer[1] += seconds
+		if seconds > timer[2]:
+			timer[2] = seconds
+
+	@contextlib.contextmanager
+	def timer(self, name: str):
+		"""
+		Times the body of a with statement, for timing any phase of a run
+		"""
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add_time(name, time.perf_counter() - start)
+
+	def to_dict(self) -> dict:
+		"""
+		Returns the counters and timers (in milliseconds) as a dictionary
+		"""
+		return {
+			"seconds": time.perf_counter() - self.started,
+			"counters": dict(self.counters),
+			"timers": {name: {"calls": calls, "total_ms": total * 1000, "mean_us": total / calls * 1e6 if calls else 0.0,
+				"max_ms": longest * 1000} for name, (calls, total, longest) in self.timers.items()},
+		}
+
+	def to_json(self) -> str:
+		"""
+		Returns to_dict as JSON
+		"""
+		return json.dumps(self.to_dict(), sort_keys = True)
+
+	def line(self) -> str:
+		"""
+		Returns the counters and timer totals as one short line
+		"""
+		parts = ["{}={}".format(name, value) for name, value in sorted(self.counters.items())]
+		parts += ["{}={:.1f}ms".format(name, total * 1000) for name, (_, total, _) in sorted(self.timers.items())]
+		return "stats {:.1f}s: {}".format(time.perf_counter() - self.started, " ".join(parts))
+
+
+STATS = Stats()
+
+_ORIGINALS = [] # (class, name, plain method) of every wrapped method
+
+
+############################## WRAPPERS ##########################
+
+def _counted(method, name: str, amount=None):
+	"""
+	Returns method wrapped to add to a counter on every call, by one or by
+	amount(result)
+	"""
+	@functools.wraps(method)
+	def wrapper(*args, **kwargs):
+		result = method(*args, **kwargs)
+		STATS.count(name, 1 if amount == None else amount(args, result))
+		return result
+	return wrapper
+
+
+def _timed(method, name: str, counter: str = None):
+	"""
+	Returns method wrapped to time every call, and count it if counter
+	is given
+	"""
+	@functools.wraps(method)
+	def wrapper(*args, **kwargs):
+		start = time.perf_counter()
+		try:
+			return method(*args, **kwargs)
+		finally:
+			STATS.add_time(name, time.perf_counter() - start)
+			if counter != None:
+				STATS.count(counter)
+	return wrapper
+
+
+def _timed_search(method):
+	"""
+	Returns AlphaBetaSearch.search wrapped to time it under the phase of the
+	game it was called in
+	"""
+	@functools.wraps(method)
+	def wrapper(self, othello, *args, **kwargs):
+		left = othello_endgame.empties(othello) / (othello.ROWS * othello.COLS)
+		phase = "opening" if left > 0.66 else ("midgame" if left > 0.2 else "endgame")
+		start = time.perf_counter()
+		try:
+			return method(self, othello, *args, **kwargs)
+		finally:
+			STATS.add_time("search." + phase, time.perf_counter() - start)
+			STATS.count("searches")
+	return wrapper
+
+
+def _flipped(args, result) -> int:
+	"""
+	Returns how many tiles a _place call flipped, for either backend
+	"""
+	flips = args[3]
+	return flips.bit_count() if isinstance(flips, int) else len(flips)
+
+
+def _walks(args, result) -> int:
+	"""
+	Returns how many directions an Othello.legal_moves call walked, eight
+	from every empty square
+	"""
+	return 8 * args[0]._counts[0]
+
+
+def _wrap(cls, name: str, wrapper) -> None:
+	"""
+	Replaces a method defined on cls with wrapper(method)
+	"""
+	if name not in cls.__dict__:
+		return
+	method = cls.__dict__[name]
+	_ORIGINALS.append((cls, name, method))
+	setattr(cls, name, wrapper(method))
+
+
+def enabled() -> bool:
+	"""
+	Returns True if instrumentation is on
+	"""
+	return bool(_ORIGINALS)
+
+
+def enable(gui_class=None) -> None:
+	"""
+	Turns instrumentation on. The GUI's drawing is timed on gui_class, or
+	on othello_GUI's class if that module has been imported. When the GUI
+	runs as a script it is __main__, so it has to pass its class in
+	"""
+	if enabled():
+		return
+	for cls in (othello_logic.Othello, othello_bitboard.BitboardOthello):
+		_wrap(cls, "_direction_is_valid", lambda method: _counted(method, "direction_walks"))
+		_wrap(cls, "_place", lambda method: _counted(method, "flips", _flipped))
+		_wrap(cls, "legal_moves", lambda method: _timed(method, "legal_moves", "legal_move_generations"))
+		_wrap(cls, "apply_move", lambda method: _timed(method, "apply_move", "nodes"))
+		_wrap(cls, "undo_move", lambda method: _timed(method, "undo_move", "undos"))
+	_wrap(othello_logic.Othello, "legal_moves", lambda method: _counted(method, "direction_walks", _walks))
+	_wrap(othello_ai.AlphaBetaSearch, "search", _timed_search)
+
+	if gui_class == None and sys.modules.get("othello_GUI") != None:
+		gui_class = sys.modules["othello_GUI"].othello_GUI
+	if gui_class != None:
+		for name in ("_draw_board", "_layout", "_draw_circles"):
+			_wrap(gui_class, name, lambda method, name=name: _timed(method, "gui." + name.strip("_")))
+
+
+def disable() -> None:
+	"""
+	Turns instrumentation off, putting every plain method back
+	"""
+	while _ORIGINALS:
+		cls, name, method = _ORIGINALS.pop()
+		setattr(cls, name, method)
+
+
+def periodic(seconds: float = 5.0, output=sys.stderr) -> "function that stops it":
+	"""
+	Prints STATS.line() to output every few seconds from a background
+	thread. Returns a function that stops it
+	"""
+	stopped = threading.Event()
+
+	def run() -> None:
+		while not stopped.wait(seconds):
+			print(STATS.line(), file = output, flush = True)
+
+	threading.Thread(target = run, daemon = True).start()
+	return stopped.set
+
+
+def profile(function, *args, path: str = "othello.prof", top: int = 0, **kwargs):
+	"""
+	Runs function(*args, **kwargs) under cProfile, saves the profile to path
+	and returns what the function returned. Prints the top most expensive
+	calls by cumulative time if top is given
+	"""
+	profiler = cProfile.Profile()
+	try:
+		return profiler.runcall(function, *args, **kwargs)
+	finally:
+		profiler.dump_stats(path)
+		if top:
+			pstats.Stats(path, stream = sys.stderr).sort_stats("cumulative").print_stats(top)
+
+
+############################## COMMAND LINE ##########################
+
+def _sample_game(rows: int, cols: int, max_nodes: int, backend) -> None:
+	"""
+	Plays one game of the AI against itself, as a workload to measure
+	"""
+	othello = backend(rows, cols, "B", ">", othello_logic.starting_board(rows, cols))
+	search = othello_ai.AlphaBetaSearch(max_time = None, max_nodes = max_nodes)
+	while True:
+		if not othello.legal_moves():
+			if not othello.legal_moves(3 - othello.current_player):
+				break
+			othello.apply_pass()
+			continue
+		move = search.search(othello).move
+		othello.apply_move(move[0], move[1])
+
+
+def main(argv=None) -> None:
+	"""
+	Plays an instrumented sample game and prints the stats
+	"""
+	parser = argparse.ArgumentParser(description = "Measures where an Othello game spends its time")
+	parser.add_argument("--size", default = "8x8")
+	parser.add_argument("--nodes", type = int, default = 2000, help = "search nodes per move")
+	parser.add_argument("--backend", choices = ["list", "bitboard"], default = "list")
+	parser.add_argument("--profile", default = None, help = "also save a cProfile to this file")
+	parser.add_argument("--every", type = float, default = None, help = "print a stats line this often")
+	args = parser.parse_args(argv)
+
+	rows, cols = (int(size) for size in args.size.lower().split("x"))
+	backend = othello_logic.Othello if args.backend == "list" else othello_bitboard.BitboardOthello
+	enable()
+	stop = periodic(args.every) if args.every else None
+	try:
+		if args.profile:
+			profile(_sample_game, rows, cols, args.nodes, backend, path = args.profile, top = 15)
+		else:
+			_sample_game(rows, cols, args.nodes, backend)
+	finally:
+		if stop != None:
+			stop()
+		disable()
+	print(json.dumps(STATS.to_dict(), indent = 1, sort_keys = True))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,183 @@
+"""
+Fixed size transposition table keyed by Othello.get_hash(). Entries are packed
+into one flat buffer, so the memory used is decided up front and never grows
+no matter how long a search runs.
+"""
+
+import struct
+
+EXACT = 1
+LOWER = 2 # score is at least this much (failed high)
+UPPER = 3 # score is at most this much (failed low)
+
+NO_MOVE = 0xFFFF
+
+# key, score, move square, depth, flag in the low 2 bits and generation above
+ENTRY = struct.Struct("<QiHBB")
+
+
+class TranspositionTable:
+	"""
+	ATTRIBUTES:
+	size, number of entries (a power of two)
+	generation, bumped by new_search so old entries get replaced first
+	hits, probes that found the position
+	misses, probes that found an empty slot
+	collisions, probes that found a different position in the slot
+	stores, entries written
+	overwrites, stores that replaced a different position
+	"""
+
+	def __init__(self, size_mb: float = 16, buffer=None):
+		"""
+		Makes a table using about size_mb megabytes. If buffer is given (a
+		writable bytes-like object, like shared memory) the entries live in it
+		and size_mb is ignored
+		"""
+		if buffer == None:
+			entries = max(1, int(size_mb * 1024 * 1024) // ENTRY.size)
+		else:
+			entries = len(buffer) // ENTRY.size
+		self.size = 1 << (entries.bit_length() - 1) # round down to a power of two
+		self._mask = self.size - 1
+		self._buffer = bytearray(self.size * ENTRY.size) if buffer == None else buffer
+		self.generation = 0
+		self.hits = 0
+		self.misses = 0
+		self.collisions = 0
+		self.stores = 0
+		self.overwrites = 0
+
+	def clear(self) -> None:
+		"""
+		Empties every entry and resets the statistics
+		"""
+		self._buffer[:self.size * ENTRY.size] = bytes(self.size * ENTRY.size)
+		self.generation = 0
+		self.hits = 0
+		self.misses = 0
+		self.collisions = 0
+		self.stores = 0
+		self.overwrites = 0
+
+	def new_search(self) -> None:
+		"""
+		Marks the start of a new search. Entries from earlier searches stay
+		usable but are the first to be replaced
+		"""
+		self.generation = (self.generation + 1) & 0x3F
+
+	def probe(self, key: int) -> ("score", "depth", "flag", "move") or None:
+		"""
+		Returns (score, depth, flag, move) stored for the position, or None if
+		it isn't in the table
+		"""
+		stored, score, move, depth, info = ENTRY.unpack_from(self._buffer, (key & self._mask) * ENTRY.size)
+		if info & 3 == 0:
+			self.misses += 1
+			return None
+		if stored != key:
+			self.collisions += 1
+			return None
+		self.hits += 1
+		return (score, depth, info & 3, move)
+
+	def store(self, key: int, score: int, depth: int, flag: int, move: int = NO_MOVE) -> None:
+		"""
+		Stores a search result. A slot written during the current search is
+		only replaced by a result searched at least as deep
+		"""
+		offset = (key & self._mask) * ENTRY.size
+		stored, _, stored_move, stored_depth, info = ENTRY.unpack_from(self._buffer, offset)
+		if info & 3 != 0:
+			if info >> 2 == self.generation and stored_depth > depth:
+				return
+			if stored != key:
+				self.overwrites += 1
+			elif move == NO_MOVE:
+				move = stored_move # keep the old best move to order with
+		self.stores += 1
+		ENTRY.pack_into(self._buffer, offset, key, score, move, min(depth, 255),
+			flag | (self.generation << 2))
+
+	def used(self) -> int:
+		"""
+		Returns how many slots hold an entry, by scanning the whole table
+		"""
+		count = 0
+		for offset in range(ENTRY.size - 1, self.size * ENTRY.size, ENTRY.size):
+			if self._buffer[offset] & 3 != 0:
+				count += 1
+		return count
+
+	def stats(self) -> dict:
+		"""
+		Returns the counters along with hit, miss and collision rates (out of
+		all probes) so the table can be sized
+		"""
+		probes = self.hits + self.misses + self.collisions
+		return {
+			"entries": self.size,
+			"bytes": self.size * ENTRY.size,
+			"probes": probes,
+			"hits": self.hits,
+			"misses": self.misses,
+			"collisions": self.collisions,
+			"hit_rate": self.hits / probes if probes else 0.0,
+			"miss_rate": self.misses / probes if probes else 0.0,
+			"collision_rate": self.collisions / probes if probes else 0.0,
+			"stores": self.stores,
+			"overwrites": self.overwrites,
+		}
+
+
+class SharedTranspositionTable(TranspositionTable):
+	"""
+	TranspositionTable for a buffer several processes write to at once, like
+	multiprocessing.shared_memory. Nothing is locked, instead the key is
+	stored XORed with the rest of the entry, so an entry torn by two
+	processes writing the same slot together no longer matches its key and
+	reads as a collision rather than as a wrong score
+	"""
+
+	def probe(self, key: int) -> ("score", "depth", "flag", "move") or None:
+		"""
+		Returns (score, depth, flag, move) stored for the position, or None if
+		it isn't in the table or the slot is torn
+		"""
+		check, score, move, depth, info = ENTRY.unpack_from(self._buffer, (key & self._mask) * ENTRY.size)
+		if info & 3 == 0:
+			self.misses += 1
+			return None
+		if check ^ _data(score, move, depth, info) != key:
+			self.collisions += 1
+			return None
+		self.hits += 1
+		return (score, depth, info & 3, move)
+
+	def store(self, key: int, score: int, depth: int, flag: int, move: int = NO_MOVE) -> None:
+		"""
+		Stores a search result with the same replacement rule as
+		TranspositionTable.store
+		"""
+		offset = (key & self._mask) * ENTRY.size
+		check, stored_score, stored_move, stored_depth, info = ENTRY.unpack_from(self._buffer, offset)
+		if info & 3 != 0:
+			if info >> 2 == self.generation and stored_depth > depth:
+				return
+			if check ^ _data(stored_score, stored_move, stored_depth, info) != key:
+				self.overwrites += 1
+			elif move == NO_MOVE:
+				move = stored_move
+		self.stores += 1
+		depth = min(depth, 255)
+		info = flag | (self.generation << 2)
+		ENTRY.pack_into(self._buffer, offset, key ^ _data(score, move, depth, info), score, move, depth, info)
+
+
+def _data(score: int, move: int, depth: int, info: int) -> int:
+	"""
+	Returns the last 8 bytes of an entry as one number, the way they are
+	packed
+	"""
+	return (score & 0xFFFFFFFF) | (move << 32) | (depth << 48) | (info << 56)
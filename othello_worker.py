@@ -0,0 +1,115 @@
+"""
+Runs othello_ai searches in a separate process so whoever asked for them
+(like the tkinter GUI) keeps running while the computer thinks, even through
+a long search on a 16x16 board. The process stays up between searches and
+keeps its transposition table, so a ponder search on the opponent's time
+leaves work behind for the next real one.
+
+Searches are numbered. poll() only hands back the result of the latest
+search, and cancel() tells the running search to stop early, so a result
+that arrives after the position changed is never used.
+"""
+
+import multiprocessing
+
+import othello_ai
+import othello_bitboard
+import othello_tt
+
+TT_MB = 32
+AI_SECONDS = 2.0 # default thinking time
+
+
+def _serve(connection, cancelled) -> None:
+	"""
+	Runs in the worker process: searches every position sent over
+	connection and sends back (job, SearchResult) until it gets None
+	"""
+	tt = othello_tt.TranspositionTable(TT_MB)
+	while True:
+		message = connection.recv()
+		if message == None:
+			break
+		job, position, max_time = message
+		if cancelled.value >= job:
+			continue # cancelled before it started
+		othello = othello_bitboard.BitboardOthello.from_bytes(position)
+		search = othello_ai.AlphaBetaSearch(max_time = max_time, tt = tt,
+			stop = lambda: cancelled.value >= job)
+		connection.send((job, search.search(othello)))
+
+
+class SearchWorker:
+	"""
+	ATTRIBUTES:
+	job, number of the latest search started (0 before the first)
+	busy, True from start until its result is polled or it is cancelled
+	"""
+
+	def __init__(self):
+		"""
+		Sets up the worker, the process starts with the first search
+		"""
+		self.job = 0
+		self.busy = False
+		self._process = None
+		self._connection = None
+		self._cancelled = None
+
+	def _launch(self) -> None:
+		"""
+		Starts the worker process
+		"""
+		self._connection, child = multiprocessing.Pipe()
+		self._cancelled = multiprocessing.Value("q", self.job, lock = False)
+		self._process = multiprocessing.Process(target = _serve, args = (child, self._cancelled), daemon = True)
+		self._process.start()
+
+	def start(self, othello, max_time=AI_SECONDS) -> int:
+		"""
+		Cancels any running search and starts searching othello's position
+		for its current player, for max_time seconds (None searches until
+		cancelled, for pondering). Returns the search's number
+		"""
+		if self._process == None or not self._process.is_alive():
+			self._launch()
+		self.cancel()
+		self.job += 1
+		self._connection.send((self.job, othello.to_bytes(), max_time))
+		self.busy = True
+		return self.job
+
+	def poll(self) -> othello_ai.SearchResult:
+		"""
+		Returns the result of the latest search if it is done, otherwise
+		None. Never waits, results of older searches are thrown away
+		"""
+		if self._connection == None:
+			return None
+		while self._connection.poll():
+			job, result = self._connection.recv()
+			if job == self.job and self.busy:
+				self.busy = False
+				return result
+		return None
+
+	def cancel(self) -> None:
+		"""
+		Stops the running search, its result will never be returned
+		"""
+		if self._cancelled != None:
+			self._cancelled.value = self.job
+		self.busy = False
+
+	def close(self) -> None:
+		"""
+		Stops the worker process
+		"""
+		if self._process != None and self._process.is_alive():
+			self.cancel()
+			self._connection.send(None)
+			self._process.join(1)
+			if self._process.is_alive():
+				self._process.terminate()
+		self._process = None
+		self._connection = None
@@ -0,0 +1,26 @@
+"""
+Checks that othello_analysis scores the best and the played move the same
+way, so losses are counted in discs. Run with python -m pytest
+"""
+
+import othello_ai
+import othello_analysis
+import othello_patterns
+import othello_selfplay
+
+
+def test_losses_stay_in_discs():
+	"""
+	No move near the endgame horizon loses WIN_SCORE just because the best
+	move was searched and the played one solved
+	"""
+	specs = othello_selfplay.game_specs(4, [(8, 8)], ["B", "W"], [">", "<"], seed = 0)
+	search = othello_analysis.make_search()
+	for spec in specs:
+		game = othello_patterns._as_game(othello_selfplay.play_game(spec))
+		lines = list(othello_analysis.analyse_game(game, search, depth = 2))
+		for line in lines[:-1]:
+			assert 0 <= line["loss"] < othello_ai.WIN_SCORE
+			if line["exact"]:
+				assert line["loss"] <= game.rows * game.cols * 2
+		assert max(lines[-1]["loss"].values()) < othello_ai.WIN_SCORE
@@ -0,0 +1,64 @@
+"""
+Checks that othello_bitboard.BitboardOthello plays exactly like the list
+board: seeded random games are replayed on both backends, comparing boards,
+piece counts, legal moves with their flips and Zobrist hashes after every
+move. Run with python -m pytest
+"""
+
+import random
+
+import pytest
+
+import othello_bitboard
+import othello_logic
+
+SIZES = [(rows, cols) for rows in range(4, 17, 2) for cols in range(4, 17, 2)]
+
+
+@pytest.mark.parametrize("rows, cols", SIZES)
+def test_parity(rows, cols):
+	"""
+	Random games on one board size agree move by move
+	"""
+	othello_bitboard.parity_check(games = 4, seed = rows * 100 + cols, sizes = [(rows, cols)])
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_replayed_game(seed):
+	"""
+	A seeded 8x8 game gives the same moves, flips, hashes and snapshots
+	"""
+	rng = random.Random(seed)
+	board = othello_logic.starting_board(8, 8)
+	lists = othello_logic.Othello(8, 8, "B", ">", board)
+	bits = othello_bitboard.BitboardOthello(8, 8, "B", ">", board)
+	while True:
+		moves = lists.legal_moves()
+		assert dict(bits.legal_moves().items()) == moves
+		assert lists.get_hash() == bits.get_hash()
+		assert lists.to_bytes() == bits.to_bytes()
+		if not moves:
+			if not lists.legal_moves(3 - lists.current_player):
+				break
+			lists.apply_pass()
+			bits.apply_pass()
+			continue
+		move = rng.choice(sorted(moves))
+		lists.apply_move(*move)
+		bits.apply_move(*move)
+	assert lists.find_winner() == bits.find_winner()
+
+
+def test_legal_moves_keep_their_position():
+	"""
+	Flips looked up after a move are still the ones from when legal_moves
+	was called
+	"""
+	bits = othello_bitboard.BitboardOthello(8, 8, "B", ">", othello_logic.starting_board(8, 8))
+	moves = bits.legal_moves()
+	before = {move: bits.placement_is_valid(*move) for move in moves}
+	bits.apply_move(*sorted(moves)[0])
+	assert {move: moves[move] for move in moves} == before
+	assert len(moves) == len(before) and all(move in moves for move in before)
+	with pytest.raises(KeyError):
+		moves[(0, 0)]
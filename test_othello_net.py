@@ -0,0 +1,13 @@
+"""
+Checks othello_net's backward pass against numerical gradients. Run with
+python -m pytest
+"""
+
+import othello_net
+
+
+def test_gradients():
+	"""
+	train_step's gradients match finite differences in float64
+	"""
+	assert othello_net._gradient_check() < othello_net.GRADIENT_TOLERANCE
@@ -0,0 +1,21 @@
+"""
+Checks that othello_selfplay's per-game seeds give different games for
+every player, and the same game again for the same seed. Run with
+python -m pytest
+"""
+
+import pytest
+
+import othello_selfplay
+
+
+@pytest.mark.parametrize("player", ["random", "alphabeta"])
+def test_seeds_give_different_games(player):
+	"""
+	Different seeds play different games, the same seed the same game
+	"""
+	specs = othello_selfplay.game_specs(6, [(6, 6)], ["B"], [">"], seed = 0)
+	games = [othello_selfplay.play_game(spec, player, max_nodes = 200)["moves"] for spec in specs]
+	assert len({str(moves) for moves in games}) == len(games)
+	assert othello_selfplay.play_game(specs[0], player, max_nodes = 200)["moves"] == games[0]
+